@@ -136,6 +136,7 @@ class Booth(tk.Frame):
             self.task.auto_save_loop = None
             self.task.response_loop = None
             self.task.wait_loop = None
+            self.task.close()
             for reference in gc.get_referrers(self.task):
                 print(f"\n{reference}\n")
         self.rat = rat
@@ -252,6 +253,43 @@ class ResponsePlot(BoothPlot):
         self.fig.tight_layout()
 
 
+class PsiPlot(BoothPlot):
+    """Posterior psychometric curve (mean +- SD) and threshold estimate per trial of a PsiMarginal.Psi staircase.
+
+    Only reads the summaries Psi keeps after each update, and redraws lazily, so it is cheap to update every trial.
+    """
+    def __init__(self, notebook, stim_range, stim_label="Stimulus", title="Psi", figsize=(4, 2)):
+        super().__init__(notebook, title=title, figsize=figsize)
+        self.stim_range = np.asarray(stim_range)
+        self.curve_plot = self.fig.add_subplot(121, xlabel=stim_label, ylabel="p(Response)")
+        self.curve_plot.set_xlim(self.stim_range[0], self.stim_range[-1])
+        self.curve_plot.set_ylim(-0.05, 1.05)
+        self.curve_line, = self.curve_plot.plot(self.stim_range, np.full(len(self.stim_range), np.nan), "k")
+        self.curve_band = self.curve_plot.fill_between(self.stim_range, 0, 0, alpha=0.2, color="k")
+        self.response_points, = self.curve_plot.plot([], [], "o", color="xkcd:green", ms=2)
+        self.threshold_plot = self.fig.add_subplot(122, xlabel="Trial", ylabel="Threshold")
+        self.threshold_plot.set_ylim(self.stim_range[0], self.stim_range[-1])
+        self.threshold_line, = self.threshold_plot.plot([], [], "k")
+        self.threshold_band = self.threshold_plot.fill_between([], [], [], alpha=0.2, color="k")
+        self.fig.tight_layout()
+
+    def update(self, psi):
+        self.curve_line.set_ydata(psi.postMean)
+        self.curve_band.remove()
+        self.curve_band = self.curve_plot.fill_between(self.stim_range, psi.postMean - psi.postStd,
+                                                       psi.postMean + psi.postStd, alpha=0.2, color="k")
+        self.response_points.set_data(psi.stim, psi.response)
+
+        threshold, threshold_sd = np.reshape(psi.thresholdTrace, (-1, 2)).T
+        trials = np.arange(len(threshold))
+        self.threshold_line.set_data(trials, threshold)
+        self.threshold_band.remove()
+        self.threshold_band = self.threshold_plot.fill_between(trials, threshold - threshold_sd,
+                                                               threshold + threshold_sd, alpha=0.2, color="k")
+        self.threshold_plot.set_xlim(0, max(len(trials) - 1, 1))
+        self.canvas.draw_idle()
+
+
 class TestClient(tk.Frame):
     def __init__(self, parent, booth_num):
         super().__init__()
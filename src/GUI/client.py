@@ -115,6 +115,7 @@ class Client(tk.Frame):
         self.rat_signals = {}
         self.running_signals = {}
         self.session_status_signals = {}
+        self.psi_diagnostics_signals = {}
         for booth in self.booth_info.keys():
             self.booth_buttons[booth] = tk.Button(self.frame, text=f"Open booth {booth}",
                                                   command=partial(self.open_booth, booth))
@@ -127,6 +128,8 @@ class Client(tk.Frame):
             self.running_signals[booth].connect(self.handle_running)
             self.session_status_signals[booth] = blinker.signal(f"Status_{booth}")
             self.session_status_signals[booth].connect(self.handle_session_status)
+            self.psi_diagnostics_signals[booth] = blinker.signal(f"PsiDiagnostics_{booth}")
+            self.psi_diagnostics_signals[booth].connect(self.handle_psi_diagnostics)
 
         self.quit_button = tk.Button(self.frame, text='Quit!', command=self.quit)
         self.quit_button.pack()
@@ -211,6 +214,9 @@ class Client(tk.Frame):
     def handle_session_status(self, _sender, status_dict):
         self.router_session.publish("server.session_status", status_dict)
 
+    def handle_psi_diagnostics(self, sender, record):
+        self.router_session.publish("server.psi_diagnostics", sender, record)
+
     def add_comment(self, booth_num):
         # TODO
         if booth_num in self.booth_info:
@@ -103,6 +103,8 @@ class Server(tk.Frame):
         self.booth_pause_buttons = {}
         self.booth_comment_buttons = {}
         self.booth_last_activity_labels = {}
+        self.psi_diagnostics = {}  # booth -> records of the Psi updates of its current session
+        self.recent_performance = {}  # booth -> performance over its last trials, see RollingStats.summary
         self.booth_test_func_buttons = {}
         self.booth_weight_labels = {}  # TODO
         for idx, booth in enumerate(self.sessions["Booth"].unique()):
@@ -167,6 +169,7 @@ class Server(tk.Frame):
         yield self.router_session.subscribe(self.update_rat, "server.select_rat")
         yield self.router_session.subscribe(self.update_booth, "server.refresh_booth")
         yield self.router_session.subscribe(self.update_running, "server.running_status")
+        yield self.router_session.subscribe(self.update_psi_diagnostics, "server.psi_diagnostics")
 
     @inlineCallbacks
     def __left(self, _details, _was_clean):
@@ -282,10 +285,22 @@ class Server(tk.Frame):
         self.booth_pellet_labels[booth_num].configure(text=f"Pellet: {status_dict['Pellet']}")
         self.booth_sound_labels[booth_num].configure(text=f"Sound: {status_dict['Sound']}")
         self.booth_percent_labels[booth_num].configure(text=f"{status_dict['Percent']:.1f}% correct")
+        if "Recent" in status_dict:
+            recent = status_dict["Recent"]
+            self.recent_performance[booth_num] = recent
+            self.booth_percent_labels[booth_num].configure(
+                text=f"{status_dict['Percent']:.1f}% correct ({recent['% Correct']:.1f}% last {recent['Trials']})")
         self.booth_attempt_labels[booth_num].configure(text=f"Attempt: {status_dict['Attempt']}")
         self.booth_daily_labels[booth_num].configure(text=f"Session: {status_dict['Session']}")
         self.update_last_active(booth_num)
 
+    def update_psi_diagnostics(self, booth_num, record):
+        # One record per Psi update, see PsiMarginal.Psi. A new session starts again from trial 1
+        if record["trial"] == 1 or booth_num not in self.psi_diagnostics:
+            self.psi_diagnostics[booth_num] = []
+        self.psi_diagnostics[booth_num].append(record)
+        self.update_last_active(booth_num)
+
     def update_last_active(self, booth_num):
         last_active = datetime.now().strftime("%H:%M")
         self.booth_last_activity_labels[booth_num].configure(text=f"Last active: {last_active}")
@@ -1,12 +1,13 @@
-import pickle
 from tdt import DSPCircuit
 from pathlib import Path
-from tasks import task, utility_funcs, PsiMarginal
+from tasks import task, PsiMarginal, psi_grids
 import pandas as pd
 import numpy as np
 import time
+import asyncio
+import blinker
 import tkinter as tk
-from psychopy.data import QuestPlusHandler
+from twisted.internet.defer import inlineCallbacks, Deferred
 import datetime
 from scipy.io import wavfile
 
@@ -81,6 +82,7 @@ class ToneShapingTask(task.GoNoGoTask):
         time.sleep(0.01)
         self.booth.client.board.digital[self.booth.booth_info["Pellet Trigger"]].write(0)
         self.num_pellets += 1
+        self.journal.write("Pellet", Pellets=self.num_pellets)
         self.end_trial()
 
     def update_plots(self):
@@ -114,6 +116,21 @@ class ToneDetectionTask(task.GoNoGoTask):
         self.cs_plus = [{"Name": "2000 Hz", "Weight": 0.5, "Freq": 2000, "Int": 60}]
         self.silence = [{"Name": "Silence", "Weight": 0.5}]
 
+        # Rapid adapt tasks skip to the standard task once % correct over the last window trials reaches this, given
+        # as (window, % correct) with window one of rolling_stats.windows. None to only adapt by session time
+        self.rapid_adapt_criterion = None
+        self.rapid_adapt_met = False
+
+    def adapt_minutes(self):
+        # Session minutes that set the rapid adapt phase, at least 40 (standard task) once rapid_adapt_criterion is met
+        if self.rapid_adapt_criterion and not self.rapid_adapt_met:
+            window, percent_correct = self.rapid_adapt_criterion
+            self.rapid_adapt_met = (self.rolling_stats.n_trials >= window and
+                                    self.rolling_stats.percent_correct(window) >= percent_correct)
+        if self.rapid_adapt_met:
+            return max(self.session_time[0], 40)
+        return self.session_time[0]
+
     def prep_trial(self):
         # Randomly select trial sound based on weighted probability
         sound_list = [*self.cs_plus, *self.cs_minus, *self.silence]
@@ -146,8 +163,9 @@ class RapidAdaptToneDetectionTask(ToneDetectionTask):
     def prep_trial(self):
         # Adjust hit window, trial, and timeout durations as session goes on
         # Adjust sound presentation weights as session goes on
+        minutes = self.adapt_minutes()
 
-        if 10 <= self.session_time[0] < 20:
+        if 10 <= minutes < 20:
             self.timeout_length = 3.0
             self.misses_before_break = 15
 
@@ -155,7 +173,7 @@ class RapidAdaptToneDetectionTask(ToneDetectionTask):
             self.cs_plus = [{"Name": "2000 Hz", "Weight": 0.7, "Freq": 2000, "Int": 60}]
             self.silence = [{"Name": "Silence", "Weight": 0.3}]
 
-        elif 20 <= self.session_time[0] < 30:
+        elif 20 <= minutes < 30:
             self.hit_win_dur = 4000
             self.trial_interval = (self.hit_win_dur + self.hit_win_start) / 1000
             self.misses_before_break = 10
@@ -164,12 +182,12 @@ class RapidAdaptToneDetectionTask(ToneDetectionTask):
             self.cs_plus = [{"Name": "2000 Hz", "Weight": 0.6, "Freq": 2000, "Int": 60}]
             self.silence = [{"Name": "Silence", "Weight": 0.4}]
 
-        elif 30 <= self.session_time[0] < 40:
+        elif 30 <= minutes < 40:
             self.hit_win_dur = 5000
             self.trial_interval = (self.hit_win_dur + self.hit_win_start) / 1000
             self.timeout_length = 5.0
 
-        elif 40 <= self.session_time[0]:  # Standard task
+        elif 40 <= minutes:  # Standard task
             self.hit_win_dur = 6000
             self.trial_interval = 8.0
             self.timeout_length = 6.0
@@ -210,8 +228,9 @@ class RapidAdaptEasyToneDiscriminationTask(EasyToneDiscriminationTask):
     def prep_trial(self):
         # Adjust hit window, trial, and timeout durations as session goes on
         # Adjust sound presentation weights as session goes on
+        minutes = self.adapt_minutes()
 
-        if 10 <= self.session_time[0] < 20:
+        if 10 <= minutes < 20:
             self.timeout_length = 3.0
             self.misses_before_break = 15
 
@@ -219,7 +238,7 @@ class RapidAdaptEasyToneDiscriminationTask(EasyToneDiscriminationTask):
             self.cs_plus = [{"Name": "2000 Hz", "Weight": 0.28, "Freq": 2000, "Int": 60}]
             self.cs_minus = [{"Name": "11314 Hz", "Weight": 0.72, "Freq": 11314, "Int": 60}]
 
-        elif 20 <= self.session_time[0] < 30:
+        elif 20 <= minutes < 30:
             self.trial_interval = 4.0
             self.misses_before_break = 10
 
@@ -227,7 +246,7 @@ class RapidAdaptEasyToneDiscriminationTask(EasyToneDiscriminationTask):
             self.cs_plus = [{"Name": "2000 Hz", "Weight": 0.33, "Freq": 2000, "Int": 60}]
             self.cs_minus = [{"Name": "11314 Hz", "Weight": 0.67, "Freq": 11314, "Int": 60}]
 
-        elif 30 <= self.session_time[0] < 40:
+        elif 30 <= minutes < 40:
             self.trial_interval = 5.0
             self.timeout_length = 5.0
 
@@ -235,7 +254,7 @@ class RapidAdaptEasyToneDiscriminationTask(EasyToneDiscriminationTask):
             self.silence = [{"Name": "Silence", "Weight": 0.17}]
             self.cs_minus = [{"Name": "11314 Hz", "Weight": 0.5, "Freq": 11314, "Int": 60}]
 
-        elif 40 <= self.session_time[0]:  # Standard task
+        elif 40 <= minutes:  # Standard task
             self.trial_interval = 8.0
             self.timeout_length = 6.0
             self.misses_before_break = 5
@@ -283,8 +302,9 @@ class RapidAdaptToneDiscriminationTask(ToneDiscriminationTask):
     def prep_trial(self):
         # Adjust hit window, trial, and timeout durations as session goes on
         # Adjust sound presentation weights as session goes on
+        minutes = self.adapt_minutes()
 
-        if 10 <= self.session_time[0] < 20:
+        if 10 <= minutes < 20:
             self.timeout_length = 3.0
             self.misses_before_break = 15
 
@@ -299,7 +319,7 @@ class RapidAdaptToneDiscriminationTask(ToneDiscriminationTask):
                 {"Name": "11314 Hz", "Weight": 0.0, "Freq": 11314, "Int": 60},
             ]
 
-        elif 20 <= self.session_time[0] < 30:
+        elif 20 <= minutes < 30:
             self.trial_interval = 4.0
             self.misses_before_break = 10
 
@@ -311,7 +331,7 @@ class RapidAdaptToneDiscriminationTask(ToneDiscriminationTask):
                 {"Name": "4000 Hz", "Weight": 0.1, "Freq": 4000, "Int": 60},
                 {"Name": "11314 Hz", "Weight": 0.0, "Freq": 11314, "Int": 60},
             ]
-        elif 30 <= self.session_time[0] < 40:
+        elif 30 <= minutes < 40:
             self.trial_interval = 5.0
             self.timeout_length = 5.0
 
@@ -325,7 +345,7 @@ class RapidAdaptToneDiscriminationTask(ToneDiscriminationTask):
                 {"Name": "4000 Hz", "Weight": 0.1, "Freq": 4000, "Int": 60},
                 {"Name": "11314 Hz", "Weight": 0.1, "Freq": 11314, "Int": 60},
             ]
-        elif 40 <= self.session_time[0]:  # Standard task
+        elif 40 <= minutes:  # Standard task
             self.trial_interval = 8.0
             self.timeout_length = 6.0
             self.misses_before_break = 5
@@ -361,7 +381,7 @@ class QuestDiscriminationTask(ToneDetectionTask):
 
         self.cs_plus = [{"Name": "2000 Hz", "Weight": 0.45, "Freq": 2000, "Int": 60}]
         self.silence = [{"Name": "Silence", "Weight": 0.1}]
-        self.quest_handler = QuestPlusHandler(
+        self.quest_handler = PsiMarginal.QuestPlus(
             nTrials=200,
             intensityVals=self.cs_minus_freqs,
             thresholdVals=self.cs_minus_freqs,
@@ -370,10 +390,14 @@ class QuestDiscriminationTask(ToneDetectionTask):
             lapseRateVals=np.linspace(0, 0.2, 11),
             responseVals=[1, 0],
             stimScale="linear",
+            cacheDir=psi_grids.PSI_CACHE_PATH,
+            speculate=psi_grids.PSI_SPECULATE,
+            chunkSize=5,  # keeps the search workspace of the 247500-point grid at ~20 MB
         )
         cs_minus_freq = self.quest_handler.next()
         self.cs_minus = [{"Name": f"{cs_minus_freq} Hz", "Weight": 0.45, "Freq": cs_minus_freq, "Int": 60}]
 
+    @inlineCallbacks
     def prep_trial(self):
         # Check if last sound was a CS-. If so, update QUEST+ and select new CS-
         if self.trial_sound in self.cs_minus:
@@ -381,102 +405,44 @@ class QuestDiscriminationTask(ToneDetectionTask):
                 self.quest_handler.addResponse(1)
             else:
                 self.quest_handler.addResponse(0)
+            self.journal.write("Staircase", Stim=self.quest_handler.psi.stim[-1],
+                               Response=self.quest_handler.psi.response[-1])
 
-        try:
-            cs_minus_freq = self.quest_handler.next()
+        # Wait for the QUEST+ worker without blocking the reactor. Once QUEST+ is finished, keep the last CS-
+        if not self.quest_handler.finished:
+            cs_minus_freq = yield Deferred.fromFuture(asyncio.wrap_future(self.quest_handler.psi.nextStim))
             self.cs_minus = [{"Name": f"{cs_minus_freq} Hz", "Weight": 0.45, "Freq": cs_minus_freq, "Int": 60}]
-        except StopIteration:
-            pass
 
         # Run normal prep
         super().prep_trial()
 
     def save(self, temp=False, filepath=None, filename=None):
-        # Pickle Quest object
+        # Save QUEST+ state if end of session, load with PsiMarginal.QuestPlus.load
         if not temp:
             quest_filepath = Path(__file__).parent / "../../data/quest/"
             quest_filepath.mkdir(parents=True, exist_ok=True)
             today = datetime.datetime.now().strftime("%Y-%m-%d")
             session_num = 1
-            quest_filename = f"{self.booth.rat}_{today}_Session-{session_num}.pickle"
+            quest_filename = f"{self.booth.rat}_{today}_Session-{session_num}.npz"
             while Path.is_file(quest_filepath / quest_filename):
                 session_num += 1
-                quest_filename = f"{self.booth.rat}_{today}_Session-{session_num}.pickle"
-            self.quest_handler.saveAsPickle(str(quest_filepath / quest_filename), fileCollisionMethod="overwrite")
+                quest_filename = f"{self.booth.rat}_{today}_Session-{session_num}.npz"
+            self.quest_handler.save(quest_filepath / quest_filename)
 
         super().save(temp=temp, filepath=filepath, filename=filename)
 
-    def update_session_data(self):
-        # TODO Temporary overwriting so program doesn't complain about unknown CS-'s
-        if self.session_data.empty:  # Handle first trial special to set up columns and values
-            data_dict = {}
-            for sound in ["CS+", "CS-", *self.cs_plus, *self.cs_minus_freqs, *self.silence]:
-                if isinstance(sound, dict):
-                    sound_name = sound["Name"]
-                elif sound in self.cs_minus_freqs:
-                    sound_name = f"{sound} Hz"
-                else:
-                    sound_name = sound
-                data_dict[f"{sound_name} Hits"] = 0
-                data_dict[f"{sound_name} Trials"] = 0
-                data_dict[f"{sound_name} % Hit"] = np.nan
-                if sound not in ["CS+", *self.cs_plus]:
-                    data_dict[f"{sound_name} d'"] = np.nan
-        else:  # Copy values from last trial as starting point -- many analysis columns won't change
-            data_dict = self.session_data.tail(1).to_dict("records")[0]
-
-        # Get Sound Category (CS+, CS-, Silence)
-        if self.trial_sound in self.cs_plus:
-            sound_category = "CS+"
-        elif self.trial_sound in self.cs_minus:
-            sound_category = "CS-"
-        else:
-            sound_category = "Silence"
+    def close(self):
+        super().close()
+        self.quest_handler.close()
 
-        # Get 'Hit' or not -- 'Hit' if response falls within hit window, no matter the sound category
-        if self.trial_response in ["Hit", "False alarm"]:
-            hit = 1
-        else:
-            hit = 0
-
-        # Fill out data dict with trial info
-        data_dict["Trial Num"] = self.trial_number
-        minute, second = self.session_time
-        data_dict["Session Time"] = {"Minute": minute, "Second": second}
-        data_dict["Sound"] = self.trial_sound
-        data_dict["Sound Category"] = sound_category
-        data_dict["Response Times"] = self.response_times
-        data_dict["Response"] = self.trial_response
-        data_dict["Hit"] = hit
-
-        data_dict[f"{sound_category} Hits"] += hit
-        data_dict[f"{sound_category} Trials"] += 1
-        data_dict[f"{sound_category} % Hit"] = \
-            data_dict[f"{sound_category} Hits"] / data_dict[f"{sound_category} Trials"] * 100.0
-
-        sound_name = self.trial_sound["Name"]
-        data_dict[f"{sound_name} Hits"] += hit
-        data_dict[f"{sound_name} Trials"] += 1
-        data_dict[f"{sound_name} % Hit"] = data_dict[f"{sound_name} Hits"] / data_dict[f"{sound_name} Trials"] * 100.0
-
-        # Calculate d'
-        for sound in ["CS-", *self.cs_minus, *self.silence]:
-            if isinstance(sound, dict):
-                sound_name = sound["Name"]
-            else:
-                sound_name = sound
-            data_dict[f"{sound_name} d'"] = utility_funcs.calc_d_prime(
-                hits=data_dict["CS+ Hits"], misses=data_dict["CS+ Trials"] - data_dict["CS+ Hits"],
-                false_alarms=data_dict[f"{sound_name} Hits"],
-                correct_rejections=data_dict[f"{sound_name} Trials"] - data_dict[f"{sound_name} Hits"]
-            )
-
-        if self.cs_minus:
-            data_dict["% Correct"] = np.nanmean([data_dict["CS+ % Hit"], (100 - data_dict["CS- % Hit"])])
-        else:
-            data_dict["% Correct"] = np.nanmean([data_dict["CS+ % Hit"], (100 - data_dict["Silence % Hit"])])
+    def resume_staircase(self, stim, response):
+        self.quest_handler.psi.resume(stim, response)
 
-        self.session_data = self.session_data.append(data_dict, ignore_index=True)
+    def tallied_sounds(self):
+        # Every CS- frequency QUEST+ can choose, not only the current CS-
+        return [*((sound["Name"], "CS+") for sound in self.cs_plus),
+                *((f"{freq} Hz", "CS-") for freq in self.cs_minus_freqs),
+                *((sound["Name"], "Silence") for sound in self.silence)]
 
     def setup_plots(self):
         # TODO Same as above. Work out a better integrated system once task is running
@@ -541,137 +507,95 @@ class PsiDiscriminationTask(ToneDetectionTask):
         calibrations_path = Path(__file__).parent / f"../../resources/tasks/psyc-ATAT_B{booth_str}_speaker_amps.csv"
         self.tone_calibrations = pd.read_csv(calibrations_path)
 
-        self.cs_minus_freqs = np.round(2000 * 2 ** (np.arange(1, 31) / 12)).astype(int)
-        self.psi_thresholds = (self.cs_minus_freqs[1:] + self.cs_minus_freqs[:-1]) / 2
-        self.psi_ntrials = 200
-        self.psi_slopes = np.linspace(50, 4000, 50)
-        self.psi_guess = np.linspace(0.05, 0.4, 4)
-        self.psi_lapse = np.linspace(0, 0.3, 10)
+        psi_grid, self.psi_calibration = psi_grids.task_grid("ATAT_Psi_Discrimination")
+        self.cs_minus_freqs = psi_grid["stimRange"]
+        self.psi_thresholds = psi_grid["threshold"]
+        self.psi_ntrials = psi_grid["nTrials"]
+        self.psi_slopes = psi_grid["slope"]
+        self.psi_guess = psi_grid["guessRate"]
+        self.psi_lapse = psi_grid["lapseRate"]
 
         self.cs_plus = [{"Name": "2000 Hz", "Weight": 0.45, "Freq": 2000, "Int": 60}]
         self.silence = [{"Name": "Silence", "Weight": 0.1}]
-        self.psi_handler = PsiMarginal.Psi(self.cs_minus_freqs,
-                                           Pfunction="cGauss",
-                                           nTrials=self.psi_ntrials,
-                                           threshold=self.psi_thresholds,
-                                           slope=self.psi_slopes,
-                                           guessRate=self.psi_guess,
-                                           lapseRate=self.psi_lapse,
-                                           marginalize=True,
-                                           )
-        while self.psi_handler.xCurrent is None:
-            time.sleep(0.1)
-        cs_minus_freq = self.psi_handler.xCurrent
+        prior = psi_grids.warm_start_prior(self.booth.rat, psi_grid) if psi_grids.PSI_WARM_START else None
+        self.psi_handler = PsiMarginal.Psi(cacheDir=psi_grids.PSI_CACHE_PATH, nWorkers=psi_grids.PSI_WORKERS,
+                                           chunkSize=psi_grids.PSI_CHUNK_SIZE, speculate=psi_grids.PSI_SPECULATE,
+                                           batch=psi_grids.PSI_BATCH, prior=prior, **psi_grid)
+        self.psi_diagnostics_signal = blinker.signal(f"PsiDiagnostics_{self.booth_num}")
+        cs_minus_freq = self.psi_handler.xCurrent  # First stimulus is computed synchronously
         self.cs_minus = [{"Name": f"{cs_minus_freq} Hz", "Weight": 0.45, "Freq": cs_minus_freq, "Int": 60}]
 
+    @inlineCallbacks
     def prep_trial(self):
+        psi_updated = False
         # Check if last sound was a CS-. If so, update Psi and select new CS-
         # Treat 'Early' and 'Late' as aborts
         if self.trial_sound in self.cs_minus:
             if self.trial_response == "Correct rejection":
                 self.psi_handler.addData(1)
+                psi_updated = True
             elif self.trial_response == "False alarm":
                 self.psi_handler.addData(0)
-
-        try:
-            while self.psi_handler.xCurrent is None:
-                time.sleep(0.1)
-            cs_minus_freq = self.psi_handler.xCurrent
-            self.cs_minus = [{"Name": f"{cs_minus_freq} Hz", "Weight": 0.45, "Freq": cs_minus_freq, "Int": 60}]
-        except StopIteration:
-            pass
+                psi_updated = True
+        if psi_updated:
+            self.journal.write("Staircase", Stim=self.psi_handler.stim[-1], Response=self.psi_handler.response[-1])
+
+        # Wait for the Psi worker without blocking the reactor
+        cs_minus_freq = yield Deferred.fromFuture(asyncio.wrap_future(self.psi_handler.nextStim))
+        if psi_updated:
+            self.record_psi_diagnostics()
+        self.plots["Psi"].update(self.psi_handler)
+        if psi_updated and self.check_psi_stop():
+            return  # Don't set up another trial, the session is over
+        self.cs_minus = [{"Name": f"{cs_minus_freq} Hz", "Weight": 0.45, "Freq": cs_minus_freq, "Int": 60}]
 
         # Run normal prep
         super().prep_trial()
 
     def save(self, temp=False, filepath=None, filename=None):
-        # Pickle Psi object if end of session
+        # Save Psi state if end of session, load with PsiMarginal.Psi.load
         if not temp:
-            psi_filepath = Path(__file__).parent / "../../data/psi/"
+            psi_filepath = psi_grids.PSI_DATA_PATH
             psi_filepath.mkdir(parents=True, exist_ok=True)
             today = datetime.datetime.now().strftime("%Y-%m-%d")
             session_num = 1
-            psi_filename = f"{self.booth.rat}_{today}_Session-{session_num}.pickle"
+            psi_filename = f"{self.booth.rat}_{today}_Session-{session_num}.npz"
             while Path.is_file(psi_filepath / psi_filename):
                 session_num += 1
-                psi_filename = f"{self.booth.rat}_{today}_Session-{session_num}.pickle"
+                psi_filename = f"{self.booth.rat}_{today}_Session-{session_num}.npz"
 
-            with (psi_filepath / psi_filename).open(mode="wb") as file:
-                pickle.dump(self.psi_handler, file)
+            self.psi_handler.save(psi_filepath / psi_filename, metadata={"calibration": self.psi_calibration})
 
         super().save(temp=temp, filepath=filepath, filename=filename)
 
-    def update_session_data(self):
-        # TODO Temporary overwriting so program doesn't complain about unknown CS-'s
-        if self.session_data.empty:  # Handle first trial special to set up columns and values
-            data_dict = {}
-            for sound in ["CS+", "CS-", *self.cs_plus, *self.cs_minus_freqs, *self.silence]:
-                if isinstance(sound, dict):
-                    sound_name = sound["Name"]
-                elif sound in self.cs_minus_freqs:
-                    sound_name = f"{sound} Hz"
-                else:
-                    sound_name = sound
-                data_dict[f"{sound_name} Hits"] = 0
-                data_dict[f"{sound_name} Trials"] = 0
-                data_dict[f"{sound_name} % Hit"] = np.nan
-                if sound not in ["CS+", *self.cs_plus]:
-                    data_dict[f"{sound_name} d'"] = np.nan
-        else:  # Copy values from last trial as starting point -- many analysis columns won't change
-            data_dict = self.session_data.tail(1).to_dict("records")[0]
-
-        # Get Sound Category (CS+, CS-, Silence)
-        if self.trial_sound in self.cs_plus:
-            sound_category = "CS+"
-        elif self.trial_sound in self.cs_minus:
-            sound_category = "CS-"
-        else:
-            sound_category = "Silence"
-
-        # Get 'Hit' or not -- 'Hit' if response falls within hit window, no matter the sound category
-        if self.trial_response in ["Hit", "False alarm"]:
-            hit = 1
-        else:
-            hit = 0
-
-        # Fill out data dict with trial info
-        data_dict["Trial Num"] = self.trial_number
-        minute, second = self.session_time
-        data_dict["Session Time"] = {"Minute": minute, "Second": second}
-        data_dict["Sound"] = self.trial_sound
-        data_dict["Sound Category"] = sound_category
-        data_dict["Response Times"] = self.response_times
-        data_dict["Response"] = self.trial_response
-        data_dict["Hit"] = hit
-
-        data_dict[f"{sound_category} Hits"] += hit
-        data_dict[f"{sound_category} Trials"] += 1
-        data_dict[f"{sound_category} % Hit"] = \
-            data_dict[f"{sound_category} Hits"] / data_dict[f"{sound_category} Trials"] * 100.0
-
-        sound_name = self.trial_sound["Name"]
-        data_dict[f"{sound_name} Hits"] += hit
-        data_dict[f"{sound_name} Trials"] += 1
-        data_dict[f"{sound_name} % Hit"] = data_dict[f"{sound_name} Hits"] / data_dict[f"{sound_name} Trials"] * 100.0
-
-        # Calculate d'
-        for sound in ["CS-", *self.cs_minus, *self.silence]:
-            if isinstance(sound, dict):
-                sound_name = sound["Name"]
-            else:
-                sound_name = sound
-            data_dict[f"{sound_name} d'"] = utility_funcs.calc_d_prime(
-                hits=data_dict["CS+ Hits"], misses=data_dict["CS+ Trials"] - data_dict["CS+ Hits"],
-                false_alarms=data_dict[f"{sound_name} Hits"],
-                correct_rejections=data_dict[f"{sound_name} Trials"] - data_dict[f"{sound_name} Hits"]
-            )
-
-        if self.cs_minus:
-            data_dict["% Correct"] = np.nanmean([data_dict["CS+ % Hit"], (100 - data_dict["CS- % Hit"])])
-        else:
-            data_dict["% Correct"] = np.nanmean([data_dict["CS+ % Hit"], (100 - data_dict["Silence % Hit"])])
-
-        self.session_data = self.session_data.append(data_dict, ignore_index=True)
+    def resume_staircase(self, stim, response):
+        self.psi_handler.resume(stim, response)
+
+    def record_psi_diagnostics(self):
+        # Add the record of the Psi update to the row of the trial it used, and send it to the server
+        record = self.psi_handler.diagnostics[-1]
+        self.update_last_trial({f"Psi {key}": value for key, value in record.items()})
+        self.psi_diagnostics_signal.send(self.booth_num, record=record)
+
+    def check_psi_stop(self):
+        # End the session from the booth once Psi has converged, before the next trial is set up. The session is
+        # stopped right away so start_trial sees session_end_time and no further trial starts
+        if self.psi_handler.stop and psi_grids.PSI_STOP_SESSION and not self.session_end_time:
+            self.booth.state = f"Psi stopped ({self.psi_handler.stopReason})"
+            self.booth.session_status_label["text"] = f"Status: {self.booth.state}"
+            self.booth.stop_session()
+            return True
+        return False
+
+    def close(self):
+        super().close()
+        self.psi_handler.close()
+
+    def tallied_sounds(self):
+        # Every CS- frequency Psi can choose, not only the current CS-
+        return [*((sound["Name"], "CS+") for sound in self.cs_plus),
+                *((f"{freq} Hz", "CS-") for freq in self.cs_minus_freqs),
+                *((sound["Name"], "Silence") for sound in self.silence)]
 
     def setup_plots(self):
         # TODO Same as above. Work out a better integrated system once task is running
@@ -723,6 +647,12 @@ class PsiDiscriminationTask(ToneDetectionTask):
         self.plots["Response"].fig.tight_layout()
         self.plots["Response"].canvas.draw()
 
+        # Posterior psychometric curve and threshold, redrawn after each Psi update
+        from GUI.booth import PsiPlot
+        self.plots["Psi"] = PsiPlot(self.booth.plot_notebook, self.cs_minus_freqs, stim_label="CS- Frequency (Hz)",
+                                    title="Psi", figsize=(4, 2))
+        self.plots["Psi"].canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
 
 class PsiDetectionTask(ToneDetectionTask):
     def __init__(self, booth):
@@ -736,136 +666,93 @@ class PsiDetectionTask(ToneDetectionTask):
         calibrations_path = Path(__file__).parent / f"../../resources/tasks/psyc-ATAT_B{booth_str}_speaker_amps.csv"
         self.tone_calibrations = pd.read_csv(calibrations_path)
 
-        self.cs_plus_ints = np.arange(0, 77, 3)
-        self.psi_thresholds = (self.cs_plus_ints[1:] + self.cs_plus_ints[:-1]) / 2
-        self.psi_ntrials = 200
-        self.psi_slopes = np.linspace(0, 30, 20)
-        self.psi_guess = np.linspace(0.05, 0.4, 4)
-        self.psi_lapse = np.linspace(0, 0.3, 10)
+        psi_grid, self.psi_calibration = psi_grids.task_grid("ATAT_Psi_Detection")
+        self.cs_plus_ints = psi_grid["stimRange"]
+        self.psi_thresholds = psi_grid["threshold"]
+        self.psi_ntrials = psi_grid["nTrials"]
+        self.psi_slopes = psi_grid["slope"]
+        self.psi_guess = psi_grid["guessRate"]
+        self.psi_lapse = psi_grid["lapseRate"]
 
         self.silence = [{"Name": "Silence", "Weight": 0.5}]
-        self.psi_handler = PsiMarginal.Psi(self.cs_plus_ints,
-                                           Pfunction="cGauss",
-                                           nTrials=self.psi_ntrials,
-                                           threshold=self.psi_thresholds,
-                                           slope=self.psi_slopes,
-                                           guessRate=self.psi_guess,
-                                           lapseRate=self.psi_lapse,
-                                           marginalize=True,
-                                           )
-        while self.psi_handler.xCurrent is None:
-            time.sleep(0.1)
-        cs_plus_int = self.psi_handler.xCurrent
+        prior = psi_grids.warm_start_prior(self.booth.rat, psi_grid) if psi_grids.PSI_WARM_START else None
+        self.psi_handler = PsiMarginal.Psi(cacheDir=psi_grids.PSI_CACHE_PATH, nWorkers=psi_grids.PSI_WORKERS,
+                                           chunkSize=psi_grids.PSI_CHUNK_SIZE, speculate=psi_grids.PSI_SPECULATE,
+                                           batch=psi_grids.PSI_BATCH, prior=prior, **psi_grid)
+        self.psi_diagnostics_signal = blinker.signal(f"PsiDiagnostics_{self.booth_num}")
+        cs_plus_int = self.psi_handler.xCurrent  # First stimulus is computed synchronously
         self.cs_plus = [{"Name": f"2000 Hz {cs_plus_int} dB", "Weight": 0.5, "Freq": 2000, "Int": cs_plus_int}]
 
+    @inlineCallbacks
     def prep_trial(self):
+        psi_updated = False
         # Check if last sound was a CS+. If so, update Psi and select new CS+ intensity
         # Treat 'Early' and 'Late' as aborts
         if self.trial_sound in self.cs_plus:
             if self.trial_response == "Hit":
                 self.psi_handler.addData(1)
+                psi_updated = True
             elif self.trial_response == "Miss":
                 self.psi_handler.addData(0)
-
-        try:
-            while self.psi_handler.xCurrent is None:
-                time.sleep(0.1)
-            cs_plus_int = self.psi_handler.xCurrent
-            self.cs_plus = [{"Name": f"2000 Hz {cs_plus_int} dB", "Weight": 0.5, "Freq": 2000, "Int": cs_plus_int}]
-        except StopIteration:
-            pass
+                psi_updated = True
+        if psi_updated:
+            self.journal.write("Staircase", Stim=self.psi_handler.stim[-1], Response=self.psi_handler.response[-1])
+
+        # Wait for the Psi worker without blocking the reactor
+        cs_plus_int = yield Deferred.fromFuture(asyncio.wrap_future(self.psi_handler.nextStim))
+        if psi_updated:
+            self.record_psi_diagnostics()
+        self.plots["Psi"].update(self.psi_handler)
+        if psi_updated and self.check_psi_stop():
+            return  # Don't set up another trial, the session is over
+        self.cs_plus = [{"Name": f"2000 Hz {cs_plus_int} dB", "Weight": 0.5, "Freq": 2000, "Int": cs_plus_int}]
 
         # Run normal prep
         super().prep_trial()
 
     def save(self, temp=False, filepath=None, filename=None):
-        # Pickle Psi object if end of session
+        # Save Psi state if end of session, load with PsiMarginal.Psi.load
         if not temp:
-            psi_filepath = Path(__file__).parent / "../../data/psi/"
+            psi_filepath = psi_grids.PSI_DATA_PATH
             psi_filepath.mkdir(parents=True, exist_ok=True)
             today = datetime.datetime.now().strftime("%Y-%m-%d")
             session_num = 1
-            psi_filename = f"{self.booth.rat}_{today}_Session-{session_num}.pickle"
+            psi_filename = f"{self.booth.rat}_{today}_Session-{session_num}.npz"
             while Path.is_file(psi_filepath / psi_filename):
                 session_num += 1
-                psi_filename = f"{self.booth.rat}_{today}_Session-{session_num}.pickle"
+                psi_filename = f"{self.booth.rat}_{today}_Session-{session_num}.npz"
 
-            with (psi_filepath / psi_filename).open(mode="wb") as file:
-                pickle.dump(self.psi_handler, file)
+            self.psi_handler.save(psi_filepath / psi_filename, metadata={"calibration": self.psi_calibration})
 
         super().save(temp=temp, filepath=filepath, filename=filename)
 
-    def update_session_data(self):
-        # TODO Temporary overwriting so program doesn't complain about unknown CS+ intensities
-        if self.session_data.empty:  # Handle first trial special to set up columns and values
-            data_dict = {}
-            for sound in ["CS+", "CS-", *self.cs_plus_ints, *self.silence]:
-                if isinstance(sound, dict):
-                    sound_name = sound["Name"]
-                elif sound in self.cs_plus_ints:
-                    sound_name = f"2000 Hz {sound} dB"
-                else:
-                    sound_name = sound
-                data_dict[f"{sound_name} Hits"] = 0
-                data_dict[f"{sound_name} Trials"] = 0
-                data_dict[f"{sound_name} % Hit"] = np.nan
-                if sound not in ["CS+", *self.cs_plus, *self.cs_plus_ints]:
-                    data_dict[f"{sound_name} d'"] = np.nan
-        else:  # Copy values from last trial as starting point -- many analysis columns won't change
-            data_dict = self.session_data.tail(1).to_dict("records")[0]
-
-        # Get Sound Category (CS+, CS-, Silence)
-        if self.trial_sound in self.cs_plus:
-            sound_category = "CS+"
-        elif self.trial_sound in self.cs_minus:
-            sound_category = "CS-"
-        else:
-            sound_category = "Silence"
-
-        # Get 'Hit' or not -- 'Hit' if response falls within hit window, no matter the sound category
-        if self.trial_response in ["Hit", "False alarm"]:
-            hit = 1
-        else:
-            hit = 0
-
-        # Fill out data dict with trial info
-        data_dict["Trial Num"] = self.trial_number
-        minute, second = self.session_time
-        data_dict["Session Time"] = {"Minute": minute, "Second": second}
-        data_dict["Sound"] = self.trial_sound
-        data_dict["Sound Category"] = sound_category
-        data_dict["Response Times"] = self.response_times
-        data_dict["Response"] = self.trial_response
-        data_dict["Hit"] = hit
-
-        data_dict[f"{sound_category} Hits"] += hit
-        data_dict[f"{sound_category} Trials"] += 1
-        data_dict[f"{sound_category} % Hit"] = \
-            data_dict[f"{sound_category} Hits"] / data_dict[f"{sound_category} Trials"] * 100.0
-
-        sound_name = self.trial_sound["Name"]
-        data_dict[f"{sound_name} Hits"] += hit
-        data_dict[f"{sound_name} Trials"] += 1
-        data_dict[f"{sound_name} % Hit"] = data_dict[f"{sound_name} Hits"] / data_dict[f"{sound_name} Trials"] * 100.0
-
-        # Calculate d'
-        for sound in ["CS-", *self.cs_minus, *self.silence]:
-            if isinstance(sound, dict):
-                sound_name = sound["Name"]
-            else:
-                sound_name = sound
-            data_dict[f"{sound_name} d'"] = utility_funcs.calc_d_prime(
-                hits=data_dict["CS+ Hits"], misses=data_dict["CS+ Trials"] - data_dict["CS+ Hits"],
-                false_alarms=data_dict[f"{sound_name} Hits"],
-                correct_rejections=data_dict[f"{sound_name} Trials"] - data_dict[f"{sound_name} Hits"]
-            )
-
-        if self.cs_minus:
-            data_dict["% Correct"] = np.nanmean([data_dict["CS+ % Hit"], (100 - data_dict["CS- % Hit"])])
-        else:
-            data_dict["% Correct"] = np.nanmean([data_dict["CS+ % Hit"], (100 - data_dict["Silence % Hit"])])
-
-        self.session_data = self.session_data.append(data_dict, ignore_index=True)
+    def resume_staircase(self, stim, response):
+        self.psi_handler.resume(stim, response)
+
+    def record_psi_diagnostics(self):
+        # Add the record of the Psi update to the row of the trial it used, and send it to the server
+        record = self.psi_handler.diagnostics[-1]
+        self.update_last_trial({f"Psi {key}": value for key, value in record.items()})
+        self.psi_diagnostics_signal.send(self.booth_num, record=record)
+
+    def check_psi_stop(self):
+        # End the session from the booth once Psi has converged, before the next trial is set up. The session is
+        # stopped right away so start_trial sees session_end_time and no further trial starts
+        if self.psi_handler.stop and psi_grids.PSI_STOP_SESSION and not self.session_end_time:
+            self.booth.state = f"Psi stopped ({self.psi_handler.stopReason})"
+            self.booth.session_status_label["text"] = f"Status: {self.booth.state}"
+            self.booth.stop_session()
+            return True
+        return False
+
+    def close(self):
+        super().close()
+        self.psi_handler.close()
+
+    def tallied_sounds(self):
+        # Every CS+ intensity Psi can choose, not only the current CS+
+        return [*((f"2000 Hz {intensity} dB", "CS+") for intensity in self.cs_plus_ints),
+                *((sound["Name"], "Silence") for sound in self.silence)]
 
     def setup_plots(self):
         # TODO Same as above. Work out a better integrated system once task is running
@@ -917,6 +804,12 @@ class PsiDetectionTask(ToneDetectionTask):
         self.plots["Response"].fig.tight_layout()
         self.plots["Response"].canvas.draw()
 
+        # Posterior psychometric curve and threshold, redrawn after each Psi update
+        from GUI.booth import PsiPlot
+        self.plots["Psi"] = PsiPlot(self.booth.plot_notebook, self.cs_plus_ints, stim_label="CS+ Intensity (dB)",
+                                    title="Psi", figsize=(4, 2))
+        self.plots["Psi"].canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
 
 class SpeechDiscriminationTask(task.GoNoGoTask):
     def __init__(self, booth):
@@ -1018,73 +911,5 @@ class SSNSpeechDiscriminationTask(SpeechDiscriminationTask):
         super().stop_session()
 
     def update_session_data(self):
-        # TODO super ugly, but I just need a quick way to ensure trial noise level is saved
-        if self.session_data.empty:  # Handle first trial special to set up columns and values
-            data_dict = {}
-            for sound in ["CS+", "CS-", *self.cs_plus, *self.cs_minus, *self.silence]:
-                if isinstance(sound, dict):
-                    sound_name = sound["Name"]
-                else:
-                    sound_name = sound
-                data_dict[f"{sound_name} Hits"] = 0
-                data_dict[f"{sound_name} Trials"] = 0
-                data_dict[f"{sound_name} % Hit"] = np.nan
-                if sound not in ["CS+", *self.cs_plus]:
-                    data_dict[f"{sound_name} d'"] = np.nan
-        else:  # Copy values from last trial as starting point -- many analysis columns won't change
-            data_dict = self.session_data.tail(1).to_dict("records")[0]
-
-        # Get Sound Category (CS+, CS-, Silence)
-        if self.trial_sound in self.cs_plus:
-            sound_category = "CS+"
-        elif self.trial_sound in self.cs_minus:
-            sound_category = "CS-"
-        else:
-            sound_category = "Silence"
-
-        # Get 'Hit' or not -- 'Hit' if response falls within hit window, no matter the sound category
-        if self.trial_response in ["Hit", "False alarm"]:
-            hit = 1
-        else:
-            hit = 0
-
-        # Fill out data dict with trial info
-        data_dict["Noise Level"] = self.current_noise_level
-        data_dict["Noise Block"] = self.noise_block_number
-        data_dict["Trial Num"] = self.trial_number
-        minute, second = self.session_time
-        data_dict["Session Time"] = {"Minute": minute, "Second": second}
-        data_dict["Sound"] = self.trial_sound
-        data_dict["Sound Category"] = sound_category
-        data_dict["Response Times"] = self.response_times
-        data_dict["Response"] = self.trial_response
-        data_dict["Hit"] = hit
-
-        data_dict[f"{sound_category} Hits"] += hit
-        data_dict[f"{sound_category} Trials"] += 1
-        data_dict[f"{sound_category} % Hit"] = \
-            data_dict[f"{sound_category} Hits"] / data_dict[f"{sound_category} Trials"] * 100.0
-
-        sound_name = self.trial_sound["Name"]
-        data_dict[f"{sound_name} Hits"] += hit
-        data_dict[f"{sound_name} Trials"] += 1
-        data_dict[f"{sound_name} % Hit"] = data_dict[f"{sound_name} Hits"] / data_dict[f"{sound_name} Trials"] * 100.0
-
-        # Calculate d'
-        for sound in ["CS-", *self.cs_minus, *self.silence]:
-            if isinstance(sound, dict):
-                sound_name = sound["Name"]
-            else:
-                sound_name = sound
-            data_dict[f"{sound_name} d'"] = utility_funcs.calc_d_prime(
-                hits=data_dict["CS+ Hits"], misses=data_dict["CS+ Trials"] - data_dict["CS+ Hits"],
-                false_alarms=data_dict[f"{sound_name} Hits"],
-                correct_rejections=data_dict[f"{sound_name} Trials"] - data_dict[f"{sound_name} Hits"]
-            )
-
-        if self.cs_minus:
-            data_dict["% Correct"] = np.nanmean([data_dict["CS+ % Hit"], (100 - data_dict["CS- % Hit"])])
-        else:
-            data_dict["% Correct"] = np.nanmean([data_dict["CS+ % Hit"], (100 - data_dict["Silence % Hit"])])
-
-        self.session_data = self.session_data.append(data_dict, ignore_index=True)
+        super().update_session_data()
+        self.update_last_trial({"Noise Level": self.current_noise_level, "Noise Block": self.noise_block_number})
@@ -32,11 +32,19 @@ Prins, N. (2013). The psi-marginal adaptive method: How to give nuisance paramet
 """
 
 import numpy as np
-from sklearn.utils.extmath import cartesian
 import scipy
 from scipy.stats import norm, beta, gamma
-from scipy.special import erfc
+from scipy.special import erfc, entr
 import threading
+import time
+import queue
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import partial
+import hashlib
+import json
+import os
+import weakref
+from pathlib import Path
 import matplotlib.pyplot as plt
 
 
@@ -81,7 +89,26 @@ def pf(parameters, psyfun='cGauss'):
         gamma = 0.2
         llambda = 0.04
     # Psychometric function
-    ones = np.ones(np.shape(mu))
+    p = pfCore(mu, sigma, x, psyfun=psyfun)
+    y = gamma + np.multiply((1 - gamma - llambda), p)
+    return y
+
+
+def pfCore(mu, sigma, x, psyfun='cGauss'):
+    """Evaluate the psychometric core F(x; mu, sigma), without guess and lapse rates.
+
+    Arguments
+    ---------
+        mu, sigma, x : array_like, broadcast against each other
+            threshold, slope and stimulus intensity
+
+        psyfun  : type of psychometric function, see pf.
+
+    Returns
+    -------
+    ndarray of F(x; mu, sigma), with the broadcast shape of the arguments
+    """
+    ones = np.ones(np.broadcast(mu, sigma, x).shape)
     if psyfun == 'cGauss':
         # F(x; mu, sigma) = Normcdf(mu, sigma) = 1/2 * erfc(-sigma * (x-mu) /sqrt(2))
         z = np.divide(np.subtract(x, mu), sigma)
@@ -90,13 +117,13 @@ def pf(parameters, psyfun='cGauss'):
         # F(x; mu, sigma) = 1 - exp(-10^(sigma(x-mu)))
         p = ones - np.exp(-np.power((np.multiply(ones, 10.0)), (np.multiply(sigma, (np.subtract(x, mu))))))
     elif psyfun == 'Weibull':
-        # F(x; mu, sigma)
-        p = 1 - np.exp(-(np.divide(x, mu)) ** sigma)
+        # F(x; mu, sigma) = 1 - exp(-(x/mu)^sigma), steep slopes overflow to F = 0 or 1
+        with np.errstate(over='ignore'):
+            p = 1 - np.exp(-(np.divide(x, mu)) ** sigma)
     else:
         # flat line if no psychometric function is specified
-        p = np.ones(np.shape(mu))
-    y = gamma + np.multiply((ones - gamma - llambda), p)
-    return y
+        p = ones
+    return p
 
 
 def GenerateData(parameters, psyfun='cGauss', ntrials=None):
@@ -131,6 +158,508 @@ def GenerateData(parameters, psyfun='cGauss', ntrials=None):
     return r
 
 
+class Likelihood:
+    """Factorized table of conditional probabilities p(response | alpha,sigma,gamma,lambda,x).
+
+    The psychometric core F(x; alpha, sigma) does not depend on the guessing and lapse rates, which only apply the
+    affine transform gamma + (1 - gamma - lambda) * F. Only the 3-D core and the guess/lapse offset and scale are stored,
+    and slices, contractions with a pdf, or the dense table are produced on demand.
+
+    Arguments
+    ---------
+        threshold, slope, guessRate, lapseRate, stimRange : 1D numpy arrays
+            parameter grids, see Psi
+
+        psyfun (str) : type of psychometric function, see pf
+
+        gammaEQlambda (bool) : if True the guess rate axis is left out, and gamma is taken equal to lambda
+
+        dtype : floating point type of the stored core
+
+        core : ndarray (optional)
+            precomputed core F(x; alpha, sigma), e.g. memory-mapped from a TableCache. Computed if not given.
+    """
+
+    def __init__(self, threshold, slope, guessRate, lapseRate, stimRange, psyfun='cGauss', gammaEQlambda=False,
+                 dtype=np.float64, core=None):
+        self.psyfun = psyfun
+        self.gammaEQlambda = gammaEQlambda
+        self.dtype = np.dtype(dtype)
+        # core: F(x; alpha, sigma), (threshold, slope, x)
+        if core is None:
+            core = self.computeCore(threshold, slope, stimRange, psyfun, self.dtype)
+        self.core = core
+        # offset (gamma) and scale (1 - gamma - lambda) over the nuisance axes, (lambda,) or (gamma, lambda)
+        lapseRate = np.asarray(lapseRate, dtype=np.float64)
+        if gammaEQlambda:
+            guessRate = lapseRate
+        else:
+            guessRate = np.asarray(guessRate, dtype=np.float64)[:, np.newaxis]
+        self.offset = guessRate * np.ones_like(lapseRate)
+        self.scale = 1 - guessRate - lapseRate
+        self.shape = self.core.shape[:2] + self.offset.shape + self.core.shape[2:]
+        self.ndim = len(self.shape)
+        self.nuisance = 'cd'[:self.offset.ndim]  # einsum subscripts of the nuisance axes
+
+    @staticmethod
+    def computeCore(threshold, slope, stimRange, psyfun, dtype):
+        """Evaluate F(x; alpha, sigma) over the (threshold, slope, x) grid."""
+        return pfCore(np.asarray(threshold)[:, np.newaxis, np.newaxis], np.asarray(slope)[np.newaxis, :, np.newaxis],
+                      np.asarray(stimRange)[np.newaxis, np.newaxis, :], psyfun=psyfun).astype(dtype)
+
+    def sliceAt(self, index):
+        """Likelihood of a success at stimulus index, over all parameters (threshold, slope, [guess,] lapse).
+
+        If index is an array, the slices are stacked along a leading axis, one per index.
+        """
+        core = self.core[:, :, index]
+        if np.ndim(index):
+            core = np.moveaxis(core, -1, 0)
+        return self.offset + self.scale * core[(Ellipsis,) + (np.newaxis,) * self.offset.ndim]
+
+    def contract(self, pdf, out=None, stim=slice(None), sums=None, box=(slice(None), slice(None))):
+        """Joint probability of a success and each threshold and slope, sum over guess and lapse rate of L * pdf.
+
+        Since L = gamma + (1 - gamma - lambda) * F, this reduces to A + B * F with A and B contractions of the pdf
+        with gamma and (1 - gamma - lambda), so the nuisance parameters never meet the stimulus axis.
+
+        Arguments
+        ---------
+            pdf : ndarray
+                pdf over all parameters, ignored if sums is given
+
+            out : ndarray (optional)
+                array to write the result into
+
+            stim : slice or index array
+                stimulus intensities to evaluate, default all
+
+            sums : tuple (optional)
+                precomputed nuisanceSums(pdf, self.offset, self.scale), to share between calls with the same pdf
+
+            box : tuple of slices
+                threshold and slope ranges to evaluate, default all. The pdf or sums must already be cut to this box
+
+        Returns
+        -------
+        ndarray ([batch,] threshold, slope, x), with the leading batch axes of the pdf if any
+        """
+        if sums is None:
+            sums = self.nuisanceSums(pdf, self.offset, self.scale)
+        offsetSum, scaleSum = sums
+        out = np.multiply(self.core[box + (stim,)], scaleSum[..., np.newaxis], out=out, casting='same_kind')
+        out += offsetSum[..., np.newaxis]
+        return out
+
+    def nuisanceSums(self, pdf, *weights):
+        """Sum the pdf over the guess and lapse rate axes, weighted by each of the given nuisance arrays.
+
+        The pdf may have leading batch axes, which are kept.
+        """
+        subscripts = f'...ab{self.nuisance},{self.nuisance}->...ab'
+        return [np.einsum(subscripts, pdf, weight) for weight in weights]
+
+    def curveMoments(self, pdf):
+        """Posterior mean and standard deviation of the psychometric curve, E[L] and sqrt(E[L^2] - E[L]^2) at each x.
+
+        With L = gamma + (1 - gamma - lambda) * F, both moments follow from five weighted sums of the pdf over the
+        guess and lapse rates, taken in one pass, and the (threshold, slope, x) core.
+        """
+        offset, scale = self.offset, self.scale
+        weights = np.stack([offset, scale, 2 * offset * scale, offset ** 2, scale ** 2])
+        nuisanceAxes = tuple(range(2, pdf.ndim))
+        offsetSum, scaleSum, crossSum, offsetSqSum, scaleSqSum = np.moveaxis(
+            np.tensordot(pdf, weights, axes=(nuisanceAxes, tuple(range(1, weights.ndim)))), -1, 0)
+        core = self.core.reshape(-1, self.core.shape[-1])
+        mean = np.sum(offsetSum) + scaleSum.ravel() @ core
+        meanSq = np.sum(offsetSqSum) + crossSum.ravel() @ core + scaleSqSum.ravel() @ core ** 2
+        return mean, np.sqrt(np.maximum(meanSq - mean ** 2, 0))
+
+    def fill(self, out, stim=slice(None), box=(slice(None), slice(None))):
+        """Write the dense likelihood table into out, with the stimulus intensity as last axis.
+
+        box optionally restricts the threshold and slope ranges, see contract.
+        """
+        nuisance = (slice(None),) * self.offset.ndim
+        core = self.core[box + (stim,)][(slice(None), slice(None)) + (np.newaxis,) * self.offset.ndim]
+        np.multiply(core, self.scale[nuisance + (np.newaxis,)], out=out, casting='same_kind')
+        out += self.offset[nuisance + (np.newaxis,)]
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        return self.fill(np.empty(self.shape, dtype=dtype or self.dtype))
+
+    @property
+    def nbytes(self):
+        return self.core.nbytes + self.offset.nbytes + self.scale.nbytes
+
+
+class Likelihood2D:
+    """Factorized table of go probabilities over a frequency x intensity stimulus space.
+
+    A tone is taken to be responded to if it is both detected and not discriminated from the CS+ frequency:
+    p(go | f, i) = gamma + (1 - gamma - lambda) * (1 - Ff(f; alphaF, sigmaF)) * Fi(i; alphaI, sigmaI). Only the
+    frequency core 1 - Ff over (alphaF, sigmaF, f) and the intensity core Fi over (alphaI, sigmaI, i) are stored. The
+    stimulus axis is the flattened (frequency, intensity) product, with intensity varying fastest.
+
+    Arguments
+    ---------
+        thresholdFreq, slopeFreq, thresholdInt, slopeInt, guessRate, lapseRate, freqRange, intRange : 1D numpy arrays
+            parameter and stimulus grids, see Psi2D
+
+        psyfunFreq, psyfunInt (str) : type of psychometric function along each stimulus axis, see pf
+
+        dtype : floating point type of the stored cores
+    """
+
+    def __init__(self, thresholdFreq, slopeFreq, thresholdInt, slopeInt, guessRate, lapseRate, freqRange, intRange,
+                 psyfunFreq='cGauss', psyfunInt='cGauss', dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.coreFreq = 1 - Likelihood.computeCore(thresholdFreq, slopeFreq, freqRange, psyfunFreq, self.dtype)
+        self.coreInt = Likelihood.computeCore(thresholdInt, slopeInt, intRange, psyfunInt, self.dtype)
+        guessRate = np.asarray(guessRate, dtype=np.float64)[:, np.newaxis]
+        lapseRate = np.asarray(lapseRate, dtype=np.float64)
+        self.offset = guessRate * np.ones_like(lapseRate)
+        self.scale = 1 - guessRate - lapseRate
+        self.nInt = len(intRange)
+        self.shape = self.coreFreq.shape[:2] + self.coreInt.shape[:2] + self.offset.shape + \
+            (len(freqRange) * self.nInt,)
+
+    def stimCore(self, stim, out=None):
+        """(1 - Ff) * Fi over (alphaF, sigmaF, alphaI, sigmaI, stim) for flattened stimulus indices stim."""
+        freq, intensity = np.divmod(np.asarray(stim), self.nInt)
+        return np.multiply(self.coreFreq[:, :, np.newaxis, np.newaxis, freq],
+                           self.coreInt[np.newaxis, np.newaxis, :, :, intensity], out=out)
+
+    def sliceAt(self, index):
+        """Likelihood of a go at flattened stimulus index, over all parameters."""
+        return self.offset + self.scale * self.stimCore(index)[..., np.newaxis, np.newaxis]
+
+    def contract(self, out, stim, sums):
+        """Joint probability of a go and each (alphaF, sigmaF, alphaI, sigmaI), summed over guess and lapse rate.
+
+        See Likelihood.contract, sums are nuisanceSums(pdf, self.offset, self.scale).
+        """
+        offsetSum, scaleSum = sums
+        out = self.stimCore(stim, out=out)
+        out *= scaleSum[..., np.newaxis]
+        out += offsetSum[..., np.newaxis]
+        return out
+
+    def nuisanceSums(self, pdf, *weights):
+        """Sum the pdf over the guess and lapse rate axes, weighted by each of the given nuisance arrays."""
+        return [np.einsum('...abcdef,ef->...abcd', pdf, weight) for weight in weights]
+
+    @property
+    def nbytes(self):
+        return self.coreFreq.nbytes + self.coreInt.nbytes + self.offset.nbytes + self.scale.nbytes
+
+
+class TableCache:
+    """Content-hashed directory of read-only likelihood and prior tables.
+
+    The tables of a Psi object depend only on the stimulus range, the parameter grids, the priors, the psychometric
+    function and the precision. Each configuration is hashed to a key, and its tables are stored as .npy files named
+    after that key. Tables are memory-mapped read-only when loaded, so every Psi instance (and every process) with the
+    same configuration shares a single copy through the OS page cache.
+
+    Without a directory, tables are only kept in memory, read-only, and shared within the process.
+
+    Tables taken with acquire are reference counted, and dropped from the cache when the last user releases them, so
+    the mapping (or memory) goes away with the last Psi object of a configuration.
+
+    Arguments
+    ---------
+        directory : str or Path (optional)
+            cache directory, created if it doesn't exist
+    """
+    version = 1  # bump when the layout or meaning of the cached tables changes
+
+    def __init__(self, directory=None):
+        self.directory = None if directory is None else Path(directory)
+        self.tables = {}  # key -> dict of loaded tables, shared by all instances using this cache object
+        self.refs = {}  # key -> number of acquire calls not yet released
+        self.lock = threading.Lock()
+
+    @classmethod
+    def key(cls, *parts):
+        """Hash arrays, strings and tuples into a hex key."""
+        digest = hashlib.sha1(str(cls.version).encode())
+        for part in parts:
+            if isinstance(part, (np.ndarray, list, range)):
+                array = np.ascontiguousarray(part, dtype=np.float64)
+                digest.update(str(array.shape).encode())
+                digest.update(array.tobytes())
+            else:
+                digest.update(repr(part).encode())
+        return digest.hexdigest()[:20]
+
+    def path(self, key, name):
+        return self.directory / f"{key}_{name}.npy"
+
+    def get(self, key, names, compute):
+        """Load the tables stored under key, or compute and store them first.
+
+        Arguments
+        ---------
+            key : str
+                configuration key, see TableCache.key
+
+            names : tuple of str
+                names of the tables stored under key
+
+            compute : callable
+                returns a dict of name -> ndarray, only called if one of the tables is missing
+
+        Returns
+        -------
+        dict of name -> read-only memory-mapped ndarray
+        """
+        if key not in self.tables and self.directory is None:
+            tables = compute()
+            for table in tables.values():
+                table.flags.writeable = False
+            self.tables[key] = {name: tables[name] for name in names}
+        elif key not in self.tables:
+            paths = {name: self.path(key, name) for name in names}
+            if not all(path.is_file() for path in paths.values()):
+                self.directory.mkdir(parents=True, exist_ok=True)
+                tables = compute()
+                for name, path in paths.items():
+                    # Write to a temporary file first, so that a crash or another process never sees a partial table
+                    tmpPath = self.directory / f"{key}_{name}.{os.getpid()}.tmp.npy"
+                    np.save(tmpPath, tables[name])
+                    os.replace(tmpPath, path)
+            self.tables[key] = {name: np.load(path, mmap_mode='r') for name, path in paths.items()}
+        return self.tables[key]
+
+    def acquire(self, key, names, compute):
+        """Like get, and hold a reference to the tables until release is called with the same key."""
+        with self.lock:
+            tables = self.get(key, names, compute)
+            self.refs[key] = self.refs.get(key, 0) + 1
+        return tables
+
+    def release(self, key):
+        """Drop a reference taken with acquire. The tables are unloaded with the last reference."""
+        with self.lock:
+            self.refs[key] -= 1
+            if self.refs[key] == 0:
+                del self.refs[key]
+                del self.tables[key]
+
+
+_tableCaches = {}
+
+
+def getTableCache(directory=None):
+    """Return the process-wide TableCache for a directory, so loaded tables are shared between Psi objects.
+
+    Without a directory, this is the in-memory cache of the process.
+    """
+    if directory is not None:
+        directory = Path(directory).resolve()
+    if directory not in _tableCaches:
+        _tableCaches[directory] = TableCache(directory)
+    return _tableCaches[directory]
+
+
+def releaseResources(worker, tableCache, tableKeys):
+    """Shut down the worker of a staircase without waiting, and release the tables it acquired from tableCache.
+
+    Takes the resources rather than the staircase, so that it can also run as the finalizer of a staircase that was
+    dropped without being closed. Calling it again does nothing.
+    """
+    if worker is not None:
+        worker.shutdown(wait=False)
+    while tableKeys:
+        tableCache.release(tableKeys.pop())
+
+
+_threadPools = {}
+_threadPoolsLock = threading.Lock()
+
+
+def getThreadPool(nWorkers):
+    """Return the process-wide thread pool with nWorkers threads, shared by all Psi objects using that many workers.
+
+    NumPy releases the GIL inside its array operations, so chunks of the stimulus axis evaluated on these threads
+    run in parallel.
+    """
+    with _threadPoolsLock:
+        if nWorkers not in _threadPools:
+            _threadPools[nWorkers] = ThreadPoolExecutor(max_workers=nWorkers, thread_name_prefix=f'Psi{nWorkers}')
+        return _threadPools[nWorkers]
+
+
+def saveArrays(file, **arrays):
+    """np.savez_compressed, writing a file path through a temporary file, so a crash mid-save never leaves a truncated
+    file behind."""
+    if not isinstance(file, (str, os.PathLike)):
+        np.savez_compressed(file, **arrays)
+        return
+    target = Path(file) if str(file).endswith('.npz') else Path(f"{file}.npz")  # as np.savez names it
+    tmpPath = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+    with open(tmpPath, 'wb') as tmpFile:
+        np.savez_compressed(tmpFile, **arrays)
+    os.replace(tmpPath, target)
+
+
+def submitWork(worker, fn, *args):
+    """Run fn on worker, or right away if worker is None. Returns a Future of its result either way."""
+    if worker is not None:
+        return worker.submit(fn, *args)
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def newWorkspaces(nBuffers, size, dtype):
+    """Queue of nBuffers pairs of (success, failure) buffers of size values, one pair per chunk evaluated at once."""
+    workspaces = queue.SimpleQueue()
+    for _ in range(nBuffers):
+        workspaces.put((np.empty(size, dtype=dtype), np.empty(size, dtype=dtype)))
+    return workspaces
+
+
+def searchChunks(chunkEntropy, shared, stimIndices, chunkSize, nWorkers):
+    """Evaluate chunkEntropy(shared, chunk) over chunks of chunkSize stimulus indices.
+
+    With several workers, the chunks run in parallel on the thread pool shared by staircases with that many workers.
+
+    Returns
+    -------
+    list of the terms returned by chunkEntropy, each concatenated over the chunks along the last (stimulus) axis
+    """
+    chunks = [stimIndices[start:start + chunkSize] for start in range(0, len(stimIndices), chunkSize)]
+    if nWorkers > 1 and len(chunks) > 1:
+        results = list(getThreadPool(nWorkers).map(partial(chunkEntropy, shared), chunks))
+    else:
+        results = [chunkEntropy(shared, chunk) for chunk in chunks]
+    return [np.concatenate(terms, axis=-1) for terms in zip(*results)]
+
+
+def responseEntropies(pTplus1success, pTplus1failure, sumAxes):
+    """p(r|x) and the entropy of the posterior after each response r, from the joint probabilities p(theta, r | x).
+
+    Arguments
+    ---------
+        pTplus1success, pTplus1failure : ndarray
+            joint probabilities of the parameters and a success or failure, over the parameter axes sumAxes and a last
+            stimulus axis. Normalized to posteriors in place
+
+        sumAxes : tuple of int
+            parameter axes
+
+    Returns
+    -------
+    tuple of numpy arrays, over the remaining axes: p(success|x), p(failure|x), entropy after success, entropy after
+    failure
+    """
+    np.maximum(pTplus1failure, 0, out=pTplus1failure)  # rounding in single precision
+    pSuccessGivenx = np.sum(pTplus1success, axis=sumAxes)
+    pFailureGivenx = np.sum(pTplus1failure, axis=sumAxes)
+    entropies = []
+    for joint, pResponse in ((pTplus1success, pSuccessGivenx), (pTplus1failure, pFailureGivenx)):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.divide(joint, np.expand_dims(pResponse, sumAxes), out=joint)
+        # entr(p) = -p*log(p), with 0*log(0) defined as 0. NaN (from 0/0 posteriors) is redefined to 0 as well
+        entr(joint, out=joint)
+        np.nan_to_num(joint, copy=False)
+        entropies.append(np.sum(joint, axis=sumAxes))
+    return pSuccessGivenx, pFailureGivenx, entropies[0], entropies[1]
+
+
+class PsiEngine:
+    """Evaluate the expected entropy for many Psi staircases in one vectorized pass.
+
+    Psi objects created with batch=True hand their expected entropy calculations to this engine instead of running
+    them on their own. Requests that arrive while the engine is busy are queued, and on the next pass all queued pdfs
+    of staircases with the same configuration (stimulus range, parameter grids, priors, psychometric function,
+    precision and search settings, see Psi.batchKey) are stacked along a batch axis and evaluated together. The
+    likelihood tables are then streamed once per pass instead of once per staircase, and the per-call overhead is paid
+    once.
+
+    Arguments
+    ---------
+        window : float
+            seconds to wait for more requests before each pass, default 0 (only batch what is already queued)
+    """
+
+    def __init__(self, window=0.0):
+        self.window = window
+        self.pending = []  # (psi, pdfs, future), in order of arrival
+        self.lock = threading.Lock()
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='PsiEngine')
+
+    def submit(self, psi, pdfs, stimIndices=None):
+        """Queue pdfs of a Psi object for evaluation, at stimIndices (default all).
+
+        Returns
+        -------
+        concurrent.futures.Future of a list with the expectedEntropy of each pdf, as dicts
+        """
+        future = Future()
+        with self.lock:
+            self.pending.append((psi, pdfs, stimIndices, future))
+            if len(self.pending) == 1:
+                self.worker.submit(self.__run)
+        return future
+
+    def __run(self):
+        if self.window:
+            time.sleep(self.window)
+        with self.lock:
+            pending, self.pending = self.pending, []
+        groups = {}
+        for request in pending:
+            groups.setdefault(request[0].batchKey, []).append(request)
+        for requests in groups.values():
+            # Any Psi in the group can evaluate the stacked pdfs, they share their likelihood
+            psi = requests[0][0]
+            # Evaluate the union of the stimulus intensities asked for
+            stimIndices = [indices for _, _, indices, _ in requests]
+            stimIndices = None if any(indices is None for indices in stimIndices) else \
+                np.unique(np.concatenate(stimIndices))
+            try:
+                expected = psi.expectedEntropy(np.stack([pdf for _, pdfs, _, _ in requests for pdf in pdfs]),
+                                               stimIndices)
+            except Exception as e:
+                for *_, future in requests:
+                    future.set_exception(e)
+                continue
+            index = 0
+            for _, pdfs, indices, future in requests:
+                results = [{name: value[index + i] for name, value in expected.items()} for i in range(len(pdfs))]
+                if indices is not None:
+                    # Leave out the intensities only other requests asked for, as expectedEntropy does, so each
+                    # staircase selects from its own candidates
+                    outside = np.ones(psi.nX, dtype=bool)
+                    outside[indices] = False
+                    for result in results:
+                        for name, values in result.items():
+                            if np.ndim(values) == 1:
+                                values[outside] = np.inf if name == 'expectEntropy' else np.nan
+                future.set_result(results)
+                index += len(pdfs)
+
+
+_psiEngine = None
+_psiEngineLock = threading.Lock()
+
+
+def getPsiEngine():
+    """Return the process-wide PsiEngine, shared by all Psi objects created with batch=True."""
+    global _psiEngine
+    with _psiEngineLock:
+        if _psiEngine is None:
+            _psiEngine = PsiEngine()
+        return _psiEngine
+
+
 class Psi:
     """Find the stimulus intensity with minimum expected entropy for each trial, to determine the psychometric function.
 
@@ -185,6 +714,84 @@ class Psi:
 
             If False, lapse rate and guess rate are included in the selection of stimulus intensity.
 
+        thread (bool) :
+            If True (default), addData runs the posterior update and stimulus search on a persistent worker thread
+            owned by this object. If False, addData blocks until the next stimulus intensity is found.
+
+        precision (str) :
+            floating point type of the likelihood table and of the minEntropyStim workspace, 'float64' (default) or
+            'float32'. Single precision halves the memory footprint and bandwidth of every trial update.
+
+        logSpace (bool) :
+            If True, and marginalize is False, the expected entropy is evaluated from precomputed L*log(L) and
+            (1-L)*log(1-L) tables, as a handful of matrix-vector products with the pdf. The posterior tensors for
+            each stimulus intensity are then never formed. Has no effect when marginalize is True, as the entropy
+            of the marginal posterior cannot be split up this way.
+
+        nWorkers (int) :
+            number of threads the stimulus axis is split over in minEntropyStim, default 1. Threads come from a pool
+            shared by all Psi objects in the process with the same nWorkers.
+
+        chunkSize (int) :
+            number of stimulus intensities evaluated per chunk, default len(stimRange) / nWorkers. Each worker holds
+            the temporaries of one chunk, which caps the peak memory of a trial update.
+
+        speculate (bool) :
+            If True, as soon as a stimulus intensity is selected, the posterior and next stimulus intensity are
+            computed on the worker for both a success and a failure. addData then only picks the finished branch, so
+            nextStim resolves almost immediately. Costs two stimulus searches per trial, off the critical path.
+            Requires thread=True.
+
+        cacheDir (str or Path) :
+            If given, the likelihood core and prior are loaded from (or stored in) a TableCache in this directory,
+            memory-mapped read-only and shared by every Psi object with the same configuration, in any process.
+            Otherwise they are kept in memory, read-only and shared by the Psi objects of this process. The tables
+            are released by close.
+
+        pruneTolerance (float) :
+            If above 0, the expected entropy is evaluated on the smallest threshold x slope box that holds all but
+            (at most) this much posterior mass, recomputed from the pdf before every stimulus search. Cost per trial
+            then shrinks as the posterior concentrates. The mass left out is reported in prunedMass, and a bound on
+            the resulting error in the expected entropy in pruneErrorBound. Has no effect when logSpace is used.
+
+        prior : ndarray (optional)
+            joint prior over (threshold, slope, [guess,] lapse), e.g. a tempered posterior of an earlier session from
+            Psi.loadPrior. Replaces the joint prior built from the per-parameter priors, and is saved by save, so the
+            session can be replayed from it.
+
+        stopThresholdSD, stopSlopeSD (float) :
+            If given, stop is set once the posterior standard deviation of the threshold (and of the slope, if both
+            are given) is at or below this value
+
+        stopInfoGain (float) :
+            If given, stop is set once the expected information gain of the selected stimulus intensity, the current
+            entropy minus its expected entropy (in nats), falls below this value
+
+        stopMinTrials (int) :
+            trials to run before stopThresholdSD, stopSlopeSD and stopInfoGain are considered, default 0.
+            stop is always set at nTrials, and stopReason tells which rule set it
+
+        narrowStim (float) :
+            If given, e.g. 0.99, only stimulus intensities inside the central credible interval of the threshold with
+            this mass, plus narrowMargin intensities on either side, are searched. The interval narrows as the
+            threshold is localized, so each search gets cheaper. stimRange must be sorted in ascending order
+
+        narrowMargin (int) :
+            stimulus intensities kept on either side of the credible interval, default 2
+
+        coarseStep (int) :
+            If given, the stimulus search is coarse-to-fine: every coarseStep-th candidate intensity is scored first,
+            then the intensities around the coarseTop best of those. For stimulus sets in the hundreds this scores
+            a fraction of the intensities, and picks the exhaustive choice unless the expected entropy has several
+            narrow minima. Default None, exhaustive search
+
+        coarseTop (int) :
+            number of best coarse candidates refined around, default 2
+
+        batch (bool) :
+            If True, expected entropies are evaluated by the process-wide PsiEngine, stacked with those of every other
+            batched Psi object with the same configuration, e.g. the staircases of all booths on a client.
+
     How to use
     ----------
         Create a psi object instance with all relevant arguments. Selecting a correct search space for the threshold,
@@ -201,21 +808,44 @@ class Psi:
         Example:
             >>> stim = obj.xCurrent
         NOTE: if obj.xCurrent returns None, the calculation is not yet finished.
-        This can be avoided by waiting until xCurrent has a numeric value, e.g.:
-            >>> while obj.xCurrent == None:
-                    pass # hang in this loop until the psi calculation has finished
-                stim = obj.xCurrent
+        Wait for the future in the field nextStim instead, which resolves to the stimulus intensity, e.g.:
+            >>> stim = obj.nextStim.result()  # block until the psi calculation has finished
+        or, without blocking a Twisted reactor:
+            >>> stim = yield Deferred.fromFuture(asyncio.wrap_future(obj.nextStim))
 
         After each trial, update the psi staircase with the subject response, by calling the addData method.
+        It returns the nextStim future.
 
         Example:
             >>> obj.addData(resp)
+
+        Each update appends a record to the list in the field diagnostics, with keys
+            trial, stimIndex, response : trial count, index into stimRange of the stimulus, and the response added
+            queueTime : seconds from addData until the worker started the update, > 0 if it is falling behind
+            computeTime : seconds the update took, speculationTime : seconds spent speculating on it during the trial
+            tempBytes : bytes of the temporaries of the stimulus search and posterior update
+            expectedInfoGain, realizedInfoGain : entropy drop (nats) predicted for the stimulus, and the actual one
+            nextStimIndex : index into stimRange of the next stimulus
+            stdThreshold, stdSlope, stdGuess, stdLapse : posterior SDs after the update
+
+        Example:
+            >>> obj.diagnostics[-1]['computeTime']
+
+        The state of the staircase can be saved to a compact .npz file, and loaded into a new working Psi object.
+
+        Example:
+            >>> obj.save('session.npz')
+                obj = Psi.load('session.npz')
     """
+    saveFormat = 1  # bump when the layout or meaning of the saved arrays changes
 
     def __init__(self, stimRange, Pfunction='cGauss', nTrials=50, threshold=None, thresholdPrior=('uniform', None),
                  slope=None, slopePrior=('uniform', None),
                  guessRate=None, guessPrior=('uniform', None), lapseRate=None, lapsePrior=('uniform', None),
-                 marginalize=True, thread=True):
+                 marginalize=True, thread=True, precision='float64', logSpace=False, nWorkers=1, chunkSize=None,
+                 speculate=False, cacheDir=None, pruneTolerance=0, prior=None, stopThresholdSD=None, stopSlopeSD=None,
+                 stopInfoGain=None, stopMinTrials=0, narrowStim=None, narrowMargin=2, coarseStep=None, coarseTop=2,
+                 batch=False):
 
         # Psychometric function parameters
         self.stimRange = stimRange  # range of stimulus intensities
@@ -227,6 +857,25 @@ class Psi:
         self.marginalize = marginalize  # marginalize out nuisance parameters gamma and lambda?
         self.psyfun = Pfunction
         self.thread = thread
+        self.dtype = np.dtype(precision)
+        self.logSpace = logSpace and not marginalize
+        self.nWorkers = nWorkers
+        self.chunkSize = chunkSize
+        self.speculate = speculate and thread
+        self.pruneTolerance = pruneTolerance
+        self.stopThresholdSD = stopThresholdSD
+        self.stopSlopeSD = stopSlopeSD
+        self.stopInfoGain = stopInfoGain
+        self.stopMinTrials = stopMinTrials
+        self.narrowStim = narrowStim
+        self.narrowMargin = narrowMargin
+        self.coarseStep = coarseStep
+        self.coarseTop = coarseTop
+        self.speculation = None
+        # persistent worker running the posterior updates and stimulus searches, one at a time and in order
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='PsiWorker') if thread else None
+        self.batch = batch
+        self.engine = getPsiEngine() if batch else None
 
         if threshold is not None:
             self.threshold = threshold
@@ -260,25 +909,31 @@ class Psi:
         # then gamma can be left out, as the distributions will be the same
         self.gammaEQlambda = np.all([np.array_equal(self.guessRate, self.lapseRate),
                                      np.array_equal(self.priorGamma, self.priorLambda)])
-        # likelihood: table of conditional probabilities p(response | alpha,sigma,gamma,lambda,x)
+        # likelihood: factorized table of conditional probabilities p(response | alpha,sigma,gamma,lambda,x)
         # prior: prior probability over all parameters p_0(alpha,sigma,gamma,lambda)
-        if self.gammaEQlambda:
-            self.dimensions = (len(self.threshold), len(self.slope), len(self.lapseRate), len(self.stimRange))
-            self.likelihood = np.reshape(
-                pf(cartesian((self.threshold, self.slope, self.lapseRate, self.stimRange)), psyfun=Pfunction), self.dimensions)
-            # row-wise products of prior probabilities
-            self.prior = np.reshape(
-                np.prod(cartesian((self.priorMu, self.priorSigma, self.priorLambda)), axis=1), self.dimensions[:-1])
-        else:
-            self.dimensions = (len(self.threshold), len(self.slope), len(self.guessRate), len(self.lapseRate), len(self.stimRange))
-            self.likelihood = np.reshape(
-                pf(cartesian((self.threshold, self.slope, self.guessRate, self.lapseRate, self.stimRange)), psyfun=Pfunction), self.dimensions)
-            # row-wise products of prior probabilities
-            self.prior = np.reshape(
-                np.prod(cartesian((self.priorMu, self.priorSigma, self.priorGamma, self.priorLambda)), axis=1), self.dimensions[:-1])
-
-        # normalize prior
-        self.prior = self.prior / np.sum(self.prior)
+        self.cacheKey = TableCache.key(self.stimRange, self.threshold, self.slope, self.guessRate, self.lapseRate,
+                                       thresholdPrior, slopePrior, guessPrior, lapsePrior, Pfunction,
+                                       self.dtype.str, bool(self.gammaEQlambda))
+        # Psi objects with equal batchKey can have their expected entropies evaluated together by a PsiEngine
+        self.batchKey = (self.cacheKey, self.marginalize, self.logSpace, self.pruneTolerance, self.narrowStim,
+                         self.narrowMargin, self.coarseStep, self.coarseTop)
+        self.tableCache = getTableCache(cacheDir)
+        self.tableKeys = []  # keys of the tables acquired from tableCache, released by close
+        # close, or the garbage collector if the object is dropped without close
+        self.finalizer = weakref.finalize(self, releaseResources, self.worker, self.tableCache, self.tableKeys)
+        tables = self.__acquireTables(self.cacheKey, ('core', 'prior'), lambda: {
+            'core': Likelihood.computeCore(self.threshold, self.slope, self.stimRange, Pfunction, self.dtype),
+            'prior': self.__genJointPrior()})
+        core = tables['core']
+        self.prior = tables['prior']
+        if prior is not None:
+            if np.shape(prior) != self.prior.shape:
+                raise ValueError(f"prior of shape {np.shape(prior)} does not match the parameter grid {self.prior.shape}")
+            self.prior = np.asarray(prior, dtype=self.prior.dtype) / np.sum(prior)
+        self.warmStarted = prior is not None
+        self.likelihood = Likelihood(self.threshold, self.slope, self.guessRate, self.lapseRate, self.stimRange,
+                                     psyfun=Pfunction, gammaEQlambda=self.gammaEQlambda, dtype=self.dtype, core=core)
+        self.dimensions = self.likelihood.shape
 
         # Set probability density function to prior
         self.pdf = np.copy(self.prior)
@@ -287,11 +942,28 @@ class Psi:
         self.iTrial = 0
         self.nTrials = nTrials
         self.stop = 0
+        self.stopReason = None
         self.response = []
         self.stim = []
+        self.thresholdTrace = []  # (eThreshold, stdThreshold) after each update
+        self.diagnostics = []  # one record per update, see __update
+        self.logLikelihood = None  # log likelihood table of replay
+
+        # Buffers reused by every call to minEntropyStim
+        self.__allocateWorkspace()
 
         # Generate the first stimulus intensity
+        self.__updateMarginals()
         self.minEntropyStim()
+        self.nextStim = self.__submit(lambda: self.xCurrent)
+
+    def __genJointPrior(self):
+        """Normalized prior over all parameters, as the outer product of the per-parameter priors."""
+        if self.gammaEQlambda:
+            prior = np.einsum('a,b,d->abd', self.priorMu, self.priorSigma, self.priorLambda)
+        else:
+            prior = np.einsum('a,b,c,d->abcd', self.priorMu, self.priorSigma, self.priorGamma, self.priorLambda)
+        return prior / np.sum(prior)
 
     def __genprior(self, x, distr='uniform', mu=0, sig=1):
         """Generate prior probability distribution for variable.
@@ -335,6 +1007,112 @@ class Psi:
             p = np.ones(nx) / nx
         return p
 
+    def save(self, file, metadata=None):
+        """Save the grids, settings, posterior and history of this staircase to a compressed .npz file.
+
+        Only plain arrays and a JSON string are written, so the file does not depend on pickle, and can be loaded with
+        any NumPy version. Tables that can be recomputed from the grids are left out.
+
+        Arguments
+        ---------
+            file : str, Path or file-like object
+
+            metadata : dict (optional)
+                JSON-serializable information to store with the staircase, e.g. how its grids were chosen
+        """
+        self.nextStim.result()  # let a running update finish
+        settings = {
+            'Pfunction': self.psyfun, 'nTrials': self.nTrials, 'marginalize': self.marginalize,
+            'thresholdPrior': self.thresholdPrior, 'slopePrior': self.slopePrior, 'guessPrior': self.guessPrior,
+            'lapsePrior': self.lapsePrior, 'precision': self.dtype.name, 'logSpace': self.logSpace,
+            'pruneTolerance': self.pruneTolerance, 'stopThresholdSD': self.stopThresholdSD,
+            'stopSlopeSD': self.stopSlopeSD, 'stopInfoGain': self.stopInfoGain, 'stopMinTrials': self.stopMinTrials,
+            'narrowStim': self.narrowStim, 'narrowMargin': self.narrowMargin, 'coarseStep': self.coarseStep,
+            'coarseTop': self.coarseTop,
+        }
+        # The prior of a warm-started staircase is needed to replay its trials
+        warmStart = {'prior': self.prior} if self.warmStarted else {}
+        saveArrays(
+            file, saveFormat=self.saveFormat, settings=json.dumps(settings, default=float),
+            stimRange=self.stimRange, threshold=self.threshold, slope=self.slope, guessRate=self.guessRate,
+            lapseRate=self.lapseRate, pdf=self.pdf, stim=np.asarray(self.stim, dtype=np.float64),
+            response=np.asarray(self.response, dtype=np.int8), iTrial=self.iTrial, xCurrent=self.xCurrent,
+            pThreshold=self.pThreshold, pSlope=self.pSlope, pGuess=self.pGuess, pLapse=self.pLapse,
+            postMean=self.postMean, postStd=self.postStd, thresholdTrace=np.reshape(self.thresholdTrace, (-1, 2)),
+            estimates=[self.eThreshold, self.eSlope, self.eGuess, self.eLapse],
+            stds=[self.stdThreshold, self.stdSlope, self.stdGuess, self.stdLapse],
+            metadata=json.dumps(metadata or {}, default=float), **warmStart)
+
+    @classmethod
+    def load(cls, file, **kwargs):
+        """Rebuild a working Psi object from a file written by save.
+
+        Arguments
+        ---------
+            file : str, Path or file-like object
+
+            kwargs :
+                further Psi arguments, e.g. thread, cacheDir or batch, which override the saved settings and prior
+
+        Returns
+        -------
+        Psi object with the saved prior, posterior and history, and the stimulus intensity for the next trial selected
+        """
+        with np.load(file, allow_pickle=False) as data:
+            if int(data['saveFormat']) > cls.saveFormat:
+                raise ValueError(f"Psi save format {int(data['saveFormat'])} is newer than this version "
+                                 f"({cls.saveFormat}) of PsiMarginal")
+            settings = json.loads(str(data['settings']))
+            for name in ('thresholdPrior', 'slopePrior', 'guessPrior', 'lapsePrior'):
+                settings[name] = tuple(settings[name])
+            if 'prior' in data.files:
+                settings['prior'] = data['prior']
+            settings.update(kwargs)
+            psi = cls(data['stimRange'], threshold=data['threshold'], slope=data['slope'],
+                      guessRate=data['guessRate'], lapseRate=data['lapseRate'], **settings)
+            # Wait for the worker, so the selection for the prior is not mixed up with the restored one
+            psi.nextStim.result()
+            psi.pdf = np.array(data['pdf'], dtype=psi.prior.dtype)
+            psi.stim = data['stim'].tolist()
+            psi.response = data['response'].tolist()
+            psi.iTrial = int(data['iTrial']) - 1  # minEntropyStim counts the trial again
+            psi.thresholdTrace = []
+        psi.__updateMarginals()
+        psi.minEntropyStim()
+        psi.nextStim = psi.__submit(lambda: psi.xCurrent)
+        return psi
+
+    @classmethod
+    def loadPrior(cls, file, tempering=1.0, **grid):
+        """Posterior saved by Psi.save, as prior for a new staircase.
+
+        Arguments
+        ---------
+            file : str, Path or file-like object
+
+            tempering (float) :
+                the posterior is raised to this power and renormalized. 1 keeps it as is, values towards 0 flatten it
+                towards a uniform prior, so a changed threshold is picked up quickly
+
+            grid :
+                Psi arguments of the new staircase: stimRange, Pfunction and the parameter grids
+
+        Returns
+        -------
+        ndarray to pass as Psi prior, or None if the saved staircase used other grids
+        """
+        with np.load(file, allow_pickle=False) as data:
+            if int(data['saveFormat']) > cls.saveFormat:
+                return None
+            if json.loads(str(data['settings']))['Pfunction'] != grid.get('Pfunction', 'cGauss'):
+                return None
+            for name in ('stimRange', 'threshold', 'slope', 'guessRate', 'lapseRate'):
+                if name in grid and not np.array_equal(data[name], grid[name]):
+                    return None
+            # Only decompress the pdf once the grids are known to match
+            prior = np.power(data['pdf'], tempering)
+        return prior / np.sum(prior)
+
     def meta_data(self):
         import time
         import sys
@@ -356,72 +1134,543 @@ class Psi:
         metadata['lapsePrior'] = self.lapsePrior
         return metadata
 
-    def __entropy(self, pdf):
-        """Calculate shannon entropy of posterior distribution.
+    def __allocateWorkspace(self):
+        """Preallocate the buffers used by minEntropyStim.
+
+        All per-trial temporaries are written in place into these buffers, so the memory footprint of a Psi object
+        stays flat over a session. The joint probability buffers double as posterior buffers, as the normalization
+        by p(r|x) is also done in place. When marginalizing, these buffers only span threshold x slope: the nuisance
+        parameters are contracted out of the likelihood and pdf before the joint is formed.
+
+        The stimulus axis is evaluated in chunks of chunkSize intensities, and there is one pair of buffers, sized for
+        one chunk, per worker thread. Batches of several pdfs use temporary buffers instead.
+        """
+        self.nX = len(self.stimRange)
+        self.nDims = len(self.dimensions) - 1
+        if self.chunkSize is None:
+            self.chunkSize = int(np.ceil(self.nX / self.nWorkers))
+        self.workspaces = queue.SimpleQueue()
+        if self.logSpace:
+            # dense likelihood flattened to (parameter combinations, x), plus the -L*log(L) and -(1-L)*log(1-L) tables.
+            # These are the largest tables, so they are shared like the core
+            def computeLogSpaceTables():
+                likelihoodFlat = np.asarray(self.likelihood).reshape(-1, self.nX)
+                return {'likelihoodFlat': likelihoodFlat, 'entrSuccess': entr(likelihoodFlat),
+                        'entrFailure': entr(1 - likelihoodFlat)}
+            tables = self.__acquireTables(TableCache.key(self.cacheKey, 'logSpace'),
+                                          ('likelihoodFlat', 'entrSuccess', 'entrFailure'), computeLogSpaceTables)
+            self.likelihoodFlat = tables['likelihoodFlat']
+            self.entrSuccess = tables['entrSuccess']
+            self.entrFailure = tables['entrFailure']
+            return
+        # Axes are counted from the end, so the pdfs can be stacked along a leading batch axis
+        self.nuisanceAxes = tuple(range(2 - self.nDims, 0))  # guess and lapse rate axes
+        if self.marginalize:
+            self.jointDims = self.dimensions[:2]
+        else:
+            self.jointDims = self.dimensions[:-1]
+        self.sumAxes = tuple(range(-len(self.jointDims) - 1, -1))  # sum over all axes except the stimulus intensity axis
+        self.workspaces = newWorkspaces(min(self.nWorkers, int(np.ceil(self.nX / self.chunkSize))),
+                                        int(np.prod(self.jointDims)) * self.chunkSize, self.dtype)
+
+    def __getstate__(self):
+        # Let queued work finish, and leave out the worker, futures, workspace, log-space and replay tables.
+        # They are rebuilt on unpickling
+        if self.worker is not None:
+            self.worker.submit(int).result()
+        state = self.__dict__.copy()
+        for name in ('workspaces', 'likelihoodFlat', 'entrSuccess', 'entrFailure', 'worker', 'engine', 'nextStim',
+                     'speculation', 'tableCache', 'tableKeys', 'finalizer'):
+            state.pop(name, None)
+        state['logLikelihood'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='PsiWorker') if self.thread else None
+        self.engine = getPsiEngine() if self.batch else None
+        # The unpickled likelihood and prior are private copies
+        self.tableCache = None
+        self.tableKeys = []
+        self.finalizer = weakref.finalize(self, releaseResources, self.worker, self.tableCache, self.tableKeys)
+        self.__allocateWorkspace()
+        self.nextStim = self.__submit(lambda: self.xCurrent)
+        if self.speculate:
+            self.speculation = self.__submit(self.__speculate, self.pdf, self.minEntropyInd)
+
+    def __submit(self, fn, *args):
+        """Run fn on the worker, or right away if thread is False. Returns a Future of its result either way."""
+        return submitWork(self.worker, fn, *args)
+
+    def __acquireTables(self, key, names, compute):
+        """Take shared read-only tables from tableCache, or compute private ones if there is no tableCache."""
+        if self.tableCache is None:
+            return compute()
+        tables = self.tableCache.acquire(key, names, compute)
+        self.tableKeys.append(key)
+        return tables
+
+    @property
+    def nbytes(self):
+        """Memory taken by the tables, pdf and workspace of this object, counting shared tables in full."""
+        nbytes = self.likelihood.nbytes + self.prior.nbytes + self.pdf.nbytes
+        if self.logSpace:
+            return nbytes + self.likelihoodFlat.nbytes + self.entrSuccess.nbytes + self.entrFailure.nbytes
+        nBuffers = min(self.nWorkers, int(np.ceil(self.nX / self.chunkSize)))
+        return nbytes + 2 * nBuffers * int(np.prod(self.jointDims)) * self.chunkSize * self.dtype.itemsize
+
+    def close(self):
+        """Stop the worker once any queued work is done, and release the shared tables.
+
+        The Psi object can still be saved afterwards, the tables stay mapped as long as it is referenced. A Psi object
+        dropped without close is closed when it is garbage collected.
+        """
+        releaseResources(self.worker, self.tableCache, self.tableKeys)
+
+    def __chunkEntropy(self, shared, stim):
+        """Expected entropy terms for a chunk of stimulus intensities.
+
         Arguments
         ---------
-            pdf :   ndarray (float64)
-                    posterior distribution of psychometric curve parameters for each stimuli
+            shared : dict
+                terms that only depend on the pdfs, computed once for all chunks by expectedEntropy
 
+            stim : 1D numpy array
+                indices of the stimulus intensities in this chunk
 
         Returns
         -------
-        1D numpy array (float64) : Shannon entropy of posterior for each stimuli
+        tuple of (batch, stimulus) numpy arrays: p(success|x), p(failure|x), entropy after success, entropy after failure
         """
-        # Marginalize out all nuisance parameters, i.e. all except alpha and sigma
-        postDims = np.ndim(pdf)
-        if self.marginalize == True:
-            while postDims > 3:  # marginalize out second-to-last dimension, last dim is x
-                pdf = np.sum(pdf, axis=-2)
-                postDims -= 1
-        # find expected entropy, suppress divide-by-zero and invalid value warnings
-        # as this is handled by the NaN redefinition to 0
-        with np.errstate(divide='ignore', invalid='ignore'):
-            entropy = np.multiply(pdf, np.log(pdf))
-        entropy[np.isnan(entropy)] = 0  # define 0*log(0) to equal 0
-        dimSum = tuple(range(postDims - 1))  # dimensions to sum over. also a Chinese dish
-        entropy = -(np.sum(entropy, axis=dimSum))
-        return entropy
+        if self.logSpace:
+            # With posterior L*pdf/p, the entropy term p*H = sum(-L*pdf*log(L*pdf/p)) splits into
+            # pdf.entr(L) + entr(pdf).L - entr(p), so only matrix-vector products over the flattened grid are needed.
+            likelihood = self.likelihoodFlat[:, stim]
+            pdf, entrPdf = shared['pdf'], shared['entrPdf']  # (batch, parameter combinations)
+            pSuccessGivenx = np.dot(pdf, likelihood)
+            pFailureGivenx = shared['pdfSum'] - pSuccessGivenx
+            entrPdfLikelihood = np.dot(entrPdf, likelihood)
+            success = np.dot(pdf, self.entrSuccess[:, stim]) + entrPdfLikelihood - entr(pSuccessGivenx)
+            failure = np.dot(pdf, self.entrFailure[:, stim]) + (shared['entrPdfSum'] - entrPdfLikelihood) - \
+                entr(pFailureGivenx)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return pSuccessGivenx, pFailureGivenx, success / pSuccessGivenx, failure / pFailureGivenx
+
+        successBuffer, failureBuffer = self.workspaces.get()
+        try:
+            box = shared['box']
+            jointDims = (box[0].stop - box[0].start, box[1].stop - box[1].start) + self.jointDims[2:]
+            shape = (shared['nBatch'],) + jointDims + (len(stim),)
+            if successBuffer.size < np.prod(shape):
+                # Batches of several pdfs get temporary buffers, so the workspace stays the size of a single pdf
+                pTplus1success, pTplus1failure = np.empty(shape, self.dtype), np.empty(shape, self.dtype)
+            else:
+                pTplus1success = successBuffer[:int(np.prod(shape))].reshape(shape)
+                pTplus1failure = failureBuffer[:int(np.prod(shape))].reshape(shape)
+            if self.marginalize:
+                # Probabilities of response r (success, failure) and threshold/slope values after presenting a
+                # stimulus with stimulus intensity x at the next trial. The guess and lapse rates are summed out
+                # while contracting the likelihood with the pdf, so only p(alpha, sigma, r | x) is ever formed
+                self.likelihood.contract(None, out=pTplus1success, stim=stim, sums=shared['sums'], box=box)
+                np.subtract(shared['pdfMarginal'][..., np.newaxis], pTplus1success, out=pTplus1failure)
+            else:
+                # Probabilities of response r (succes, failure) after presenting a stimulus
+                # with stimulus intensity x at the next trial, multiplied with the prior (pdfND)
+                self.likelihood.fill(pTplus1success[0], stim=stim, box=box)
+                np.multiply(pTplus1success[:1], shared['pdfND'], out=pTplus1success, casting='same_kind')
+                np.subtract(shared['pdfND'], pTplus1success, out=pTplus1failure)
+
+            # p(r|x), and the entropy of the posterior p(alpha, sigma | x, r) for the next trial at intensity x,
+            # producing response r
+            return responseEntropies(pTplus1success, pTplus1failure, self.sumAxes)
+        finally:
+            self.workspaces.put((successBuffer, failureBuffer))
+
+    def expectedEntropy(self, pdfs, stimIndices=None):
+        """Calculate the expected entropy of the posterior after presenting each stimulus intensity.
+
+        Arguments
+        ---------
+            pdfs : ndarray
+                probability distributions over the parameters, stacked along a leading batch axis. Any pdf over the
+                parameter grid of this object can be evaluated, e.g. those of other Psi objects with the same batchKey
+
+            stimIndices : 1D numpy array (optional)
+                indices into stimRange to evaluate, default all
+
+        Returns
+        -------
+        dict of (batch, stimulus) numpy arrays, one value per pdf and stimulus intensity: pSuccessGivenx,
+        pFailureGivenx, entropySuccess, entropyFailure and expectEntropy. With pruning, also prunedMass (batch,) and
+        pruneErrorBound (batch, stimulus). Intensities left out of stimIndices are NaN, and inf in expectEntropy
+        """
+        if stimIndices is None:
+            stimIndices = np.arange(self.nX)
+        nBatch = len(pdfs)
+        if self.logSpace:
+            pdfFlat = pdfs.reshape(nBatch, -1)
+            entrPdf = entr(pdfFlat)
+            shared = {'pdf': pdfFlat, 'entrPdf': entrPdf, 'pdfSum': np.sum(pdfFlat, axis=1, keepdims=True),
+                      'entrPdfSum': np.sum(entrPdf, axis=1, keepdims=True)}
+        else:
+            pdfMarginal = np.sum(pdfs, axis=self.nuisanceAxes)
+            box = self.__pruneBox(pdfMarginal)
+            pdfs = pdfs[(Ellipsis,) + box + (slice(None),) * len(self.nuisanceAxes)]
+            if self.marginalize:
+                shared = {'sums': self.likelihood.nuisanceSums(pdfs, self.likelihood.offset, self.likelihood.scale),
+                          'pdfMarginal': pdfMarginal[(Ellipsis,) + box]}
+            else:
+                # broadcast the pdf along the stimulus axis of the conditional prob table likelihood
+                shared = {'pdfND': pdfs[..., np.newaxis]}
+            shared['box'] = box
+        shared['nBatch'] = nBatch
+
+        nChunks = int(np.ceil(len(stimIndices) / self.chunkSize))
+        tempBytes = self.__tempBytes(shared, min(self.chunkSize, len(stimIndices)), min(self.nWorkers, nChunks))
+        pSuccessGivenx, pFailureGivenx, entropySuccess, entropyFailure = \
+            searchChunks(self.__chunkEntropy, shared, stimIndices, self.chunkSize, self.nWorkers)
+        expected = {
+            'pSuccessGivenx': pSuccessGivenx,
+            'pFailureGivenx': pFailureGivenx,
+            'entropySuccess': entropySuccess,
+            'entropyFailure': entropyFailure,
+            'expectEntropy': np.nan_to_num(entropySuccess * pSuccessGivenx) +
+                             np.nan_to_num(entropyFailure * pFailureGivenx),
+        }
+        if self.pruneTolerance > 0 and not self.logSpace:
+            prunedMass = np.maximum(1 - np.sum(pdfMarginal[(Ellipsis,) + box], axis=(1, 2)), 0)
+            expected['pruneErrorBound'] = self.__pruneErrorBound(prunedMass, pSuccessGivenx, pFailureGivenx)
+        if len(stimIndices) < self.nX:
+            for name, values in expected.items():
+                expected[name] = np.full((nBatch, self.nX), np.inf if name == 'expectEntropy' else np.nan)
+                expected[name][:, stimIndices] = values
+        if self.pruneTolerance > 0 and not self.logSpace:
+            expected['prunedMass'] = prunedMass
+        expected['tempBytes'] = np.full(nBatch, tempBytes)
+        return expected
+
+    def __tempBytes(self, shared, chunkLength, concurrentChunks):
+        """Bytes of the temporaries of one expectedEntropy call: the shared terms, plus the per-chunk workspace (or
+        likelihood table columns in log space) of the chunks evaluated at the same time."""
+        arrays = [value for value in shared.values() if isinstance(value, np.ndarray)] + list(shared.get('sums', []))
+        sharedBytes = sum(array.nbytes for array in arrays if array.base is None)
+        if self.logSpace:
+            chunkBytes = 3 * self.likelihoodFlat.shape[0] * chunkLength * self.likelihoodFlat.itemsize
+        else:
+            box = shared['box']
+            jointSize = (box[0].stop - box[0].start) * (box[1].stop - box[1].start) * int(np.prod(self.jointDims[2:]))
+            chunkBytes = 2 * shared['nBatch'] * jointSize * chunkLength * self.dtype.itemsize
+        return sharedBytes + concurrentChunks * chunkBytes
+
+    def __pruneBox(self, pdfMarginal):
+        """Threshold and slope ranges holding all but pruneTolerance of the mass of every pdf in the batch.
+
+        Each axis drops at most pruneTolerance / 4 of marginal mass from either end, so the box holds at least
+        1 - pruneTolerance of each pdf. Without pruning, this is the whole grid.
+        """
+        ranges = []
+        for axis in (2, 1):  # threshold marginal sums over slope, and vice versa
+            n = pdfMarginal.shape[3 - axis]
+            if self.pruneTolerance <= 0:
+                ranges.append(slice(0, n))
+                continue
+            cumulative = np.cumsum(np.sum(pdfMarginal, axis=axis), axis=1)
+            total = cumulative[:, -1:]
+            tail = self.pruneTolerance / 4 * total
+            start = np.min(np.sum(cumulative <= tail, axis=1))
+            stop = n - np.min(np.sum(total - cumulative[:, :-1] <= tail, axis=1))
+            ranges.append(slice(int(min(start, stop - 1)), int(stop)))
+        return tuple(ranges)
+
+    def __pruneErrorBound(self, prunedMass, pSuccessGivenx, pFailureGivenx):
+        """Bound on the error in expected entropy from leaving prunedMass out of the evaluated posteriors.
+
+        For each response, the pruned posterior is within total variation distance delta = prunedMass / p(r|x) of
+        the full posterior, so its entropy is within delta * log(N - 1) + h(delta) of the full entropy
+        (Fannes-Audenaert), with N the number of grid cells and h the binary entropy.
+        """
+        logCells = np.log(int(np.prod(self.jointDims)) - 1)
+        bound = 0
+        for pResponse in (pSuccessGivenx, pFailureGivenx):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                delta = np.minimum(np.nan_to_num(prunedMass[:, np.newaxis] / pResponse, nan=1, posinf=1), 1)
+            bound = bound + pResponse * (delta * logCells + entr(delta) + entr(1 - delta))
+        return bound
+
+    def __evaluate(self, *pdfs):
+        """expectedEntropy of each pdf, as a list of dicts, over the stimulus intensities worth searching."""
+        stimIndices = self.__candidates(pdfs)
+        if self.coarseStep is None:
+            return self.__evaluateAt(pdfs, stimIndices)
+        candidates = np.arange(self.nX) if stimIndices is None else stimIndices
+        if len(candidates) <= 2 * self.coarseStep:
+            return self.__evaluateAt(pdfs, stimIndices)
+
+        # Score a subsample of the candidates, every coarseStep-th and the last one
+        coarse = np.union1d(candidates[::self.coarseStep], candidates[-1:])
+        results = self.__evaluateAt(pdfs, coarse)
+        # then the candidates between the best coarse ones and their coarse neighbours
+        fine = []
+        for expected in results:
+            for best in np.argsort(expected['expectEntropy'])[:self.coarseTop]:
+                position = np.searchsorted(candidates, best)
+                fine.append(candidates[max(position - self.coarseStep + 1, 0):position + self.coarseStep])
+        fine = np.setdiff1d(np.concatenate(fine), coarse)
+        if len(fine) == 0:
+            return results
+        for expected, refined in zip(results, self.__evaluateAt(pdfs, fine)):
+            for name, values in refined.items():
+                if name == 'tempBytes':
+                    expected[name] = max(expected[name], values)
+                elif name != 'prunedMass':
+                    expected[name][fine] = values[fine]
+        return results
+
+    def __evaluateAt(self, pdfs, stimIndices):
+        """expectedEntropy of each pdf at stimIndices, as a list of dicts. Goes through the PsiEngine if batch."""
+        if self.engine is not None:
+            return self.engine.submit(self, pdfs, stimIndices).result()
+        expected = self.expectedEntropy(np.stack(pdfs), stimIndices)
+        return [{name: value[i] for name, value in expected.items()} for i in range(len(pdfs))]
+
+    def __narrowRanges(self, pdfs):
+        """Start and stop index of the stimulus intensities worth searching for each pdf, see narrowStim."""
+        pdfs = np.asarray(pdfs)
+        tail = (1 - self.narrowStim) / 2
+        cumulative = np.cumsum(np.sum(pdfs, axis=tuple(range(2, pdfs.ndim))), axis=1)
+        cumulative /= cumulative[:, -1:]
+        # np.searchsorted on each row of cumulative
+        low = self.threshold[np.sum(cumulative < tail, axis=1)]
+        high = self.threshold[np.minimum(np.sum(cumulative < 1 - tail, axis=1), cumulative.shape[1] - 1)]
+        start = np.maximum(np.searchsorted(self.stimRange, low) - self.narrowMargin, 0)
+        stop = np.minimum(np.searchsorted(self.stimRange, high, side='right') + self.narrowMargin, self.nX)
+        return start, stop
+
+    def __candidates(self, pdfs):
+        """Indices of the stimulus intensities worth searching for any of the pdfs, None for all. See narrowStim."""
+        if self.narrowStim is None:
+            return None
+        start, stop = self.__narrowRanges(pdfs)
+        start, stop = np.min(start), np.max(stop)
+        if stop - start >= self.nX:
+            return None
+        return np.arange(start, max(stop, start + 1))
+
+    def candidateMask(self, pdfs):
+        """(batch, stimulus) bool array, True at the stimulus intensities worth searching for each pdf. See narrowStim.
+        """
+        mask = np.ones((len(pdfs), self.nX), dtype=bool)
+        if self.narrowStim is None:
+            return mask
+        start, stop = self.__narrowRanges(pdfs)
+        stimIndices = np.arange(self.nX)
+        return (stimIndices >= start[:, np.newaxis]) & (stimIndices < np.maximum(stop, start + 1)[:, np.newaxis])
+
+    def selectStims(self, pdfs):
+        """Index into stimRange of the stimulus intensity a staircase with each pdf would select next.
+
+        Selects as minEntropyStim does, with the narrowStim and coarseStep settings of this object, but for all pdfs
+        in one or two expectedEntropy passes. Each pdf's candidate intensities are applied as a mask over the expected
+        entropies of the union of the candidates.
+
+        Arguments
+        ---------
+            pdfs : ndarray
+                probability distributions over the parameters, stacked along a leading batch axis
+
+        Returns
+        -------
+        1D numpy array of stimulus indices, one per pdf
+        """
+        mask = self.candidateMask(pdfs)
+        if self.coarseStep is None:
+            return np.argmin(self.__maskedEntropy(pdfs, mask), axis=1)
+
+        # Every coarseStep-th and the last candidate of each pdf, or all of them if there are few
+        coarse = np.zeros_like(mask)
+        for row, candidates in zip(coarse, mask):
+            candidates = np.flatnonzero(candidates)
+            row[candidates if len(candidates) <= 2 * self.coarseStep else
+                np.union1d(candidates[::self.coarseStep], candidates[-1:])] = True
+        expectEntropy = self.__maskedEntropy(pdfs, coarse)
+        # then the candidates between the best coarse ones and their coarse neighbours
+        fine = np.zeros_like(mask)
+        for row, candidates, expected in zip(fine, mask, expectEntropy):
+            candidates = np.flatnonzero(candidates)
+            if len(candidates) <= 2 * self.coarseStep:
+                continue
+            for best in np.argsort(expected)[:self.coarseTop]:
+                position = np.searchsorted(candidates, best)
+                row[candidates[max(position - self.coarseStep + 1, 0):position + self.coarseStep]] = True
+        fine &= ~coarse
+        if np.any(fine):
+            expectEntropy = np.where(fine, self.__maskedEntropy(pdfs, fine), expectEntropy)
+        return np.argmin(expectEntropy, axis=1)
+
+    def __maskedEntropy(self, pdfs, mask):
+        """expectEntropy of each pdf over the intensities in any row of mask, inf outside the pdf's row."""
+        stimIndices = np.flatnonzero(np.any(mask, axis=0))
+        expected = self.expectedEntropy(np.asarray(pdfs), None if len(stimIndices) == self.nX else stimIndices)
+        return np.where(mask, expected['expectEntropy'], np.inf)
 
     def minEntropyStim(self):
         """Find the stimulus intensity based on the expected information gain.
 
         Minimum Shannon entropy is used as selection criterion for the stimulus intensity in the upcoming trial.
         """
-        self.pdf = self.pdf
-        self.nX = len(self.stimRange)
-        self.nDims = np.ndim(self.pdf)
-
-        # make pdf the same dims as conditional prob table likelihood
-        self.pdfND = np.expand_dims(self.pdf, axis=self.nDims)  # append new axis
-        self.pdfND = np.tile(self.pdfND, (self.nX))  # tile along new axis
-
-        # Probabilities of response r (succes, failure) after presenting a stimulus
-        # with stimulus intensity x at the next trial, multiplied with the prior (pdfND)
-        self.pTplus1success = np.multiply(self.likelihood, self.pdfND)
-        self.pTplus1failure = self.pdfND - self.pTplus1success
-
-        # Probability of success or failure given stimulus intensity x, p(r|x)
-        self.sumAxes = tuple(range(self.nDims))  # sum over all axes except the stimulus intensity axis
-        self.pSuccessGivenx = np.sum(self.pTplus1success, axis=self.sumAxes)
-        self.pFailureGivenx = np.sum(self.pTplus1failure, axis=self.sumAxes)
-
-        # Posterior probability of parameter values given stimulus intensity x and response r
-        # p(alpha, sigma | x, r)
-        self.posteriorTplus1success = self.pTplus1success / self.pSuccessGivenx
-        self.posteriorTplus1failure = self.pTplus1failure / self.pFailureGivenx
-
-        # Expected entropy for the next trial at intensity x, producing response r
-        self.entropySuccess = self.__entropy(self.posteriorTplus1success)
-        self.entropyFailure = self.__entropy(self.posteriorTplus1failure)
-        self.expectEntropy = np.multiply(self.entropySuccess, self.pSuccessGivenx) + np.multiply(self.entropyFailure,
-                                                                                                 self.pFailureGivenx)
+        self.__selectStim(self.__evaluate(self.pdf)[0])
+
+    def __selectStim(self, expected):
+        """Select the stimulus intensity of minimum expected entropy, given the expectedEntropy of the pdf."""
+        self.pSuccessGivenx = expected['pSuccessGivenx']
+        self.pFailureGivenx = expected['pFailureGivenx']
+        self.entropySuccess = expected['entropySuccess']
+        self.entropyFailure = expected['entropyFailure']
+        self.expectEntropy = expected['expectEntropy']
+        self.prunedMass = expected.get('prunedMass', 0.0)
+        self.pruneErrorBound = np.nanmax(expected['pruneErrorBound']) if 'pruneErrorBound' in expected else 0.0
         self.minEntropyInd = np.argmin(self.expectEntropy)  # index of smallest expected entropy
         self.xCurrent = self.stimRange[self.minEntropyInd]  # stim intensity at minimum expected entropy
+        self.entropy = self.__currentEntropy()
+        self.expectedInfoGain = self.entropy - self.expectEntropy[self.minEntropyInd]
 
         self.iTrial += 1
-        if self.iTrial == (self.nTrials - 1):
-            self.stop = 1
+        self.__checkStop()
+
+        # Work out the next stimulus for both possible responses while the current one is being presented
+        if self.speculate:
+            self.speculation = self.__submit(self.__speculate, self.pdf, self.minEntropyInd)
+
+    def __currentEntropy(self):
+        """Entropy of the current pdf, over threshold and slope if marginalizing, like expectEntropy."""
+        pdf = np.sum(self.pdf, axis=self.nuisanceAxes) if self.marginalize else self.pdf
+        return np.sum(entr(pdf))
+
+    def __checkStop(self):
+        """Set stop and stopReason from the trial count and the stopping rules."""
+        if self.iTrial >= (self.nTrials - 1):
+            self.stop, self.stopReason = 1, 'nTrials'
+        if self.stop or len(self.response) < self.stopMinTrials:
+            return
+        sdRules = [(std, limit) for std, limit in ((self.stdThreshold, self.stopThresholdSD),
+                                                   (self.stdSlope, self.stopSlopeSD)) if limit is not None]
+        if sdRules and all(std <= limit for std, limit in sdRules):
+            self.stop, self.stopReason = 1, 'SD'
+        elif self.stopInfoGain is not None and self.expectedInfoGain < self.stopInfoGain:
+            self.stop, self.stopReason = 1, 'infoGain'
+
+    def __speculate(self, pdf, stimIndex):
+        """Compute the posterior and expected entropies that follow a success and a failure at stimIndex."""
+        start = time.perf_counter()
+        posteriors = {response: self.__posterior(pdf, stimIndex, response) for response in (1, 0)}
+        expected = self.__evaluate(posteriors[1], posteriors[0])
+        for result in expected:
+            result['tempBytes'] = result['tempBytes'] + 2 * 2 * pdf.nbytes  # both posteriors, see __posterior
+        return {1: (posteriors[1], expected[0]), 0: (posteriors[0], expected[1]),
+                'computeTime': time.perf_counter() - start}
+
+    def __posterior(self, pdf, stimIndex, response):
+        """Normalized posterior after a response at stimIndex.
+
+        Only the slice of the likelihood at that stimulus intensity is needed, the workspace buffers are scratch space.
+        """
+        if response == 1:
+            pdf = pdf * self.likelihood.sliceAt(stimIndex)
+        elif response == 0:
+            pdf = pdf * (1 - self.likelihood.sliceAt(stimIndex))
+        return pdf / np.sum(pdf)
+
+    def replay(self, stim, response, trials=None, prior=None):
+        """Posteriors after logged trials, computed directly rather than by replaying them through addData.
+
+        The posterior after t trials only depends on how often each stimulus intensity got each response, so it is
+        log(prior) + counts . log(likelihood), normalized. The counts of all requested trial counts are formed at once
+        and multiplied with a table of log L and log(1 - L) in one matrix product, without any stimulus search.
+        Responses other than 0 and 1 leave the posterior unchanged, as in addData.
+
+        Arguments
+        ---------
+            stim : 1D array
+                stimulus intensities of the trials, values of stimRange
+
+            response : 1D array
+                responses of the trials, 1 for a success, 0 for a failure
+
+            trials : int or sequence of int (optional)
+                trial counts to give the posterior after, default only after all trials
+
+            prior : ndarray (optional)
+                prior the trials started from, e.g. the saved prior of a warm-started session, default the prior of this
+                object
+
+        Returns
+        -------
+        ndarray: the posterior, with a leading axis over trials if trials is a sequence
+        """
+        stimIndex = self.__stimIndices(stim)
+        response = np.asarray(response)
+        checkpoints = np.atleast_1d(len(response) if trials is None else trials)
+
+        # One-hot columns (intensity, response) per trial, cumulated over trials
+        counts = np.zeros((len(response) + 1, 2 * self.nX))
+        valid = np.isin(response, (0, 1))
+        counts[1 + np.flatnonzero(valid), stimIndex[valid] + self.nX * (1 - response[valid].astype(int))] = 1
+        counts = np.cumsum(counts, axis=0)[checkpoints]
+
+        if self.logLikelihood is None:  # taken on first use, and shared like the core
+            self.logLikelihood = self.__acquireTables(TableCache.key(self.cacheKey, 'replay'), ('logLikelihood',),
+                                                      lambda: {'logLikelihood': self.__logLikelihood()})['logLikelihood']
+        prior = self.prior if prior is None else prior
+        with np.errstate(divide='ignore'):
+            logPosterior = np.log(prior).reshape(1, -1) + counts @ self.logLikelihood
+        logPosterior -= np.max(logPosterior, axis=1, keepdims=True)
+        posterior = np.exp(logPosterior)
+        posterior /= np.sum(posterior, axis=1, keepdims=True)
+        posterior = posterior.reshape((len(checkpoints),) + self.prior.shape)
+        return posterior if np.ndim(trials) else posterior[0]
+
+    def __stimIndices(self, stim):
+        """Indices into stimRange of logged stimulus intensities."""
+        stimIndex = np.searchsorted(self.stimRange, stim)
+        if np.any(stimIndex >= self.nX) or not np.allclose(np.asarray(self.stimRange)[np.minimum(stimIndex,
+                                                                                                 self.nX - 1)], stim):
+            raise ValueError("stimulus intensities outside of stimRange")
+        return stimIndex
+
+    def resume(self, stim, response):
+        """Continue the staircase after logged trials, e.g. those of a session that crashed.
+
+        The posterior is rebuilt from the prior of this object as addData builds it, one likelihood slice per trial,
+        rather than with replay, whose table is only worth building for many sessions. The stimulus intensity for the
+        next trial is then selected as after load.
+
+        Arguments
+        ---------
+            stim : 1D array
+                stimulus intensities of the trials, values of stimRange
+
+            response : 1D array
+                responses of the trials, 1 for a success, 0 for a failure
+        """
+        self.nextStim.result()  # let a running update finish
+        pdf = self.prior
+        for stimIndex, trialResponse in zip(self.__stimIndices(stim), response):
+            pdf = self.__posterior(pdf, stimIndex, trialResponse)
+        self.pdf = np.asarray(pdf, dtype=self.prior.dtype)
+        self.stim = list(stim)
+        self.response = list(response)
+        self.iTrial = len(self.response)  # minEntropyStim counts the next trial
+        self.thresholdTrace = []
+        self.__updateMarginals()
+        self.minEntropyStim()
+        self.nextStim = self.__submit(lambda: self.xCurrent)
+
+    def __logLikelihood(self):
+        """log L and log(1 - L) at each stimulus intensity, as rows of a (2 * intensities, parameter combinations)
+        table. Zero probabilities are clipped, so a response they rule out drives the posterior to ~0, not NaN."""
+        likelihood = np.moveaxis(self.likelihood.fill(np.empty(self.dimensions)), -1, 0).reshape(self.nX, -1)
+        tiny = np.finfo(np.float64).tiny
+        return np.concatenate([np.log(np.maximum(likelihood, tiny)), np.log(np.maximum(1 - likelihood, tiny))])
 
     def addData(self, response):
         """
@@ -433,22 +1682,60 @@ class Psi:
                 1: correct/right
 
                 0: incorrect/left
+
+        Returns
+        -------
+        concurrent.futures.Future of the next stimulus intensity, also available as nextStim. The posterior and its
+        summaries are updated on the worker, they are current once this future is done.
         """
         self.stim.append(self.xCurrent)
         self.response.append(response)
 
         self.xCurrent = None
+        self.nextStim = self.__submit(self.__update, response, time.perf_counter())
+        return self.nextStim
 
-        # Keep the posterior probability distribution that corresponds to the recorded response
-        if response == 1:
-            # select the posterior that corresponds to the stimulus intensity of lowest entropy
-            self.pdf = self.posteriorTplus1success[Ellipsis, self.minEntropyInd]
-        elif response == 0:
-            self.pdf = self.posteriorTplus1failure[Ellipsis, self.minEntropyInd]
-
-        # normalize the pdf
-        self.pdf = self.pdf / np.sum(self.pdf)
+    def __update(self, response, submitted=None):
+        """Update the posterior with a response and select the next stimulus intensity. Runs on the worker.
 
+        Appends a record of the update to diagnostics, see the Psi docstring.
+        """
+        start = time.perf_counter()
+        stimIndex, entropy, expectedInfoGain = self.minEntropyInd, self.entropy, self.expectedInfoGain
+        speculationTime = 0.0
+        if self.speculate and response in (0, 1):
+            # The posterior and next stimulus for this response were computed while the trial ran. The speculation
+            # was queued on this worker before this update, so it has finished
+            speculation = self.speculation.result()
+            self.pdf, expected = speculation[response]
+            speculationTime = speculation['computeTime']
+        else:
+            # Keep the posterior probability distribution that corresponds to the recorded response
+            self.pdf = self.__posterior(self.pdf, self.minEntropyInd, response)
+            expected = self.__evaluate(self.pdf)[0]
+            expected['tempBytes'] = expected['tempBytes'] + 2 * self.pdf.nbytes
+        self.__updateMarginals()
+        self.__selectStim(expected)
+        self.diagnostics.append({
+            'trial': len(self.response),
+            'stimIndex': int(stimIndex),
+            'response': response,
+            'queueTime': start - (submitted or start),
+            'computeTime': time.perf_counter() - start,
+            'speculationTime': speculationTime,
+            'tempBytes': int(expected['tempBytes']),
+            'expectedInfoGain': float(expectedInfoGain),
+            'realizedInfoGain': float(entropy - self.entropy),
+            'nextStimIndex': int(self.minEntropyInd),
+            'stdThreshold': float(self.stdThreshold),
+            'stdSlope': float(self.stdSlope),
+            'stdGuess': float(self.stdGuess),
+            'stdLapse': float(self.stdLapse),
+        })
+        return self.xCurrent
+
+    def __updateMarginals(self):
+        """Marginal distributions, means and standard deviations of each parameter under the current pdf."""
         # Marginalized probabilities per parameter
         if self.gammaEQlambda:
             self.pThreshold = np.sum(self.pdf, axis=(1, 2))
@@ -473,11 +1760,9 @@ class Psi:
         self.stdLapse = np.sqrt(np.sum(np.multiply((self.lapseRate - self.eLapse) ** 2, self.pLapse)))
         self.stdGuess = np.sqrt(np.sum(np.multiply((self.guessRate - self.eGuess) ** 2, self.pGuess)))
 
-        # Start calculating the next minimum entropy stimulus
-        if self.thread:
-            threading.Thread(target=self.minEntropyStim).start()
-        else:
-            self.minEntropyStim()
+        # Posterior mean and SD of the psychometric curve over stimRange, and the threshold estimate after each update
+        self.postMean, self.postStd = self.likelihood.curveMoments(self.pdf)
+        self.thresholdTrace.append((self.eThreshold, self.stdThreshold))
 
     def plot(self, muRef=0, sigmaRef=0, lapseRef=0, guessRef=0, save=False, filename=None):
         """
@@ -522,14 +1807,7 @@ class Psi:
         else:
             ref = False
 
-        if self.gammaEQlambda:
-            postmean = np.sum(self.likelihood * self.pdfND, axis=(0, 1, 2))  # mean
-            poststd = np.sqrt(
-                np.sum(self.likelihood ** 2 * self.pdfND, axis=(0, 1, 2)) - postmean ** 2)  # std
-        else:
-            postmean = np.sum(self.likelihood * self.pdfND, axis=(0, 1, 2, 3))  # mean
-            poststd = np.sqrt(
-                np.sum(self.likelihood ** 2 * self.pdfND, axis=(0, 1, 2, 3)) - postmean ** 2)  # std
+        postmean, poststd = self.postMean, self.postStd  # kept up to date by each update
 
         plt.figure(figsize=(8, 7))
         plt.subplot(2, 2, 1)
@@ -577,3 +1855,285 @@ class Psi:
             else:
                 plt.savefig("PsiCurve.png")
         plt.show()
+
+
+class QuestPlus:
+    """QUEST+ staircase (Watson, 2017) with the next()/addResponse() interface of psychopy's QuestPlusHandler.
+
+    Runs on a Psi object with marginalize=False, so each stimulus minimizes the expected entropy of the posterior
+    over all four parameters, as in QUEST+. The likelihood tables come from the table cache, the posterior update and
+    stimulus search run on the Psi worker, and the state is saved with Psi.save.
+
+    Arguments
+    ---------
+        nTrials, intensityVals, thresholdVals, slopeVals, lowerAsymptoteVals, lapseRateVals :
+            as in QuestPlusHandler. The lower asymptote is the guess rate of Psi
+
+        responseVals : sequence of two values
+            response that counts as a success (probability given by the psychometric function), and as a failure
+
+        stimScale (str) : only 'linear' is supported
+
+        psychometricFunc (str) : only 'weibull' is supported, F(x) = 1 - exp(-(x / threshold) ** slope)
+
+        kwargs :
+            further Psi arguments, e.g. cacheDir, speculate, precision or chunkSize
+
+    How to use
+    ----------
+        As QuestPlusHandler:
+            >>> intensity = obj.next()  # raises StopIteration after nTrials responses
+                obj.addResponse(response)
+    """
+
+    def __init__(self, nTrials, intensityVals, thresholdVals, slopeVals, lowerAsymptoteVals, lapseRateVals,
+                 responseVals=(1, 0), stimScale='linear', psychometricFunc='weibull', **kwargs):
+        if stimScale != 'linear' or psychometricFunc != 'weibull':
+            raise ValueError("QuestPlus only supports a Weibull psychometric function on a linear stimulus scale")
+        self.responseVals = list(responseVals)
+        self.psi = Psi(intensityVals, Pfunction='Weibull', nTrials=nTrials, threshold=thresholdVals, slope=slopeVals,
+                       guessRate=lowerAsymptoteVals, lapseRate=lapseRateVals, marginalize=False, **kwargs)
+
+    @property
+    def finished(self):
+        return len(self.psi.response) >= self.psi.nTrials
+
+    def next(self):
+        """Stimulus intensity for the next trial. Waits for the worker if the last response is still being added."""
+        if self.finished:
+            raise StopIteration
+        return self.psi.nextStim.result()
+
+    __next__ = next
+
+    def __iter__(self):
+        return self
+
+    def addResponse(self, response):
+        """Add the response to the intensity last returned by next, one of responseVals."""
+        if response not in self.responseVals:
+            raise ValueError(f"response {response} is not one of {self.responseVals}")
+        self.psi.addData(1 if response == self.responseVals[0] else 0)
+
+    @property
+    def paramEstimate(self):
+        """Posterior mean of each parameter."""
+        self.psi.nextStim.result()
+        return {'threshold': self.psi.eThreshold, 'slope': self.psi.eSlope, 'lowerAsymptote': self.psi.eGuess,
+                'lapseRate': self.psi.eLapse}
+
+    def save(self, file):
+        """Save the staircase to a .npz file, see Psi.save. Load it with QuestPlus.load."""
+        self.psi.save(file, metadata={'responseVals': self.responseVals})
+
+    @classmethod
+    def load(cls, file, **kwargs):
+        """Rebuild a working QuestPlus from a file written by save. kwargs override the saved Psi settings."""
+        with np.load(file, allow_pickle=False) as data:
+            metadata = json.loads(str(data['metadata']))
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        quest = cls.__new__(cls)
+        quest.responseVals = metadata.get('responseVals', [1, 0])
+        quest.psi = Psi.load(file, **kwargs)
+        return quest
+
+    def close(self):
+        self.psi.close()
+
+
+class Psi2D:
+    """Psi-marginal staircase over a two-dimensional frequency x intensity stimulus space.
+
+    Runs the detection and the frequency discrimination staircase in one: each trial presents a tone of some frequency
+    and intensity, and the response (go or no go) informs both the intensity threshold and slope and the frequency
+    threshold and slope, see Likelihood2D. The guess and lapse rate are marginalized out, as in Psi. The likelihood is
+    kept as two small cores, and the stimulus search is evaluated in chunks of the flattened stimulus space, so memory
+    stays at the pdf plus one chunk of (alphaF, sigmaF, alphaI, sigmaI) per worker.
+
+    Arguments
+    ---------
+        freqRange, intRange :
+            possible tone frequencies (the CS+ frequency included) and intensities
+
+        thresholdFreq, slopeFreq :
+            grids of the frequency at which half the tones are no longer taken for the CS+, and of the spread
+
+        thresholdInt, slopeInt :
+            grids of the detection threshold and slope
+
+        guessRate, lapseRate :
+            grids of the guess (go without detecting) and lapse (no go to a detected CS+) rates
+
+        PfunctionFreq, PfunctionInt (str) :
+            psychometric function along each stimulus axis, see Psi
+
+        nTrials :
+            number of trials, stop is set at nTrials
+
+        prior : ndarray (optional)
+            joint prior over (thresholdFreq, slopeFreq, thresholdInt, slopeInt, guessRate, lapseRate), default uniform
+
+        thread, precision, nWorkers, chunkSize :
+            see Psi. chunkSize defaults to at most 2**22 joint values per chunk
+
+    How to use
+    ----------
+        As Psi, with xCurrent a (frequency, intensity) tuple, and addData taking 1 for a go and 0 for no go. Responses
+        other than 0 and 1 are recorded but leave the posterior unchanged, as in Psi. save and load as in Psi.
+    """
+    saveFormat = 1  # bump when the layout or meaning of the saved arrays changes
+
+    def __init__(self, freqRange, intRange, thresholdFreq, slopeFreq, thresholdInt, slopeInt, guessRate, lapseRate,
+                 PfunctionFreq='cGauss', PfunctionInt='cGauss', nTrials=50, prior=None, thread=True,
+                 precision='float64', nWorkers=1, chunkSize=None):
+        self.freqRange = np.asarray(freqRange)
+        self.intRange = np.asarray(intRange)
+        self.parameters = {
+            'ThresholdFreq': np.asarray(thresholdFreq, dtype=np.float64),
+            'SlopeFreq': np.asarray(slopeFreq, dtype=np.float64),
+            'ThresholdInt': np.asarray(thresholdInt, dtype=np.float64),
+            'SlopeInt': np.asarray(slopeInt, dtype=np.float64),
+            'Guess': np.asarray(guessRate, dtype=np.float64),
+            'Lapse': np.asarray(lapseRate, dtype=np.float64),
+        }
+        self.psyfunFreq = PfunctionFreq
+        self.psyfunInt = PfunctionInt
+        self.dtype = np.dtype(precision)
+        self.likelihood = Likelihood2D(thresholdFreq, slopeFreq, thresholdInt, slopeInt, guessRate, lapseRate,
+                                       self.freqRange, self.intRange, PfunctionFreq, PfunctionInt, self.dtype)
+        self.dimensions = self.likelihood.shape
+        self.jointDims = self.dimensions[:4]
+        self.nX = self.dimensions[-1]
+
+        if prior is None:
+            prior = np.ones(self.dimensions[:-1])
+        elif np.shape(prior) != self.dimensions[:-1]:
+            raise ValueError(f"prior of shape {np.shape(prior)} does not match the parameter grid {self.dimensions[:-1]}")
+        self.prior = np.asarray(prior, dtype=np.float64) / np.sum(prior)
+        self.pdf = np.copy(self.prior)
+
+        self.thread = thread
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='PsiWorker') if thread else None
+        self.finalizer = weakref.finalize(self, releaseResources, self.worker, None, [])
+        self.nWorkers = nWorkers
+        jointSize = int(np.prod(self.jointDims))
+        self.chunkSize = chunkSize or int(max(1, min(np.ceil(self.nX / nWorkers), 2 ** 22 // jointSize)))
+        self.workspaces = newWorkspaces(min(nWorkers, int(np.ceil(self.nX / self.chunkSize))),
+                                        jointSize * self.chunkSize, self.dtype)
+
+        self.iTrial = 0
+        self.nTrials = nTrials
+        self.stop = 0
+        self.response = []
+        self.stim = []
+        self.__updateMarginals()
+        self.minEntropyStim()
+        self.nextStim = self.__submit(lambda: self.xCurrent)
+
+    def __submit(self, fn, *args):
+        """Run fn on the worker, or right away if thread is False. Returns a Future of its result either way."""
+        return submitWork(self.worker, fn, *args)
+
+    def close(self):
+        """Stop the worker once any queued work is done. Also done when the object is garbage collected."""
+        self.finalizer()
+
+    def save(self, file, metadata=None):
+        """Save the grids, settings, prior, posterior and history of this staircase to a compressed .npz file, see
+        Psi.save."""
+        self.nextStim.result()  # let a running update finish
+        settings = {'PfunctionFreq': self.psyfunFreq, 'PfunctionInt': self.psyfunInt, 'nTrials': self.nTrials,
+                    'precision': self.dtype.name}
+        saveArrays(
+            file, saveFormat=self.saveFormat, settings=json.dumps(settings), freqRange=self.freqRange,
+            intRange=self.intRange, thresholdFreq=self.parameters['ThresholdFreq'],
+            slopeFreq=self.parameters['SlopeFreq'], thresholdInt=self.parameters['ThresholdInt'],
+            slopeInt=self.parameters['SlopeInt'], guessRate=self.parameters['Guess'],
+            lapseRate=self.parameters['Lapse'], prior=self.prior, pdf=self.pdf,
+            stim=np.reshape(np.asarray(self.stim, dtype=np.float64), (-1, 2)),
+            response=np.asarray(self.response, dtype=np.int8), iTrial=self.iTrial,
+            metadata=json.dumps(metadata or {}, default=float))
+
+    @classmethod
+    def load(cls, file, **kwargs):
+        """Rebuild a working Psi2D object from a file written by save. kwargs are further Psi2D arguments, e.g. thread,
+        which override the saved settings."""
+        with np.load(file, allow_pickle=False) as data:
+            if int(data['saveFormat']) > cls.saveFormat:
+                raise ValueError(f"Psi2D save format {int(data['saveFormat'])} is newer than this version "
+                                 f"({cls.saveFormat}) of PsiMarginal")
+            settings = json.loads(str(data['settings']))
+            settings['prior'] = data['prior']
+            settings.update(kwargs)
+            grids = {name: data[name] for name in ('freqRange', 'intRange', 'thresholdFreq', 'slopeFreq',
+                                                   'thresholdInt', 'slopeInt', 'guessRate', 'lapseRate')}
+            psi = cls(**grids, **settings)
+            psi.nextStim.result()
+            psi.pdf = np.array(data['pdf'])
+            psi.stim = [(psi.freqRange.dtype.type(freq), psi.intRange.dtype.type(intensity))
+                        for freq, intensity in data['stim']]
+            psi.response = data['response'].tolist()
+            psi.iTrial = int(data['iTrial']) - 1  # minEntropyStim counts the trial again
+        psi.__updateMarginals()
+        psi.minEntropyStim()
+        psi.nextStim = psi.__submit(lambda: psi.xCurrent)
+        return psi
+
+    def __chunkEntropy(self, shared, stim):
+        """p(go|x), p(no go|x) and the entropy of the (alphaF, sigmaF, alphaI, sigmaI) posterior after each."""
+        successBuffer, failureBuffer = self.workspaces.get()
+        try:
+            shape = self.jointDims + (len(stim),)
+            pTplus1success = successBuffer[:int(np.prod(shape))].reshape(shape)
+            pTplus1failure = failureBuffer[:int(np.prod(shape))].reshape(shape)
+            self.likelihood.contract(pTplus1success, stim, shared['sums'])
+            np.subtract(shared['pdfMarginal'][..., np.newaxis], pTplus1success, out=pTplus1failure)
+            return responseEntropies(pTplus1success, pTplus1failure, tuple(range(len(self.jointDims))))
+        finally:
+            self.workspaces.put((successBuffer, failureBuffer))
+
+    def minEntropyStim(self):
+        """Find the (frequency, intensity) pair with minimum expected entropy for the next trial."""
+        shared = {'sums': self.likelihood.nuisanceSums(self.pdf, self.likelihood.offset, self.likelihood.scale),
+                  'pdfMarginal': np.sum(self.pdf, axis=(4, 5))}
+        self.pSuccessGivenx, self.pFailureGivenx, self.entropySuccess, self.entropyFailure = \
+            searchChunks(self.__chunkEntropy, shared, np.arange(self.nX), self.chunkSize, self.nWorkers)
+        self.expectEntropy = np.nan_to_num(self.entropySuccess * self.pSuccessGivenx) + \
+            np.nan_to_num(self.entropyFailure * self.pFailureGivenx)
+        self.minEntropyInd = np.argmin(self.expectEntropy)
+        freq, intensity = np.divmod(self.minEntropyInd, self.likelihood.nInt)
+        self.xCurrent = (self.freqRange[freq], self.intRange[intensity])
+
+        self.iTrial += 1
+        if self.iTrial >= (self.nTrials - 1):
+            self.stop = 1
+
+    def addData(self, response):
+        """Add the response to the current tone, 1 for a go and 0 for no go. Returns the nextStim future, see Psi."""
+        self.stim.append(self.xCurrent)
+        self.response.append(response)
+        self.xCurrent = None
+        self.nextStim = self.__submit(self.__update, response)
+        return self.nextStim
+
+    def __update(self, response):
+        if response == 1:
+            pdf = self.pdf * self.likelihood.sliceAt(self.minEntropyInd)
+            self.pdf = pdf / np.sum(pdf)
+        elif response == 0:
+            pdf = self.pdf * (1 - self.likelihood.sliceAt(self.minEntropyInd))
+            self.pdf = pdf / np.sum(pdf)
+        self.__updateMarginals()
+        self.minEntropyStim()
+        return self.xCurrent
+
+    def __updateMarginals(self):
+        """Marginal distribution, mean and standard deviation of each parameter, e.g. pThresholdInt, eThresholdInt
+        and stdThresholdInt."""
+        for axis, (name, values) in enumerate(self.parameters.items()):
+            marginal = np.sum(self.pdf, axis=tuple(a for a in range(self.pdf.ndim) if a != axis))
+            mean = np.sum(values * marginal)
+            setattr(self, f'p{name}', marginal)
+            setattr(self, f'e{name}', mean)
+            setattr(self, f'std{name}', np.sqrt(np.sum((values - mean) ** 2 * marginal)))
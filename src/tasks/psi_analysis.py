@@ -0,0 +1,115 @@
+"""Re-fit saved Psi sessions from their logged trials.
+
+Posteriors are rebuilt with PsiMarginal.Psi.replay, straight from the stimulus and response arrays of each session
+file, without a stimulus search per trial. Sessions with the same grids share one Psi object and its log likelihood
+table, and groups of sessions are spread over processes.
+
+Kept free of hardware imports (TDT, twisted), like psi_grids:
+
+    python -m tasks.psi_analysis ../data/psi --trials 50 100 200 --output refit.csv
+"""
+from concurrent.futures import ProcessPoolExecutor
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from tasks import PsiMarginal, psi_grids
+
+
+def grid_key(file):
+    """Key shared by the session files that can be replayed with the same Psi object."""
+    with np.load(file, allow_pickle=False) as data:
+        settings = json.loads(str(data["settings"]))
+        grids = [data[name] for name in ("stimRange", "threshold", "slope", "guessRate", "lapseRate")]
+    return PsiMarginal.TableCache.key(*grids, json.dumps(settings, sort_keys=True))
+
+
+def summarize(psi, posterior):
+    """Posterior mean and SD of each parameter, for a posterior over the grids of psi."""
+    parameters = {"Threshold": psi.threshold, "Slope": psi.slope, "Lapse": psi.lapseRate}
+    if not psi.gammaEQlambda:
+        parameters = {"Threshold": psi.threshold, "Slope": psi.slope, "Guess": psi.guessRate, "Lapse": psi.lapseRate}
+    summary = {}
+    for axis, (name, values) in enumerate(parameters.items()):
+        marginal = np.sum(posterior, axis=tuple(a for a in range(posterior.ndim) if a != axis))
+        mean = marginal @ values
+        summary[name] = mean
+        summary[f"{name} SD"] = np.sqrt(marginal @ (values - mean) ** 2)
+    return summary
+
+
+def reconstruct_group(files, trials=None):
+    """Replay session files saved with the same grids, see reconstruct.
+
+    Returns
+    -------
+    list of dicts, one per file and trial count
+    """
+    psi = PsiMarginal.Psi.load(files[0], thread=False, speculate=False, batch=False, cacheDir=None, prior=None)
+    rows = []
+    for file in files:
+        with np.load(file, allow_pickle=False) as data:
+            stim, response = data["stim"], data["response"]
+            # Warm-started sessions are replayed from the prior they started from
+            prior = data["prior"] if "prior" in data.files else None
+        checkpoints = sorted({t for t in (trials or []) if t < len(response)} | {len(response)})
+        for checkpoint, posterior in zip(checkpoints, psi.replay(stim, response, trials=checkpoints, prior=prior)):
+            rows.append({"File": Path(file).name, "Trials": checkpoint, **summarize(psi, posterior)})
+    psi.close()
+    return rows
+
+
+def reconstruct(files, trials=None, processes=None, group_size=50):
+    """Posterior estimates of saved Psi sessions, rebuilt from their logged trials.
+
+    Arguments
+    ---------
+        files : list of str or Path
+            session files written by Psi.save
+
+        trials : list of int
+            trial counts to also give the estimates at, besides after all trials of each session
+
+        processes : int
+            worker processes, default one per core
+
+        group_size : int
+            at most this many sessions are replayed per task given to a process
+
+    Returns
+    -------
+    pd.DataFrame with one row per session and trial count: posterior mean and SD of each parameter
+    """
+    groups = {}
+    for file in files:
+        groups.setdefault(grid_key(file), []).append(file)
+    tasks = [group[start:start + group_size] for group in groups.values() for start in range(0, len(group), group_size)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(reconstruct_group, tasks, [trials] * len(tasks)))
+    return pd.DataFrame([row for rows in results for row in rows])
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Re-fit saved Psi sessions from their logged trials.")
+    parser.add_argument("paths", nargs="*", type=Path,
+                        help=f"session files, or directories of them (default: {psi_grids.PSI_DATA_PATH})")
+    parser.add_argument("--rat", help="only the sessions of this rat")
+    parser.add_argument("--trials", type=int, nargs="+", help="also give the estimates after these trial counts")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--output", type=Path, help="write the estimates to this CSV file instead of printing them")
+    args = parser.parse_args()
+
+    files = []
+    for path in args.paths or [psi_grids.PSI_DATA_PATH]:
+        if path.is_dir():
+            files.extend(psi_grids.session_files(args.rat, path) if args.rat else sorted(path.glob("*.npz")))
+        else:
+            files.append(path)
+    if not files:
+        parser.error("no Psi session files found")
+    estimates = reconstruct(files, trials=args.trials, processes=args.processes)
+    if args.output:
+        estimates.to_csv(args.output, index=False)
+    else:
+        print(estimates.to_string(index=False, float_format="%.3f"))
@@ -0,0 +1,242 @@
+"""Psi staircase configurations of the ATAT Psi tasks, and a CLI to pre-warm the Psi table cache with them.
+
+Kept free of hardware imports (TDT, twisted), so the grids can be used offline and from the command line:
+
+    python -m tasks.psi_grids
+"""
+from pathlib import Path
+import time
+import warnings
+import zipfile
+import numpy as np
+from tasks import PsiMarginal
+
+PSI_CACHE_PATH = Path(__file__).parent / "../../data/psi_cache/"
+PSI_DATA_PATH = Path(__file__).parent / "../../data/psi/"
+# Threads per Psi update and stimulus intensities per chunk. Keep PSI_WORKERS low enough that all booths on a client
+# computer fit on its cores; threads are shared between booths with the same setting
+PSI_WORKERS = 1
+PSI_CHUNK_SIZE = None
+# Precompute the next stimulus for both responses during each trial, so Psi never delays the start of a trial
+PSI_SPECULATE = True
+# Evaluate the staircases of all booths on a client together, in one vectorized pass per configuration. This runs the
+# stimulus search of every booth on one thread, and only batches requests that are queued at the same time, so leave
+# it off unless it has been measured to lower the latency on the client computer
+PSI_BATCH = False
+# Start each session from the rat's most recent compatible posterior, raised to the power PSI_TEMPERING
+# (1: as saved, 0: uniform). Only the last PSI_WARM_START_FILES sessions of the rat are searched. Off by default, so
+# each session starts from the grid priors unless this is turned on deliberately
+PSI_WARM_START = False
+PSI_TEMPERING = 0.5
+PSI_WARM_START_FILES = 10
+# Factor each task's parameter grids are coarsened by (see coarsen_grid), 1 or left out for the full grids. Find it
+# offline on the slowest client computer with `python -m tasks.psi_grids --calibrate`, which coarsens the grids until
+# a trial update fits the budgets below. The factor is fixed here rather than measured when a task loads, so the grids,
+# and with them the table cache keys, PsiEngine batches and warm starts, are the same on every run and computer.
+# The latency budget is per booth, so it should leave room for the other booths on the client
+PSI_GRID_FACTORS = {}
+PSI_LATENCY_BUDGET = 0.1  # seconds
+PSI_MEMORY_BUDGET = 256 * 2 ** 20  # bytes
+# End the session once the staircase has converged, or reached nTrials (see the stop* arguments of the grids). Off by
+# default, so sessions keep their usual length unless this is turned on deliberately
+PSI_STOP_SESSION = False
+
+
+def discrimination_grid():
+    cs_minus_freqs = np.round(2000 * 2 ** (np.arange(1, 31) / 12)).astype(int)
+    return {
+        "stimRange": cs_minus_freqs,
+        "Pfunction": "cGauss",
+        "nTrials": 200,
+        "threshold": (cs_minus_freqs[1:] + cs_minus_freqs[:-1]) / 2,
+        "slope": np.linspace(50, 4000, 50),
+        "guessRate": np.linspace(0.05, 0.4, 4),
+        "lapseRate": np.linspace(0, 0.3, 10),
+        "marginalize": True,
+        "stopThresholdSD": 75,  # Hz
+        "stopMinTrials": 50,
+        "narrowStim": 0.999,
+        "narrowMargin": 3,
+    }
+
+
+def detection_grid():
+    cs_plus_ints = np.arange(0, 77, 3)
+    return {
+        "stimRange": cs_plus_ints,
+        "Pfunction": "cGauss",
+        "nTrials": 200,
+        "threshold": (cs_plus_ints[1:] + cs_plus_ints[:-1]) / 2,
+        "slope": np.linspace(0, 30, 20),
+        "guessRate": np.linspace(0.05, 0.4, 4),
+        "lapseRate": np.linspace(0, 0.3, 10),
+        "marginalize": True,
+        "stopThresholdSD": 2,  # dB
+        "stopMinTrials": 50,
+        "narrowStim": 0.999,
+        "narrowMargin": 3,
+    }
+
+
+def frequency_intensity_grid():
+    """PsiMarginal.Psi2D keyword arguments covering the discrimination and detection ranges together, on grids
+    coarse enough for the joint (frequency, intensity) search to fit PSI_LATENCY_BUDGET."""
+    freqs = np.round(2000 * 2 ** (np.arange(0, 25, 2) / 12)).astype(int)
+    ints = np.arange(0, 76, 5)
+    return {
+        "freqRange": freqs,
+        "intRange": ints,
+        "nTrials": 300,
+        "thresholdFreq": (freqs[1:] + freqs[:-1]) / 2,
+        "slopeFreq": np.linspace(50, 4000, 8),
+        "thresholdInt": (ints[1:] + ints[:-1]) / 2,
+        "slopeInt": np.linspace(1, 30, 8),
+        "guessRate": np.linspace(0.05, 0.4, 4),
+        "lapseRate": np.linspace(0, 0.3, 5),
+    }
+
+
+# Task ID (as in utility_funcs.get_task) -> Psi keyword arguments
+PSI_TASK_GRIDS = {
+    "ATAT_Psi_Discrimination": discrimination_grid,
+    "ATAT_Psi_Detection": detection_grid,
+}
+
+
+def coarsen_grid(grid, factor):
+    """Copy of grid with each parameter grid resampled to factor times its points (at least 2).
+
+    Points are interpolated over the index, so the range and the spacing profile (e.g. log spacing) are kept.
+    """
+    grid = dict(grid)
+    for name in ("threshold", "slope", "guessRate", "lapseRate"):
+        values = np.asarray(grid[name], dtype=float)
+        n = max(2, int(round(len(values) * factor)))
+        if n < len(values):
+            grid[name] = np.interp(np.linspace(0, len(values) - 1, n), np.arange(len(values)), values)
+    return grid
+
+
+def benchmark_grid(grid, repeats=5, **psi_kwargs):
+    """Median time of a Psi trial update (posterior and stimulus search) with grid, and the memory the Psi takes.
+
+    Returns
+    -------
+    tuple of latency in seconds and memory in bytes
+    """
+    psi = PsiMarginal.Psi(**grid, thread=False, **psi_kwargs)
+    times = []
+    for response in np.arange(repeats) % 2:
+        start = time.perf_counter()
+        psi.addData(int(response))
+        times.append(time.perf_counter() - start)
+    memory = psi.nbytes
+    psi.close()
+    return float(np.median(times)), memory
+
+
+def calibrate_grid(grid, latency_budget=PSI_LATENCY_BUDGET, memory_budget=PSI_MEMORY_BUDGET, step=0.8, max_steps=10,
+                   **psi_kwargs):
+    """Coarsen grid in steps of step until a trial update fits the latency and memory budgets on this computer.
+
+    With speculate=True in psi_kwargs, two stimulus searches are run per trial, so the measured latency is doubled.
+    This benchmarks Psi, so it is meant to be run offline, to pick the PSI_GRID_FACTORS of the tasks.
+
+    Returns
+    -------
+    tuple of the chosen grid and a dict describing the calibration
+    """
+    factor = 1.0
+    for _ in range(max_steps + 1):
+        chosen = coarsen_grid(grid, factor)
+        latency, memory = benchmark_grid(chosen, **psi_kwargs)
+        if psi_kwargs.get("speculate"):
+            latency *= 2
+        if latency <= latency_budget and memory <= memory_budget:
+            break
+        factor *= step
+    return chosen, {
+        "factor": factor,
+        "latency": latency,
+        "memory": memory,
+        "latency_budget": latency_budget,
+        "memory_budget": memory_budget,
+        "within_budget": latency <= latency_budget and memory <= memory_budget,
+        "grid_points": {name: len(chosen[name]) for name in ("threshold", "slope", "guessRate", "lapseRate")},
+    }
+
+
+def session_files(rat, data_path=PSI_DATA_PATH):
+    """Saved Psi sessions of a rat, most recent first. Files are named <rat>_<date>_Session-<n>.npz."""
+    sessions = []
+    for file in Path(data_path).glob(f"{rat}_*_Session-*.npz"):
+        file_rat, date, session = file.stem.rsplit("_", 2)
+        if file_rat == rat:
+            sessions.append((date, int(session.split("-")[1]), file))
+    return [file for *_, file in sorted(sessions, reverse=True)]
+
+
+def warm_start_prior(rat, grid, data_path=PSI_DATA_PATH, tempering=PSI_TEMPERING):
+    """Tempered posterior of the rat's most recent Psi session with the same grid, or None if there is none.
+
+    Warns when falling back to the default prior, e.g. because the grids changed since the rat's last sessions, and
+    skips session files that can't be read.
+    """
+    files = session_files(rat, data_path)[:PSI_WARM_START_FILES]
+    for file in files:
+        try:
+            prior = PsiMarginal.Psi.loadPrior(file, tempering, **grid)
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile) as e:
+            # e.g. a file cut off by a crash while it was saved by an older version
+            warnings.warn(f"Skipping unreadable Psi session {file}: {e!r}")
+            continue
+        if prior is not None:
+            return prior
+    if files:
+        warnings.warn(f"None of the last {len(files)} Psi sessions of {rat} used the current grids, "
+                      f"starting from the default prior")
+    else:
+        warnings.warn(f"No Psi sessions of {rat} in {Path(data_path).resolve()}, starting from the default prior")
+    return None
+
+
+def task_grid(task_id):
+    """Psi grid of a task, coarsened by its PSI_GRID_FACTORS entry.
+
+    Returns
+    -------
+    tuple of the grid and a dict of the factor and grid sizes, to be saved with the session
+    """
+    factor = PSI_GRID_FACTORS.get(task_id, 1.0)
+    grid = coarsen_grid(PSI_TASK_GRIDS[task_id](), factor)
+    return grid, {"factor": factor,
+                  "grid_points": {name: len(grid[name]) for name in ("threshold", "slope", "guessRate", "lapseRate")}}
+
+
+def warm_cache(cache_path=PSI_CACHE_PATH, task_ids=None):
+    for task_id in task_ids or PSI_TASK_GRIDS:
+        psi = PsiMarginal.Psi(**task_grid(task_id)[0], thread=False, cacheDir=cache_path)
+        print(f"{task_id}: cached Psi tables {psi.cacheKey} in {Path(cache_path).resolve()}")
+        psi.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Pre-compute the Psi likelihood and prior tables of the ATAT tasks.")
+    parser.add_argument("task_ids", nargs="*", help=f"tasks to warm, any of {list(PSI_TASK_GRIDS)} (default: all)")
+    parser.add_argument("--cache-path", default=PSI_CACHE_PATH, help="Psi table cache directory")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="only benchmark the grids on this computer, and show the PSI_GRID_FACTORS that fit the "
+                             "configured budgets")
+    args = parser.parse_args()
+    for task_id in args.task_ids:
+        if task_id not in PSI_TASK_GRIDS:
+            parser.error(f"unknown Psi task {task_id}")
+    if args.calibrate:
+        for task_id in args.task_ids or PSI_TASK_GRIDS:
+            _, calibration = calibrate_grid(PSI_TASK_GRIDS[task_id](), nWorkers=PSI_WORKERS, chunkSize=PSI_CHUNK_SIZE,
+                                            speculate=PSI_SPECULATE)
+            print(f"{task_id}: {calibration}")
+            print(f"    PSI_GRID_FACTORS[{task_id!r}] = {calibration['factor']:.6g}")
+    else:
+        warm_cache(args.cache_path, args.task_ids)
@@ -0,0 +1,209 @@
+"""Simulate rats running a Psi staircase, to choose Psi grids offline.
+
+Simulated observers respond with the probabilities of a known psychometric function. Their posteriors are stacked
+along a batch axis and updated together, with one vectorized stimulus search per trial for the whole batch, and
+batches are spread over processes. The bias and SD of the threshold and slope estimates are reported against the
+trial count, together with the time per trial of a single live staircase on this computer. Running with
+marginalize=False gives QUEST+ style stimulus selection over all parameters.
+
+Kept free of hardware imports (TDT, twisted), like psi_grids:
+
+    python -m tasks.psi_simulation ATAT_Psi_Detection --threshold 30 --slope 10 --observers 2000
+"""
+from concurrent.futures import ProcessPoolExecutor
+import time
+import numpy as np
+import pandas as pd
+from tasks import PsiMarginal, psi_grids
+
+
+def p_success(x, threshold, slope, guess, lapse, psyfun="cGauss"):
+    """Probability of a success at stimulus intensity x, for the given (true) parameters."""
+    return guess + (1 - guess - lapse) * PsiMarginal.pfCore(threshold, slope, x, psyfun=psyfun)
+
+
+def simulate_batch(grid, true_params, n_observers, n_trials, checkpoints, seed):
+    """Run n_observers simulated observers through the Psi staircase defined by grid, as one batch.
+
+    The stimulus search of all observers is vectorized, see Psi.selectStims. It follows the narrowStim and coarseStep
+    settings of grid, as in a live staircase.
+
+    Returns
+    -------
+    tuple of (checkpoints, n_observers) arrays: threshold and slope estimates (posterior means) after each checkpoint
+    """
+    rng = np.random.default_rng(seed)
+    psi = PsiMarginal.Psi(**grid, thread=False)
+    likelihood = psi.likelihood
+    pdfs = np.repeat(psi.prior[np.newaxis], n_observers, axis=0)
+    nuisance_axes = tuple(range(3, pdfs.ndim))  # guess and lapse rate axes, marginalized for the estimates
+    threshold_estimates = np.empty((len(checkpoints), n_observers))
+    slope_estimates = np.empty((len(checkpoints), n_observers))
+    checkpoint = 0
+    for trial in range(1, n_trials + 1):
+        stim_indices = psi.selectStims(pdfs)
+        x = np.asarray(psi.stimRange)[stim_indices]
+        success = rng.random(n_observers) < p_success(x, *true_params, psyfun=psi.psyfun)
+
+        # Posterior update of every observer with its own stimulus intensity and response
+        trial_likelihood = likelihood.sliceAt(stim_indices)
+        trial_likelihood[~success] = 1 - trial_likelihood[~success]
+        pdfs *= trial_likelihood
+        pdfs /= np.sum(pdfs, axis=tuple(range(1, pdfs.ndim)), keepdims=True)
+
+        if trial == checkpoints[checkpoint]:
+            marginal = np.sum(pdfs, axis=nuisance_axes)  # (observers, threshold, slope)
+            threshold_estimates[checkpoint] = np.sum(marginal, axis=2) @ psi.threshold
+            slope_estimates[checkpoint] = np.sum(marginal, axis=1) @ psi.slope
+            checkpoint += 1
+            if checkpoint == len(checkpoints):
+                break
+    psi.close()
+    return threshold_estimates, slope_estimates
+
+
+def trial_times(grid, true_params, n_trials, seed=0):
+    """Wall-clock time of each update of a single live staircase (addData until the next stimulus), in seconds."""
+    rng = np.random.default_rng(seed)
+    psi = PsiMarginal.Psi(**grid, thread=False)
+    times = np.empty(n_trials)
+    for trial in range(n_trials):
+        response = int(rng.random() < p_success(psi.xCurrent, *true_params, psyfun=psi.psyfun))
+        start = time.perf_counter()
+        psi.addData(response)
+        times[trial] = time.perf_counter() - start
+    psi.close()
+    return times
+
+
+def compare_coarse_search(grid, true_params, coarse_step, coarse_top=2, n_trials=None, n_runs=10, seed=0):
+    """Check the coarse-to-fine stimulus search (Psi coarseStep) against the exhaustive search.
+
+    Staircases with exhaustive search run on simulated responses. Before each trial, the coarse-to-fine search picks
+    a stimulus intensity from the same pdf.
+
+    Returns
+    -------
+    dict with the fraction of trials where both searches agree, the mean and max excess expected entropy of the
+    coarse-to-fine choice (nats), and the mean time of each search in seconds
+    """
+    n_trials = n_trials or grid.get("nTrials", 50)
+    rng = np.random.default_rng(seed)
+    agree, excess, times = [], [], {"exhaustive": [], "coarse": []}
+    for _ in range(n_runs):
+        exhaustive = PsiMarginal.Psi(**grid, thread=False)
+        coarse = PsiMarginal.Psi(**grid, thread=False, coarseStep=coarse_step, coarseTop=coarse_top)
+        for _ in range(n_trials):
+            for name, psi in (("exhaustive", exhaustive), ("coarse", coarse)):
+                psi.pdf = exhaustive.pdf
+                start = time.perf_counter()
+                psi.minEntropyStim()
+                times[name].append(time.perf_counter() - start)
+            agree.append(coarse.minEntropyInd == exhaustive.minEntropyInd)
+            excess.append(exhaustive.expectEntropy[coarse.minEntropyInd] - exhaustive.expectEntropy.min())
+            exhaustive.addData(int(rng.random() < p_success(exhaustive.xCurrent, *true_params, psyfun=exhaustive.psyfun)))
+        exhaustive.close()
+        coarse.close()
+    return {
+        "agreement": float(np.mean(agree)),
+        "mean_excess_entropy": float(np.mean(excess)),
+        "max_excess_entropy": float(np.max(excess)),
+        "exhaustive_time": float(np.mean(times["exhaustive"])),
+        "coarse_time": float(np.mean(times["coarse"])),
+    }
+
+
+def simulate(grid, true_params, n_observers=1000, n_trials=None, checkpoints=None, batch_size=100, processes=None,
+             seed=0):
+    """Simulate observers with parameters true_params running the Psi staircase defined by grid.
+
+    Arguments
+    ---------
+        grid : dict
+            Psi keyword arguments, e.g. from psi_grids.PSI_TASK_GRIDS
+
+        true_params : tuple
+            (threshold, slope, guess rate, lapse rate) of the simulated observers
+
+        n_observers : int
+            number of simulated observers
+
+        n_trials : int
+            trials per observer, default the nTrials of grid
+
+        checkpoints : list of int
+            trial counts to report the estimates at, default every 10 trials
+
+        batch_size : int
+            observers simulated together in one vectorized batch
+
+        processes : int
+            worker processes the batches are spread over, default one per core
+
+        seed : int
+            random seed, batches use consecutive seeds
+
+    Returns
+    -------
+    pd.DataFrame with one row per checkpoint: bias and SD of the threshold and slope estimates, and the mean time per
+    trial of a live staircase up to that trial count
+    """
+    n_trials = n_trials or grid.get("nTrials", 50)
+    checkpoints = sorted(checkpoints or range(10, n_trials + 1, 10))
+    batches = [min(batch_size, n_observers - start) for start in range(0, n_observers, batch_size)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(simulate_batch, [grid] * len(batches), [true_params] * len(batches), batches,
+                                [checkpoints[-1]] * len(batches), [checkpoints] * len(batches),
+                                range(seed, seed + len(batches))))
+    threshold_estimates = np.concatenate([result[0] for result in results], axis=1)
+    slope_estimates = np.concatenate([result[1] for result in results], axis=1)
+    times = trial_times(grid, true_params, checkpoints[-1], seed=seed)
+    mean_times = np.cumsum(times) / np.arange(1, len(times) + 1)
+    return pd.DataFrame({
+        "Trials": checkpoints,
+        "Threshold bias": np.mean(threshold_estimates, axis=1) - true_params[0],
+        "Threshold SD": np.std(threshold_estimates, axis=1),
+        "Slope bias": np.mean(slope_estimates, axis=1) - true_params[1],
+        "Slope SD": np.std(slope_estimates, axis=1),
+        "ms per trial": 1000 * mean_times[np.subtract(checkpoints, 1)],
+    })
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Simulate rats running the Psi staircase of an ATAT task.")
+    parser.add_argument("task_id", help=f"task to simulate, any of {list(psi_grids.PSI_TASK_GRIDS)}")
+    parser.add_argument("--threshold", type=float, required=True, help="true threshold of the simulated rats")
+    parser.add_argument("--slope", type=float, required=True, help="true slope of the simulated rats")
+    parser.add_argument("--guess", type=float, default=0.1, help="true guess rate (default: 0.1)")
+    parser.add_argument("--lapse", type=float, default=0.05, help="true lapse rate (default: 0.05)")
+    parser.add_argument("--observers", type=int, default=1000, help="number of simulated rats (default: 1000)")
+    parser.add_argument("--trials", type=int, help="trials per rat (default: nTrials of the task)")
+    parser.add_argument("--threshold-points", type=int, help="resample the threshold grid to this many points")
+    parser.add_argument("--slope-points", type=int, help="resample the slope grid to this many points")
+    parser.add_argument("--stim-points", type=int, help="resample the stimulus range to this many intensities")
+    parser.add_argument("--coarse-step", type=int,
+                        help="instead of simulating, compare the coarse-to-fine search with this step to the exhaustive one")
+    parser.add_argument("--batch-size", type=int, default=100, help="rats per vectorized batch (default: 100)")
+    parser.add_argument("--processes", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.task_id not in psi_grids.PSI_TASK_GRIDS:
+        parser.error(f"unknown Psi task {args.task_id}")
+
+    grid = psi_grids.PSI_TASK_GRIDS[args.task_id]()
+    if args.threshold_points:
+        grid["threshold"] = np.linspace(grid["threshold"][0], grid["threshold"][-1], args.threshold_points)
+    if args.slope_points:
+        grid["slope"] = np.linspace(grid["slope"][0], grid["slope"][-1], args.slope_points)
+    if args.stim_points:
+        stim_range = grid["stimRange"]
+        grid["stimRange"] = np.interp(np.linspace(0, len(stim_range) - 1, args.stim_points),
+                                      np.arange(len(stim_range)), stim_range)
+    if args.coarse_step:
+        print(compare_coarse_search(grid, (args.threshold, args.slope, args.guess, args.lapse), args.coarse_step,
+                                    n_trials=args.trials, seed=args.seed))
+        raise SystemExit
+    summary = simulate(grid, (args.threshold, args.slope, args.guess, args.lapse), n_observers=args.observers,
+                       n_trials=args.trials, batch_size=args.batch_size, processes=args.processes, seed=args.seed)
+    print(summary.to_string(index=False, float_format="%.3f"))
@@ -0,0 +1,115 @@
+"""Append-only journal of a running session, see SessionJournal."""
+import datetime
+import json
+import os
+from pathlib import Path
+
+
+def _to_json(value):
+    # NumPy scalars and arrays in trial rows and sound dicts
+    return value.tolist()
+
+
+class SessionJournal:
+    """JSON lines journal of the trials and events of a booth's session, for crash recovery.
+
+    Each record is one line {"Type": ..., ...}, written and flushed when it happens, so the cost of journaling is
+    constant per trial and a crash of the client loses nothing. sync fsyncs the file, to also survive a crash of the
+    computer, and is called periodically by the task. A crash mid-write can only cut off the last line, which read
+    skips. Record types:
+
+        Start : "Rat", "Task" and "Session Start" (ISO time) of the session
+        Trial : "Data" (session data row), "Sound" (sound dict) and "Response Times" of a trial
+        Update : "Data", columns set on the row of the last trial afterwards
+        Pellet : "Pellets", the pellet count after a pellet
+        Staircase : "Stim" and "Response" added to the staircase of the task
+        End : the session was saved
+
+    Arguments
+    ---------
+        path : str or Path
+            journal file, one per booth. Starting a session replaces it, unless it holds an unfinished session, which
+            is moved aside
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.file = None
+
+    def start(self, rat, task_id, session_start):
+        """Start the journal of a new session."""
+        records = read(self.path)
+        if records and not finished(records):
+            stamp = records[0]["Session Start"].replace(":", "-")
+            self.path.replace(self.path.with_name(f"{self.path.stem}_{stamp}{self.path.suffix}"))
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = self.path.open(mode="w")
+        self.write("Start", Rat=rat, Task=task_id, **{"Session Start": session_start.isoformat()})
+        self.sync()
+
+    def resume(self):
+        """Keep appending to the journal of an unfinished session, after its records were recovered. A last line cut
+        off by the crash is dropped first."""
+        with self.path.open(mode="rb+") as file:
+            file.truncate(_records(file)[1])
+        self.file = self.path.open(mode="a")
+        if self.file.tell() and not self.path.read_bytes().endswith(b"\n"):
+            self.file.write("\n")
+
+    def write(self, record_type, **fields):
+        """Append a record and flush it to the operating system."""
+        if self.file is None:
+            return
+        self.file.write(json.dumps({"Type": record_type, **fields}, default=_to_json) + "\n")
+        self.file.flush()
+
+    def sync(self):
+        """Write the journal through to disk."""
+        if self.file is not None:
+            os.fsync(self.file.fileno())
+
+    def end(self):
+        """Mark the session as saved and close the journal."""
+        self.write("End", Time=datetime.datetime.now().isoformat())
+        self.sync()
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def _records(file):
+    # Records of a journal opened in binary mode, up to a line that doesn't parse, and the bytes they take up
+    records, length = [], 0
+    for line in file:
+        try:
+            records.append(json.loads(line))
+        except json.JSONDecodeError:
+            break
+        length += len(line)
+    return records, length
+
+
+def read(path):
+    """Records of a journal, without a last line cut off by a crash. Empty if there is no journal."""
+    try:
+        with Path(path).open(mode="rb") as file:
+            return _records(file)[0]
+    except FileNotFoundError:
+        return []
+
+
+def finished(records):
+    """Whether the session of a journal was saved."""
+    return bool(records) and records[-1]["Type"] == "End"
+
+
+def resumable(records, rat, task_id, today=None):
+    """Whether a journal holds an unfinished session of rat on task_id, started today, to continue from."""
+    if not records or finished(records) or records[0]["Type"] != "Start":
+        return False
+    start = datetime.datetime.fromisoformat(records[0]["Session Start"])
+    return (records[0]["Rat"] == rat and records[0]["Task"] == task_id and
+            start.date() == (today or datetime.date.today()))
@@ -0,0 +1,230 @@
+"""Running signal detection statistics of a session, see SessionStats."""
+import numpy as np
+from scipy.special import ndtri  # norm.ppf, without its per-call argument checking
+
+CATEGORIES = ("CS+", "CS-", "Silence")
+
+
+def signal_detection(hits, trials, cs_plus_hits, cs_plus_trials):
+    """Vectorized % hit, d' and criterion of sounds against the CS+ trials.
+
+    Like utility_funcs.calc_d_prime, hit and false alarm rates of 0 or 1 are moved half a trial inwards to keep d'
+    finite. Sounds without trials give NaN. All arguments broadcast together.
+
+    Returns
+    -------
+    tuple of arrays: % hit, d' and criterion c = -(z(hit rate) + z(false alarm rate)) / 2
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fa_rate = hits / trials
+        hit_rate = cs_plus_hits / cs_plus_trials
+        z_fa = ndtri(np.clip(fa_rate, 0.5 / trials, 1 - 0.5 / trials))
+        z_hit = ndtri(np.clip(hit_rate, 0.5 / cs_plus_trials, 1 - 0.5 / cs_plus_trials))
+    return fa_rate * 100.0, z_hit - z_fa, -(z_hit + z_fa) / 2
+
+
+def percent_correct(percent_hit, trials):
+    """CS+ % hit averaged with the % correct rejections of CS- trials, or of Silence trials if there are no CS- trials.
+
+    Arguments
+    ---------
+        percent_hit, trials : 1D arrays
+            % hit and number of trials of each category, in the order of CATEGORIES
+
+    Returns
+    -------
+    float, NaN without CS+ and no-go trials
+    """
+    no_go = 1 if trials[1] else 2
+    percents = [percent_hit[0], 100 - percent_hit[no_go]]
+    return np.nan if np.all(np.isnan(percents)) else float(np.nanmean(percents))
+
+
+class SessionStats:
+    """Running hit tallies of a session, per sound and per sound category (CS+, CS- and Silence).
+
+    Sounds get integer IDs in order of appearance, and their hits and trials are kept in arrays, so a trial is counted
+    in O(1). compute then gives the % hit, d' and criterion of all sounds and categories in one vectorized pass, with
+    d' and criterion of CS- and Silence sounds taken against all CS+ trials. % correct is that of percent_correct.
+    """
+
+    def __init__(self, capacity=16):
+        self.names = []
+        self.ids = {}  # sound name -> sound ID
+        self.categories = np.empty(capacity, dtype=np.int64)  # index into CATEGORIES, by sound ID
+        self.hits = np.zeros(capacity + len(CATEGORIES), dtype=np.int64)  # categories, then sounds by ID
+        self.trials = np.zeros(capacity + len(CATEGORIES), dtype=np.int64)
+        self.n_trials = 0
+        self.percent_hit = self.d_prime = self.criterion = np.full(len(CATEGORIES), np.nan)
+        self.percent_correct = np.nan
+
+    @property
+    def empty(self):
+        return self.n_trials == 0
+
+    def sound_id(self, name, category):
+        """ID of a sound, adding it with its category ("CS+", "CS-" or "Silence") if new."""
+        if name not in self.ids:
+            sound_id = len(self.names)
+            if sound_id == len(self.categories):  # Double the capacity
+                self.categories = np.concatenate((self.categories, np.empty_like(self.categories)))
+                self.hits = np.concatenate((self.hits, np.zeros(sound_id, dtype=np.int64)))
+                self.trials = np.concatenate((self.trials, np.zeros(sound_id, dtype=np.int64)))
+            self.ids[name] = sound_id
+            self.names.append(name)
+            self.categories[sound_id] = CATEGORIES.index(category)
+        return self.ids[name]
+
+    def add(self, name, category, hit):
+        """Count a trial of a sound, hit being 1 if the rat responded."""
+        sound_id = self.sound_id(name, category)
+        entries = [self.categories[sound_id], len(CATEGORIES) + sound_id]
+        self.hits[entries] += hit
+        self.trials[entries] += 1
+        self.n_trials += 1
+
+    def compute(self):
+        """Update percent_hit, d_prime and criterion (categories, then sounds by ID) and percent_correct."""
+        n = len(CATEGORIES) + len(self.names)
+        self.percent_hit, self.d_prime, self.criterion = signal_detection(self.hits[:n], self.trials[:n],
+                                                                         self.hits[0], self.trials[0])
+        is_cs_plus = np.concatenate(([True, False, False], self.categories[:len(self.names)] == 0))
+        self.d_prime[is_cs_plus] = self.criterion[is_cs_plus] = np.nan
+        self.percent_correct = percent_correct(self.percent_hit, self.trials)
+
+    def entry(self, name):
+        """Index of a sound, or else a category, into percent_hit, d_prime and criterion."""
+        if name in self.ids:
+            return len(CATEGORIES) + self.ids[name]
+        return CATEGORIES.index(name)
+
+    def row(self):
+        """Category tallies and % correct as of the last compute, as session data columns."""
+        row = {"% Correct": self.percent_correct}
+        for entry, category in enumerate(CATEGORIES):
+            row[f"{category} Hits"] = self.hits[entry]
+            row[f"{category} Trials"] = self.trials[entry]
+            row[f"{category} % Hit"] = self.percent_hit[entry]
+            if category != "CS+":
+                row[f"{category} d'"] = self.d_prime[entry]
+                row[f"{category} Criterion"] = self.criterion[entry]
+        return row
+
+    def history(self, sounds, hits):
+        """Per-sound tallies after each trial, rebuilt in one vectorized pass.
+
+        Arguments
+        ---------
+            sounds : pd.Categorical or pd.Series of categorical
+                name of the sound of each trial
+
+            hits : 1D array
+                1 if the rat responded on the trial, else 0
+
+        Returns
+        -------
+        dict of (trials,) arrays: Hits, Trials, % Hit, and for CS- and Silence sounds d' and Criterion of every sound
+        that isn't named like a category
+        """
+        sounds = getattr(sounds, "cat", sounds)
+        lookup = np.array([self.ids[name] for name in sounds.categories], dtype=np.int64)
+        sound_ids = lookup[np.asarray(sounds.codes)]
+        n_sounds = len(self.names)
+        trial_counts = np.zeros((len(sound_ids), n_sounds), dtype=np.int64)
+        trial_counts[np.arange(len(sound_ids)), sound_ids] = 1
+        hit_counts = np.cumsum(trial_counts * np.asarray(hits, dtype=np.int64)[:, np.newaxis], axis=0)
+        trial_counts = np.cumsum(trial_counts, axis=0)
+        is_cs_plus = self.categories[:n_sounds] == 0
+        percent_hit, d_prime, criterion = signal_detection(
+            hit_counts, trial_counts, hit_counts[:, is_cs_plus].sum(axis=1, keepdims=True),
+            trial_counts[:, is_cs_plus].sum(axis=1, keepdims=True))
+
+        columns = {}
+        for sound_id, name in enumerate(self.names):
+            if name in CATEGORIES:
+                continue
+            columns[f"{name} Hits"] = hit_counts[:, sound_id]
+            columns[f"{name} Trials"] = trial_counts[:, sound_id]
+            columns[f"{name} % Hit"] = percent_hit[:, sound_id]
+            if not is_cs_plus[sound_id]:
+                columns[f"{name} d'"] = d_prime[:, sound_id]
+                columns[f"{name} Criterion"] = criterion[:, sound_id]
+        return columns
+
+
+class RollingStats:
+    """Performance over the last trials of a session, for several window lengths at once.
+
+    The category, hit and first response time of the last max(windows) trials are kept in ring buffers, next to hit
+    and trial tallies per window and category. A new trial is added to every tally, and the trial that falls out of
+    each window subtracted from it, so adding a trial is O(1). Windows that haven't filled up yet cover all trials so
+    far.
+
+    Arguments
+    ---------
+        windows : tuple of int
+            window lengths in trials
+    """
+
+    def __init__(self, windows=(20, 50, 100)):
+        self.windows = tuple(sorted(windows))
+        size = self.windows[-1]
+        self.categories = np.zeros(size, dtype=np.int64)  # ring buffers, trial n at n % size
+        self.hits = np.zeros(size, dtype=np.int64)
+        self.response_times = np.full(size, np.nan)  # first response time of each trial, NaN without response
+        self.window_hits = np.zeros((len(self.windows), len(CATEGORIES)), dtype=np.int64)
+        self.window_trials = np.zeros((len(self.windows), len(CATEGORIES)), dtype=np.int64)
+        self.n_trials = 0
+
+    def add(self, category, hit, response_time=np.nan):
+        """Add a trial of a sound category ("CS+", "CS-" or "Silence"), hit being 1 if the rat responded."""
+        size = len(self.hits)
+        for row, window in enumerate(self.windows):
+            if self.n_trials >= window:
+                old = (self.n_trials - window) % size
+                self.window_hits[row, self.categories[old]] -= self.hits[old]
+                self.window_trials[row, self.categories[old]] -= 1
+        new = self.n_trials % size
+        self.categories[new] = CATEGORIES.index(category)
+        self.hits[new] = hit
+        self.response_times[new] = response_time
+        self.window_hits[:, self.categories[new]] += hit
+        self.window_trials[:, self.categories[new]] += 1
+        self.n_trials += 1
+
+    def percent_correct(self, window):
+        """% correct of the trials in the window, see percent_correct."""
+        row = self.windows.index(window)
+        percent_hit, _, _ = signal_detection(self.window_hits[row], self.window_trials[row],
+                                             self.window_hits[row, 0], self.window_trials[row, 0])
+        return percent_correct(percent_hit, self.window_trials[row])
+
+    def summary(self, window, quantiles=(0.25, 0.5, 0.75)):
+        """Performance over the last window trials.
+
+        Returns
+        -------
+        dict with the trial count and % correct of the window, and per category its trials, % hit, d' and criterion
+        (CS- and Silence) and response time quantiles (ms)
+        """
+        row = self.windows.index(window)
+        percent_hit, d_prime, criterion = signal_detection(self.window_hits[row], self.window_trials[row],
+                                                           self.window_hits[row, 0], self.window_trials[row, 0])
+        recent = np.arange(self.n_trials - min(window, self.n_trials), self.n_trials) % len(self.hits)
+        summary = {"Trials": min(window, self.n_trials), "% Correct": self.percent_correct(window)}
+        for entry, category in enumerate(CATEGORIES):
+            summary[f"{category} Trials"] = int(self.window_trials[row, entry])
+            summary[f"{category} % Hit"] = float(percent_hit[entry])
+            if category != "CS+":
+                summary[f"{category} d'"] = float(d_prime[entry])
+                summary[f"{category} Criterion"] = float(criterion[entry])
+            response_times = self.response_times[recent[self.categories[recent] == entry]]
+            response_times = response_times[~np.isnan(response_times)]
+            for quantile, value in zip(quantiles, np.quantile(response_times, quantiles) if len(response_times)
+                                       else np.full(len(quantiles), np.nan)):
+                summary[f"{category} RT {100 * quantile:g}%"] = float(value)
+        return summary
+
+    def summaries(self):
+        """summary of every window, keyed by window length."""
+        return {window: self.summary(window) for window in self.windows}
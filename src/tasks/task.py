@@ -11,17 +11,17 @@ except:
 
 import tkinter as tk
 from tkinter import ttk
-from twisted.internet.defer import inlineCallbacks, ensureDeferred, Deferred
+from twisted.internet.defer import inlineCallbacks, Deferred
 from twisted.internet import task, reactor
 import blinker
 import datetime
 import time
 import pandas as pd
 import numpy as np
-from tasks import utility_funcs
-import pickle
+from tasks.trial_log import TrialLog
+from tasks.session_stats import SessionStats, RollingStats
+from tasks import session_journal
 import json
-from functools import partial
 
 
 class GoNoGoTask:
@@ -45,8 +45,11 @@ class GoNoGoTask:
         self.response_poll_delay = 0.1
         self.response_loop = task.LoopingCall(self.get_responses)  # TODO Holds a reference
         self.wait_loop = task.LoopingCall(self.wait_trial)  # TODO Holds a reference
-        self.auto_save_time = 60
-        self.auto_save_loop = task.LoopingCall(partial(self.save, temp=True))  # TODO Holds a reference
+        # Trials and events are journaled as they happen, the loop only fsyncs the journal
+        journal_path = Path(__file__).parent / f"../../data/journal_Booth{self.booth_num}.jsonl"
+        self.journal = session_journal.SessionJournal(journal_path)
+        self.auto_save_time = 10
+        self.auto_save_loop = task.LoopingCall(self.journal.sync)  # TODO Holds a reference
         self.session_time = (0, 0)
         self.session_time_loop = task.LoopingCall(self.update_session_time)  # TODO Holds a reference
         self.save_filepath = None
@@ -80,7 +83,9 @@ class GoNoGoTask:
         self.cs_minus = []
         self.silence = [{"Name": "Silence", "Weight": 0.5}]
         self.plots = {}
-        self.session_data = pd.DataFrame()
+        self.session_data = TrialLog()
+        self.session_stats = SessionStats()
+        self.rolling_stats = RollingStats()  # performance over the last 20, 50 and 100 trials
 
     def setup_plots(self):
         from GUI.booth import ResponsePlot
@@ -126,6 +131,7 @@ class GoNoGoTask:
         self.plots["Response"].fig.tight_layout()
         self.plots["Response"].canvas.draw()
 
+    @inlineCallbacks
     def start_session(self):
         print("Got session start message")
         self.circuit.start()
@@ -134,9 +140,15 @@ class GoNoGoTask:
         self.booth.state = "Running"
         self.running_signal.send(self.booth_num, running=True)
         self.session_start_time = datetime.datetime.now()
+        records = session_journal.read(self.journal.path)
+        if session_journal.resumable(records, self.booth.rat, self.booth.task_id):
+            self.resume_session(records)
+            self.journal.resume()
+        else:
+            self.journal.start(self.booth.rat, self.booth.task_id, self.session_start_time)
         self.booth.session_status_label["text"] = f"Status: {self.booth.state}"
         self.auto_save_loop.start(self.auto_save_time, now=False)
-        self.prep_trial()
+        yield self.prep_trial()  # May return a Deferred if the next stimulus is computed off the reactor thread
         self.session_time_loop.start(1)
         self.start_trial()
 
@@ -151,10 +163,16 @@ class GoNoGoTask:
         self.pause_event.set()
 
         self.save()
+        self.journal.end()
         self.upload()
+        self.close()
         self.booth.state = "Stopped"
         self.running_signal.send(self.booth_num, running=False)
 
+    def close(self):
+        # Release the files and workers the task holds, when its session stops or the booth replaces the task
+        self.journal.close()
+
     def prep_trial(self):
         pass
 
@@ -194,7 +212,7 @@ class GoNoGoTask:
         self.update_info()
         yield Deferred.fromFuture(asyncio.ensure_future(self.check_pause()))
         print(f"End trial, trial response: {self.trial_response}")
-        self.prep_trial()
+        yield self.prep_trial()
         self.start_trial()
 
     async def check_pause(self):
@@ -266,6 +284,7 @@ class GoNoGoTask:
         time.sleep(0.01)
         self.booth.client.board.digital[self.booth.booth_info["Pellet Trigger"]].write(0)
         self.num_pellets += 1
+        self.journal.write("Pellet", Pellets=self.num_pellets)
 
     def handle_pause(self, _sender, pause):
         if self.is_paused:
@@ -290,14 +309,14 @@ class GoNoGoTask:
                     self.session_end_time.strftime("%H:%M"),  # end time
                     f"{self.session_time[0]}:{self.session_time[1]}",  # session duration
                     self.num_pellets,  # pellets
-                    self.session_data.tail(1)["% Correct"].values[0],  # percent correct
+                    self.session_stats.percent_correct,  # percent correct
                     self.booth.task_id,  # program name
                     self.booth.task_id,  # task number
                     0,  # soundfile eg. [1, 1, 2, 2]
                     0,  # VNS stims
                     0,  # max impedance
-                    0,  # self.session_data.tail(1)["Silence d'"].values[0],  # d' silence
-                    0,  # self.session_data.tail(1)["CS- d'"].values[0],  # d' CS-
+                    0,  # self.session_stats.d_prime[self.session_stats.entry("Silence")],  # d' silence
+                    0,  # self.session_stats.d_prime[self.session_stats.entry("CS-")],  # d' CS-
                     0,  # notes
                     0,  # z filename
                     0,  # c filename
@@ -332,17 +351,19 @@ class GoNoGoTask:
     def save(self, temp=False, filepath=None, filename=None):
         if self.session_data.empty:
             return
-        data = self.session_data.to_json()
+        data = self.session_data.to_frame(response_times=True)
+        data = data.assign(**self.session_stats.history(data["Sound"], data["Hit"])).to_json()
         data_dict = {
             "Data": data,
+            "Sounds": self.session_data.stimuli,
             "Rat": self.booth.rat,
             "Time": datetime.datetime.now().isoformat(),
             # TODO use datetime.datetime.fromisoformat() when reading it in
             "Task": self.booth.task_id,
             "Session Start": self.session_start_time.isoformat(),
-            "Session Time": self.session_data.tail(1)["Session Time"].values[0],
+            "Session Time": self.session_data.last("Session Time"),
             "Pellets": self.num_pellets,
-            "% Correct": self.session_data.tail(1)["% Correct"].values[0],
+            "% Correct": self.session_stats.percent_correct,
             "Finished": not temp,
         }
 
@@ -366,23 +387,18 @@ class GoNoGoTask:
 
         filepath.mkdir(parents=True, exist_ok=True)
         with (filepath / filename).open(mode="w") as file:
-            json.dump(data_dict, file)
+            json.dump(data_dict, file, default=lambda value: value.item())  # NumPy scalars in sound dicts
+
+    def tallied_sounds(self):
+        # Sounds in the session statistics from the first trial on, played or not, as (name, category)
+        return [*((sound["Name"], "CS+") for sound in self.cs_plus),
+                *((sound["Name"], "CS-") for sound in self.cs_minus),
+                *((sound["Name"], "Silence") for sound in self.silence)]
 
     def update_session_data(self):
-        if self.session_data.empty:  # Handle first trial special to set up columns and values
-            data_dict = {}
-            for sound in ["CS+", "CS-", *self.cs_plus, *self.cs_minus, *self.silence]:
-                if isinstance(sound, dict):
-                    sound_name = sound["Name"]
-                else:
-                    sound_name = sound
-                data_dict[f"{sound_name} Hits"] = 0
-                data_dict[f"{sound_name} Trials"] = 0
-                data_dict[f"{sound_name} % Hit"] = np.nan
-                if sound not in ["CS+", *self.cs_plus]:
-                    data_dict[f"{sound_name} d'"] = np.nan
-        else:  # Copy values from last trial as starting point -- many analysis columns won't change
-            data_dict = self.session_data.tail(1).to_dict("records")[0]
+        if self.session_stats.empty:
+            for name, category in self.tallied_sounds():
+                self.session_stats.sound_id(name, category)
 
         # Get Sound Category (CS+, CS-, Silence)
         if self.trial_sound in self.cs_plus:
@@ -398,44 +414,59 @@ class GoNoGoTask:
         else:
             hit = 0
 
-        # Fill out data dict with trial info
-        data_dict["Trial Num"] = self.trial_number
-        minute, second = self.session_time
-        data_dict["Session Time"] = {"Minute": minute, "Second": second}
-        data_dict["Sound"] = self.trial_sound
-        data_dict["Sound Category"] = sound_category
-        data_dict["Response Times"] = self.response_times
-        data_dict["Response"] = self.trial_response
-        data_dict["Hit"] = hit
-
-        data_dict[f"{sound_category} Hits"] += hit
-        data_dict[f"{sound_category} Trials"] += 1
-        data_dict[f"{sound_category} % Hit"] = \
-            data_dict[f"{sound_category} Hits"] / data_dict[f"{sound_category} Trials"] * 100.0
-
-        sound_name = self.trial_sound["Name"]
-        data_dict[f"{sound_name} Hits"] += hit
-        data_dict[f"{sound_name} Trials"] += 1
-        data_dict[f"{sound_name} % Hit"] = data_dict[f"{sound_name} Hits"] / data_dict[f"{sound_name} Trials"] * 100.0
-
-        # Calculate d'
-        for sound in ["CS-", *self.cs_minus, *self.silence]:
-            if isinstance(sound, dict):
-                sound_name = sound["Name"]
-            else:
-                sound_name = sound
-            data_dict[f"{sound_name} d'"] = utility_funcs.calc_d_prime(
-                hits=data_dict["CS+ Hits"], misses=data_dict["CS+ Trials"] - data_dict["CS+ Hits"],
-                false_alarms=data_dict[f"{sound_name} Hits"],
-                correct_rejections=data_dict[f"{sound_name} Trials"] - data_dict[f"{sound_name} Hits"]
-            )
-
-        if self.cs_minus:
-            data_dict["% Correct"] = np.nanmean([data_dict["CS+ % Hit"], (100 - data_dict["CS- % Hit"])])
-        else:
-            data_dict["% Correct"] = np.nanmean([data_dict["CS+ % Hit"], (100 - data_dict["Silence % Hit"])])
+        # Update the running tallies, then % hit, d' and criterion of all sounds and % correct
+        self.session_stats.add(self.trial_sound["Name"], sound_category, hit)
+        self.session_stats.compute()
+        self.rolling_stats.add(sound_category, hit, self.response_times[0] if len(self.response_times) else np.nan)
 
-        self.session_data = self.session_data.append(data_dict, ignore_index=True)
+        # Fill out data dict with trial info and the sound category statistics. Per-sound statistics are added to the
+        # saved data by save
+        minute, second = self.session_time
+        data_dict = {
+            "Trial Num": self.trial_number,
+            "Session Time": {"Minute": minute, "Second": second},
+            "Sound Category": sound_category,
+            "Response": self.trial_response,
+            "Hit": hit,
+            **self.session_stats.row(),
+        }
+        self.session_data.append(data_dict, self.trial_sound, self.response_times)
+        self.journal.write("Trial", Data=data_dict, Sound=self.trial_sound,
+                           **{"Response Times": self.response_times})
+
+    def update_last_trial(self, row):
+        # Set columns of the last trial's row after update_session_data, e.g. from the next trial's prep
+        self.session_data.update_last(row)
+        self.journal.write("Update", Data=row)
+
+    def resume_session(self, records):
+        # Continue a session that crashed from its journal: session data, statistics, pellets and staircase
+        self.session_start_time = datetime.datetime.fromisoformat(records[0]["Session Start"])
+        for name, category in self.tallied_sounds():
+            self.session_stats.sound_id(name, category)
+        staircase = []
+        for record in records[1:]:
+            if record["Type"] == "Trial":
+                data_dict, response_times = record["Data"], np.array(record["Response Times"])
+                self.session_data.append(data_dict, record["Sound"], response_times)
+                self.session_stats.add(record["Sound"]["Name"], data_dict["Sound Category"], data_dict["Hit"])
+                self.rolling_stats.add(data_dict["Sound Category"], data_dict["Hit"],
+                                       response_times[0] if len(response_times) else np.nan)
+                self.trial_number = data_dict["Trial Num"]
+            elif record["Type"] == "Update":
+                self.session_data.update_last(record["Data"])
+            elif record["Type"] == "Pellet":
+                self.num_pellets = record["Pellets"]
+            elif record["Type"] == "Staircase":
+                staircase.append((record["Stim"], record["Response"]))
+        self.session_stats.compute()
+        if staircase:
+            self.resume_staircase(*zip(*staircase))
+        print(f"Resumed session from journal at trial {self.trial_number}")
+
+    def resume_staircase(self, stim, response):
+        # Tasks with a staircase continue it from the journaled stimuli and responses
+        pass
 
     def update_plots(self):
         # Plot trial response
@@ -456,10 +487,10 @@ class GoNoGoTask:
 
         # Find matching % Response bar and update height
         name = self.trial_sound["Name"]
-        self.plots["Response"].percent_bars[name].set_height(self.session_data.tail(1)[f"{name} % Hit"].values[0])
+        self.plots["Response"].percent_bars[name].set_height(self.session_stats.percent_hit[self.session_stats.entry(name)])
 
         # TODO Update percent correct plot
-        self.plots["Response"].percent_bars["% Correct"].set_height(self.session_data.tail(1)["% Correct"].values[0])
+        self.plots["Response"].percent_bars["% Correct"].set_height(self.session_stats.percent_correct)
 
         # Keep response times ylim matched to the trial interval in the case of tasks that dynamically change it
         self.plots["Response"].response_times_plot.set_ylim([0, self.trial_interval])
@@ -482,7 +513,8 @@ class GoNoGoTask:
             "Trial": self.trial_number,
             "Pellet": self.num_pellets,
             "Sound": self.trial_sound["Name"],
-            "Percent": self.session_data.tail(1)["% Correct"].values[0],
+            "Percent": self.session_stats.percent_correct,
+            "Recent": self.rolling_stats.summary(self.rolling_stats.windows[0]),
             "Attempt": "-",
             "Session": "-",
         }
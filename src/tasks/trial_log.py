@@ -0,0 +1,176 @@
+"""Columnar per-trial log of a session, see TrialLog."""
+import numbers
+import numpy as np
+import pandas as pd
+
+
+class TrialLog:
+    """Growable columnar store of per-trial records.
+
+    Each column is a typed NumPy array (bool, int64, float64, or object for strings and anything else) with room for
+    more trials than logged so far. When the room runs out, all arrays double in size, so appending a trial is O(1)
+    amortized, however long the session. Sounds are stored as integer IDs into the stimuli list, and the response times
+    of all trials as one flat array of values plus per-trial offsets into it.
+
+    Columns can appear at any trial. Earlier trials, and later trials that leave a column out, hold a missing value:
+    NaN for numbers, None otherwise. Integer and bool columns that need a missing value become float64 and object.
+
+    Arguments
+    ---------
+        capacity : int
+            number of trials to allocate room for at first
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.n_trials = 0
+        self.columns = {}
+        self.stimuli = []  # sound dicts, indexed by stimulus ID
+        self.stimulus_ids = {}  # sound name -> stimulus ID
+        self.sound_ids = np.empty(capacity, dtype=np.int64)
+        self.response_offsets = np.zeros(capacity + 1, dtype=np.int64)
+        self.response_values = np.empty(4 * capacity, dtype=np.float64)
+
+    def __len__(self):
+        return self.n_trials
+
+    @property
+    def empty(self):
+        return self.n_trials == 0
+
+    def stimulus_id(self, sound):
+        """Integer ID of a sound dict, by name. New sounds are added to stimuli."""
+        name = sound["Name"]
+        if name not in self.stimulus_ids:
+            self.stimulus_ids[name] = len(self.stimuli)
+            self.stimuli.append(sound)
+        return self.stimulus_ids[name]
+
+    def append(self, row, sound, response_times=()):
+        """Log a trial.
+
+        Arguments
+        ---------
+            row : dict
+                column name -> value of this trial
+
+            sound : dict
+                sound played on this trial, with at least a "Name"
+
+            response_times : 1D array
+                response times of this trial
+        """
+        if self.n_trials == self.capacity:
+            self._grow(2 * self.capacity)
+        trial = self.n_trials
+        self.sound_ids[trial] = self.stimulus_id(sound)
+
+        start = self.response_offsets[trial]
+        stop = start + len(response_times)
+        if stop > len(self.response_values):
+            self.response_values = self._resized(self.response_values, max(2 * len(self.response_values), stop))
+        self.response_values[start:stop] = response_times
+        self.response_offsets[trial + 1] = stop
+
+        self.n_trials += 1
+        for name, column in self.columns.items():
+            if name not in row:
+                self._set(name, trial, None)
+        for name, value in row.items():
+            self._set(name, trial, value)
+
+    def update_last(self, row):
+        """Set columns of the last logged trial."""
+        for name, value in row.items():
+            self._set(name, self.n_trials - 1, value)
+
+    def last(self, name):
+        """Value of a column at the last logged trial."""
+        return self.columns[name][self.n_trials - 1]
+
+    def last_row(self):
+        """All columns of the last logged trial, as a dict."""
+        return {name: column[self.n_trials - 1] for name, column in self.columns.items()}
+
+    def column(self, name):
+        """View of a column over the logged trials."""
+        return self.columns[name][:self.n_trials]
+
+    def sounds(self):
+        """Stimulus ID of each logged trial."""
+        return self.sound_ids[:self.n_trials]
+
+    def response_times(self, trial):
+        """View of the response times of a trial."""
+        return self.response_values[self.response_offsets[trial]:self.response_offsets[trial + 1]]
+
+    def to_frame(self, response_times=False):
+        """DataFrame of the logged trials, sharing memory with the numeric columns.
+
+        The sound of each trial is given by name, as a categorical "Sound" column. With response_times, a "Response
+        Times" column holds a view of each trial's response times.
+        """
+        data = {name: column[:self.n_trials] for name, column in self.columns.items()}
+        data["Sound"] = pd.Categorical.from_codes(self.sounds(), [sound["Name"] for sound in self.stimuli])
+        if response_times:
+            data["Response Times"] = np.split(self.response_values[:self.response_offsets[self.n_trials]],
+                                              self.response_offsets[1:self.n_trials])
+        return pd.DataFrame(data, copy=False)
+
+    def _set(self, name, trial, value):
+        if name not in self.columns:
+            self.columns[name] = np.empty(self.capacity, dtype=self._dtype(value))
+            self._fill_missing(name, 0, trial)
+        column = self.columns[name]
+        if value is None or (isinstance(value, float) and np.isnan(value) and column.dtype != np.float64):
+            self._fill_missing(name, trial, trial + 1)
+            return
+        if not self._fits(column.dtype, value):
+            self.columns[name] = column = self._cast(column, np.float64 if column.dtype.kind in "iu" and
+                                                     isinstance(value, numbers.Real) else object)
+        column[trial] = value
+
+    def _fill_missing(self, name, start, stop):
+        column = self.columns[name]
+        if start == stop:
+            return
+        if column.dtype.kind in "biu":
+            self.columns[name] = column = self._cast(column, np.float64 if column.dtype.kind in "iu" else object)
+        column[start:stop] = np.nan if column.dtype == np.float64 else None
+
+    @staticmethod
+    def _dtype(value):
+        if isinstance(value, (bool, np.bool_)):
+            return np.bool_
+        if isinstance(value, numbers.Integral):
+            return np.int64
+        if isinstance(value, numbers.Real):
+            return np.float64
+        return object
+
+    @staticmethod
+    def _fits(dtype, value):
+        if dtype == object:
+            return True
+        if dtype == np.bool_:
+            return isinstance(value, (bool, np.bool_))
+        if dtype == np.int64:
+            return isinstance(value, numbers.Integral) and not isinstance(value, (bool, np.bool_))
+        return isinstance(value, numbers.Real)
+
+    @staticmethod
+    def _cast(column, dtype):
+        return column.astype(dtype)
+
+    @staticmethod
+    def _resized(array, size):
+        resized = np.empty(size, dtype=array.dtype)
+        resized[:len(array)] = array
+        return resized
+
+    def _grow(self, capacity):
+        for name, column in self.columns.items():
+            self.columns[name] = self._resized(column, capacity)
+        self.sound_ids = self._resized(self.sound_ids, capacity)
+        self.response_offsets = self._resized(self.response_offsets, capacity + 1)
+        self.capacity = capacity
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The tasks package lives in src, as run by run_client.py
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
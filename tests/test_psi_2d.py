@@ -0,0 +1,94 @@
+import numpy as np
+from scipy.special import entr
+from tasks import PsiMarginal
+
+
+def small_grid():
+    freqs = np.array([2000, 2245, 2520, 2828, 3175])
+    ints = np.arange(0, 61, 15)
+    return {
+        "freqRange": freqs,
+        "intRange": ints,
+        "thresholdFreq": (freqs[1:] + freqs[:-1]) / 2,
+        "slopeFreq": np.linspace(50, 800, 3),
+        "thresholdInt": (ints[1:] + ints[:-1]) / 2,
+        "slopeInt": np.linspace(2, 20, 3),
+        "guessRate": np.linspace(0.05, 0.3, 3),
+        "lapseRate": np.linspace(0, 0.2, 3),
+        "nTrials": 40,
+    }
+
+
+def brute_force_likelihood(grid):
+    """p(go) over (alphaF, sigmaF, alphaI, sigmaI, guess, lapse, frequency, intensity), straight from Likelihood2D's
+    definition."""
+    axes = [grid[name] for name in ("thresholdFreq", "slopeFreq", "thresholdInt", "slopeInt", "guessRate",
+                                    "lapseRate", "freqRange", "intRange")]
+    alpha_f, sigma_f, alpha_i, sigma_i, guess, lapse, freq, intensity = np.meshgrid(*axes, indexing="ij")
+    detected = PsiMarginal.pfCore(alpha_i, sigma_i, intensity)
+    not_discriminated = 1 - PsiMarginal.pfCore(alpha_f, sigma_f, freq)
+    likelihood = guess + (1 - guess - lapse) * not_discriminated * detected
+    return likelihood.reshape(likelihood.shape[:6] + (-1,))
+
+
+def brute_force_expected_entropy(pdf, likelihood):
+    entropies = []
+    for stim in range(likelihood.shape[-1]):
+        expected = 0
+        for joint in (pdf * likelihood[..., stim], pdf * (1 - likelihood[..., stim])):
+            p = joint.sum()
+            posterior = np.sum(joint / p, axis=(4, 5))  # entropy over the parameters of interest
+            expected += p * entr(posterior).sum()
+        entropies.append(expected)
+    return np.array(entropies)
+
+
+def run(psi, likelihood, n_trials, seed=0):
+    """Run psi on simulated go/no go responses, and keep a brute-force posterior next to it."""
+    rng = np.random.default_rng(seed)
+    pdf = np.copy(psi.prior)
+    for _ in range(n_trials):
+        stim = psi.minEntropyInd
+        response = int(rng.random() < 0.6)
+        psi.addData(response)
+        pdf = pdf * (likelihood[..., stim] if response else 1 - likelihood[..., stim])
+        pdf /= pdf.sum()
+    return pdf
+
+
+def test_matches_brute_force_posterior_and_search():
+    grid = small_grid()
+    likelihood = brute_force_likelihood(grid)
+    psi = PsiMarginal.Psi2D(**grid, thread=False, nWorkers=2, chunkSize=3)
+    np.testing.assert_allclose(psi.expectEntropy, brute_force_expected_entropy(psi.pdf, likelihood), rtol=1e-9)
+    pdf = run(psi, likelihood, 12)
+    np.testing.assert_allclose(psi.pdf, pdf, rtol=1e-9, atol=1e-15)
+    expected = brute_force_expected_entropy(pdf, likelihood)
+    np.testing.assert_allclose(psi.expectEntropy, expected, rtol=1e-9)
+    assert psi.minEntropyInd == np.argmin(expected)
+    psi.close()
+
+
+def test_other_responses_leave_posterior_unchanged():
+    psi = PsiMarginal.Psi2D(**small_grid(), thread=False)
+    pdf = np.copy(psi.pdf)
+    psi.addData(2)
+    np.testing.assert_array_equal(psi.pdf, pdf)
+    assert psi.response == [2]
+    psi.close()
+
+
+def test_save_load_round_trip(tmp_path):
+    grid = small_grid()
+    prior = np.random.default_rng(1).random(PsiMarginal.Psi2D(**grid, thread=False).prior.shape)
+    psi = PsiMarginal.Psi2D(**{**grid, "nTrials": 33}, thread=False, prior=prior)
+    run(psi, brute_force_likelihood(grid), 5)
+    psi.save(tmp_path / "session.npz")
+    loaded = PsiMarginal.Psi2D.load(tmp_path / "session.npz", thread=False)
+    assert loaded.nTrials == 33
+    np.testing.assert_allclose(loaded.prior, psi.prior)
+    np.testing.assert_allclose(loaded.pdf, psi.pdf)
+    assert loaded.stim == psi.stim and loaded.response == psi.response
+    assert loaded.xCurrent == psi.xCurrent and loaded.iTrial == psi.iTrial
+    psi.close()
+    loaded.close()
@@ -0,0 +1,23 @@
+import numpy as np
+from tasks import PsiMarginal, psi_analysis
+from test_psi_marginal import small_grid, run, saved
+
+
+def test_replay_of_warm_started_session_gives_saved_posterior(tmp_path):
+    earlier = run(PsiMarginal.Psi(**small_grid(), thread=False), 30, seed=1)
+    prior = PsiMarginal.Psi.loadPrior(saved(earlier), 0.5, **small_grid())
+    earlier.close()
+    psi = run(PsiMarginal.Psi(**small_grid(), thread=False, prior=prior), 25, seed=2)
+    file = tmp_path / "R1_2026-01-02_Session-1.npz"
+    psi.save(file)
+
+    loaded = PsiMarginal.Psi.load(file, thread=False)
+    np.testing.assert_allclose(loaded.prior, psi.prior)
+    np.testing.assert_allclose(loaded.replay(psi.stim, psi.response), psi.pdf, rtol=1e-6, atol=1e-12)
+
+    rows = psi_analysis.reconstruct_group([file])
+    expected = psi_analysis.summarize(psi, psi.pdf)
+    for name, value in expected.items():
+        np.testing.assert_allclose(rows[-1][name], value, rtol=1e-6)
+    psi.close()
+    loaded.close()
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from tasks import PsiMarginal, psi_grids
+from test_psi_marginal import small_grid, run
+
+
+def test_task_grid_is_the_same_every_load(monkeypatch):
+    monkeypatch.setitem(psi_grids.PSI_GRID_FACTORS, "ATAT_Psi_Detection", 0.5)
+    grid, calibration = psi_grids.task_grid("ATAT_Psi_Detection")
+    again, _ = psi_grids.task_grid("ATAT_Psi_Detection")
+    assert calibration["factor"] == 0.5
+    assert len(grid["slope"]) == 10
+    for name in ("threshold", "slope", "guessRate", "lapseRate"):
+        np.testing.assert_array_equal(grid[name], again[name])
+
+
+def test_warm_start_warns_when_falling_back(tmp_path):
+    psi = run(PsiMarginal.Psi(**small_grid(), thread=False), 10)
+    psi.save(tmp_path / "R1_2026-01-01_Session-1.npz")
+    psi.close()
+    assert psi_grids.warm_start_prior("R1", small_grid(), data_path=tmp_path) is not None
+    changed = {**small_grid(), "slope": np.linspace(1, 10, 7)}
+    with pytest.warns(UserWarning, match="current grids"):
+        assert psi_grids.warm_start_prior("R1", changed, data_path=tmp_path) is None
+    with pytest.warns(UserWarning, match="No Psi sessions"):
+        assert psi_grids.warm_start_prior("R2", small_grid(), data_path=tmp_path) is None
+
+
+def test_warm_start_skips_unreadable_sessions(tmp_path):
+    psi = run(PsiMarginal.Psi(**small_grid(), thread=False), 10)
+    psi.save(tmp_path / "R1_2026-01-01_Session-1.npz")
+    psi.close()
+    truncated = (tmp_path / "R1_2026-01-01_Session-1.npz").read_bytes()[:200]
+    (tmp_path / "R1_2026-01-02_Session-1.npz").write_bytes(truncated)
+    with pytest.warns(UserWarning, match="unreadable"):
+        prior = psi_grids.warm_start_prior("R1", small_grid(), data_path=tmp_path)
+    np.testing.assert_allclose(prior, psi.pdf ** 0.5 / np.sum(psi.pdf ** 0.5))
@@ -0,0 +1,122 @@
+import gc
+import io
+import time
+import numpy as np
+from tasks import PsiMarginal
+
+
+def small_grid():
+    return {
+        "stimRange": np.arange(0, 40, 2.0),
+        "threshold": np.linspace(5, 35, 16),
+        "slope": np.linspace(1, 10, 6),
+        "guessRate": np.linspace(0, 0.2, 3),
+        "lapseRate": np.linspace(0, 0.1, 3),
+        "Pfunction": "cGauss",
+        "nTrials": 80,
+    }
+
+
+def run(psi, n_trials, seed=0, threshold=20, slope=4):
+    rng = np.random.default_rng(seed)
+    for _ in range(n_trials):
+        p = 0.05 + 0.9 * PsiMarginal.pfCore(threshold, slope, psi.xCurrent)
+        psi.addData(int(rng.random() < p))
+    return psi
+
+
+def saved(psi):
+    file = io.BytesIO()
+    psi.save(file)
+    file.seek(0)
+    return file
+
+
+def test_save_load_keeps_settings():
+    options = {"stopThresholdSD": 2.5, "stopSlopeSD": 3.0, "stopInfoGain": 0.01, "stopMinTrials": 7,
+               "narrowStim": 0.98, "narrowMargin": 3, "coarseStep": 3, "coarseTop": 1, "pruneTolerance": 1e-4}
+    psi = run(PsiMarginal.Psi(**small_grid(), thread=False, **options), 10)
+    loaded = PsiMarginal.Psi.load(saved(psi), thread=False)
+    for name, value in options.items():
+        assert getattr(loaded, name) == value, name
+    assert loaded.xCurrent == psi.xCurrent
+    np.testing.assert_allclose(loaded.pdf, psi.pdf)
+    psi.close()
+    loaded.close()
+
+
+def test_dropped_psi_releases_tables():
+    psi = PsiMarginal.Psi(**small_grid())
+    psi.nextStim.result()
+    worker, tableCache, key = psi.worker, psi.tableCache, psi.cacheKey
+    refs = tableCache.refs[key]
+    del psi
+    gc.collect()
+    assert tableCache.refs.get(key, 0) == refs - 1
+    assert worker._shutdown
+
+
+def test_batch_key_separates_search_settings():
+    keys = {PsiMarginal.Psi(**small_grid(), thread=False, **options).batchKey
+            for options in ({}, {"pruneTolerance": 1e-4}, {"narrowStim": 0.99}, {"narrowStim": 0.99, "narrowMargin": 3},
+                            {"coarseStep": 3}, {"coarseStep": 3, "coarseTop": 1})}
+    assert len(keys) == 6
+
+
+def test_batches_leave_workspace_size_unchanged():
+    psi = PsiMarginal.Psi(**small_grid(), thread=False)
+    buffers = psi.workspaces.get()
+    sizes = [buffer.size for buffer in buffers]
+    psi.workspaces.put(buffers)
+    psi.expectedEntropy(np.stack([psi.pdf] * 4))
+    assert [buffer.size for buffer in psi.workspaces.get()] == sizes
+
+
+def test_select_stims_follows_search_settings():
+    for options in ({}, {"narrowStim": 0.95, "narrowMargin": 1}, {"coarseStep": 3, "coarseTop": 1}):
+        psi = run(PsiMarginal.Psi(**small_grid(), thread=False, **options), 15)
+        assert psi.selectStims(np.stack([psi.pdf, psi.prior])).tolist() == \
+            [psi.minEntropyInd, PsiMarginal.Psi(**small_grid(), thread=False, **options).minEntropyInd]
+        psi.close()
+
+
+def test_save_to_path_replaces_file_whole(tmp_path):
+    psi = run(PsiMarginal.Psi(**small_grid(), thread=False), 5)
+    psi.save(tmp_path / "session.npz")
+    psi.save(tmp_path / "named")
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["named.npz", "session.npz"]
+    np.testing.assert_allclose(PsiMarginal.Psi.load(tmp_path / "session.npz", thread=False).pdf, psi.pdf)
+    psi.close()
+
+
+def test_engine_keeps_batched_requests_to_their_own_intensities():
+    psi = PsiMarginal.Psi(**small_grid(), thread=False)
+    engine = PsiMarginal.PsiEngine()
+    engine.worker.submit(time.sleep, 0.2)  # queue both requests behind this, so they are evaluated in one pass
+    narrow = engine.submit(psi, [psi.pdf], np.array([0, 1, 2]))
+    full = engine.submit(psi, [psi.pdf])
+    expectEntropy = narrow.result()[0]["expectEntropy"]
+    assert np.argmin(expectEntropy) in (0, 1, 2)
+    assert np.all(np.isinf(expectEntropy[3:]))
+    np.testing.assert_array_equal(full.result()[0]["expectEntropy"], psi.expectEntropy)
+    psi.close()
+
+
+def test_select_stims_of_a_batch_matches_each_pdf_alone():
+    pdfs = np.stack([run(PsiMarginal.Psi(**small_grid(), thread=False), n_trials, seed=n_trials).pdf
+                     for n_trials in (0, 5, 20, 40)])
+    for options in ({}, {"narrowStim": 0.9, "narrowMargin": 1}, {"narrowStim": 0.95, "coarseStep": 2, "coarseTop": 2}):
+        psi = PsiMarginal.Psi(**small_grid(), thread=False, **options)
+        assert psi.selectStims(pdfs).tolist() == [psi.selectStims(pdf[np.newaxis])[0] for pdf in pdfs]
+        psi.close()
+
+
+def test_resume_rebuilds_posterior_without_replay_table():
+    psi = run(PsiMarginal.Psi(**small_grid(), thread=False), 20)
+    resumed = PsiMarginal.Psi(**small_grid(), thread=False)
+    resumed.resume(psi.stim, psi.response)
+    np.testing.assert_allclose(resumed.pdf, psi.pdf)
+    assert resumed.xCurrent == psi.xCurrent
+    assert resumed.logLikelihood is None
+    psi.close()
+    resumed.close()
@@ -0,0 +1,11 @@
+from tasks import psi_simulation
+from test_psi_marginal import small_grid
+
+
+def test_coarse_search_matches_exhaustive_search():
+    # The coarse-to-fine search may pick a neighbouring intensity on flat stretches of the expected entropy, but
+    # never one that is noticeably worse
+    result = psi_simulation.compare_coarse_search(small_grid(), (20, 4, 0.05, 0.05), coarse_step=3, coarse_top=2,
+                                                  n_trials=30, n_runs=2, seed=0)
+    assert result["agreement"] >= 0.9
+    assert result["max_excess_entropy"] <= 0.01  # nats
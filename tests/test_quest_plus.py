@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from scipy.special import entr
+from tasks import PsiMarginal
+
+GRID = {
+    "intensityVals": np.arange(1.0, 31.0, 1.5),
+    "thresholdVals": np.linspace(4, 26, 12),
+    "slopeVals": np.array([1.5, 2.5, 3.5, 5.0]),
+    "lowerAsymptoteVals": np.linspace(0, 0.4, 3),
+    "lapseRateVals": np.linspace(0, 0.1, 3),
+}
+
+
+class ReferenceQuestPlus:
+    """QUEST+ as in Watson (2017): a posterior over all (threshold, slope, guess, lapse), and each stimulus chosen to
+    minimize the expected entropy of that posterior. Weibull p = guess + (1 - guess - lapse) * F, with
+    F = 1 - exp(-(x / threshold) ** slope)."""
+
+    def __init__(self, grid):
+        threshold, slope, guess, lapse, x = np.meshgrid(
+            grid["thresholdVals"], grid["slopeVals"], grid["lowerAsymptoteVals"], grid["lapseRateVals"],
+            grid["intensityVals"], indexing="ij")
+        self.intensities = grid["intensityVals"]
+        self.likelihood = guess + (1 - guess - lapse) * (1 - np.exp(-(x / threshold) ** slope))
+        self.posterior = np.full(self.likelihood.shape[:-1], 1 / np.prod(self.likelihood.shape[:-1]))
+
+    def expected_entropy(self):
+        entropies = np.zeros(len(self.intensities))
+        for likelihood in (self.likelihood, 1 - self.likelihood):
+            joint = self.posterior[..., np.newaxis] * likelihood
+            p_response = joint.sum(axis=(0, 1, 2, 3))
+            entropies += p_response * entr(joint / p_response).sum(axis=(0, 1, 2, 3))
+        return entropies
+
+    def next(self):
+        return self.intensities[np.argmin(self.expected_entropy())]
+
+    def add_response(self, intensity, success):
+        likelihood = self.likelihood[..., np.flatnonzero(self.intensities == intensity)[0]]
+        self.posterior = self.posterior * (likelihood if success else 1 - likelihood)
+        self.posterior /= self.posterior.sum()
+
+
+def test_matches_reference_quest_plus():
+    quest = PsiMarginal.QuestPlus(nTrials=20, responseVals=["Yes", "No"], thread=False, **GRID)
+    reference = ReferenceQuestPlus(GRID)
+    rng = np.random.default_rng(3)
+    for _ in range(20):
+        intensity = quest.next()
+        assert intensity == reference.next()
+        np.testing.assert_allclose(quest.psi.expectEntropy, reference.expected_entropy(), rtol=1e-9)
+        success = rng.random() < 0.05 + 0.9 * (1 - np.exp(-(intensity / 15) ** 3))
+        quest.addResponse("Yes" if success else "No")
+        reference.add_response(intensity, success)
+        np.testing.assert_allclose(quest.psi.pdf, reference.posterior, rtol=1e-9, atol=1e-300)
+    with pytest.raises(StopIteration):
+        quest.next()
+    estimate = quest.paramEstimate
+    np.testing.assert_allclose(estimate["threshold"],
+                               reference.posterior.sum(axis=(1, 2, 3)) @ GRID["thresholdVals"], rtol=1e-9)
+    quest.close()
+
+
+def test_rejects_unknown_responses():
+    quest = PsiMarginal.QuestPlus(nTrials=5, thread=False, **GRID)
+    with pytest.raises(ValueError):
+        quest.addResponse("Maybe")
+    quest.close()
@@ -0,0 +1,59 @@
+import datetime
+import numpy as np
+from tasks import session_journal
+from tasks.session_journal import SessionJournal
+
+START = datetime.datetime(2026, 10, 17, 9, 30)
+
+
+def write_session(path, n_trials=3):
+    journal = SessionJournal(path)
+    journal.start("R1", "ATAT_Psi_Detection", START)
+    for trial in range(n_trials):
+        journal.write("Trial", Data={"Trial": np.int64(trial), "Hit": np.float64(0.5)}, Sound={"Name": "Silence"},
+                      **{"Response Times": np.arange(trial, dtype=float)})
+    return journal
+
+
+def test_finished_session_is_not_resumable(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_session(path).end()
+    records = session_journal.read(path)
+    assert [record["Type"] for record in records] == ["Start", "Trial", "Trial", "Trial", "End"]
+    assert records[2]["Data"] == {"Trial": 1, "Hit": 0.5}
+    assert session_journal.finished(records)
+    assert not session_journal.resumable(records, "R1", "ATAT_Psi_Detection", today=START.date())
+
+
+def test_resume_after_crash_mid_line(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_session(path).close()
+    path.write_bytes(path.read_bytes()[:-10])  # the crash cut the last trial short
+    records = session_journal.read(path)
+    assert [record["Type"] for record in records] == ["Start", "Trial", "Trial"]
+    assert not session_journal.finished(records)
+    assert session_journal.resumable(records, "R1", "ATAT_Psi_Detection", today=START.date())
+    assert not session_journal.resumable(records, "R2", "ATAT_Psi_Detection", today=START.date())
+    assert not session_journal.resumable(records, "R1", "ATAT_Psi_Detection", today=START.date() +
+                                         datetime.timedelta(days=1))
+
+    journal = SessionJournal(path)
+    journal.resume()
+    journal.write("Pellet", Pellets=4)
+    journal.end()
+    records = session_journal.read(path)
+    assert [record["Type"] for record in records] == ["Start", "Trial", "Trial", "Pellet", "End"]
+    assert path.read_bytes().count(b"\n") == len(records)
+
+
+def test_start_moves_unfinished_journal_aside(tmp_path):
+    path = tmp_path / "journal.jsonl"
+    write_session(path).close()
+    write_session(path, n_trials=1).end()
+    assert len(session_journal.read(path)) == 3
+    aside = tmp_path / "journal_2026-10-17T09-30-00.jsonl"
+    assert len(session_journal.read(aside)) == 4
+
+
+def test_missing_journal_reads_empty(tmp_path):
+    assert session_journal.read(tmp_path / "journal.jsonl") == []
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+from tasks.session_stats import SessionStats, RollingStats
+
+# (sound, category, hit)
+TRIALS = [("2000 Hz", "CS+", 1), ("2000 Hz", "CS+", 1), ("2000 Hz", "CS+", 0), ("2000 Hz", "CS+", 1),
+          ("4000 Hz", "CS-", 1), ("4000 Hz", "CS-", 0), ("4000 Hz", "CS-", 0), ("Silence", "Silence", 0),
+          ("3000 Hz", "CS-", 1), ("Silence", "Silence", 1)]
+
+
+def session(trials=TRIALS):
+    stats = SessionStats(capacity=1)  # grows while adding the sounds
+    for trial in trials:
+        stats.add(*trial)
+    stats.compute()
+    return stats
+
+
+def test_session_tallies_and_signal_detection():
+    stats = session()
+    row = stats.row()
+    assert (row["CS+ Hits"], row["CS+ Trials"], row["CS- Hits"], row["CS- Trials"]) == (3, 4, 2, 4)
+    assert row["CS+ % Hit"] == 75 and row["CS- % Hit"] == 50
+    assert row["% Correct"] == (75 + 50) / 2
+    np.testing.assert_allclose(row["CS- d'"], 0.6744897501960817)  # z(0.75) - z(0.5)
+    entry = stats.entry("4000 Hz")
+    np.testing.assert_allclose(stats.percent_hit[entry], 100 / 3)
+    assert np.isnan(stats.d_prime[stats.entry("2000 Hz")])
+
+
+def test_hit_rates_of_0_and_1_stay_finite():
+    stats = session([("2000 Hz", "CS+", 1), ("2000 Hz", "CS+", 1), ("4000 Hz", "CS-", 0), ("4000 Hz", "CS-", 0)])
+    assert np.isfinite(stats.d_prime[stats.entry("4000 Hz")])
+
+
+def test_history_matches_adding_trial_by_trial():
+    stats = session()
+    sounds = pd.Categorical([sound for sound, _, _ in TRIALS])
+    history = stats.history(sounds, [hit for _, _, hit in TRIALS])
+    for trial in range(1, len(TRIALS) + 1):
+        partial = session(TRIALS[:trial])
+        for name in ("2000 Hz", "4000 Hz", "3000 Hz"):
+            entry = partial.entry(name) if name in partial.ids else None
+            assert history[f"{name} Trials"][trial - 1] == (partial.trials[entry] if entry else 0)
+            assert history[f"{name} Hits"][trial - 1] == (partial.hits[entry] if entry else 0)
+
+
+def test_rolling_windows_drop_old_trials():
+    rolling = RollingStats(windows=(3, 5))
+    for _, category, hit in TRIALS:
+        rolling.add(category, hit, response_time=100.0 if hit else np.nan)
+    summary = rolling.summary(3)  # Silence miss, CS- hit, Silence hit
+    assert summary["Trials"] == 3
+    assert summary["CS- Trials"] == 1 and summary["Silence Trials"] == 2
+    assert rolling.summary(5)["CS+ Trials"] == 0
+    assert np.isnan(summary["CS+ % Hit"])
+    assert summary["Silence RT 50%"] == 100.0
+
+
+def test_rolling_and_session_percent_correct_agree():
+    for trials in (TRIALS, [trial for trial in TRIALS if trial[1] != "CS-"], TRIALS[:4]):
+        rolling = RollingStats(windows=(len(TRIALS),))
+        for _, category, hit in trials:
+            rolling.add(category, hit)
+        stats = session(trials)
+        np.testing.assert_equal(rolling.percent_correct(len(TRIALS)), stats.percent_correct)
+
+
+def test_session_without_cs_minus_trials_scores_silence():
+    stats = SessionStats()
+    stats.sound_id("4000 Hz", "CS-")  # tallied but never played
+    for trial in [("2000 Hz", "CS+", 1), ("Silence", "Silence", 1)]:
+        stats.add(*trial)
+    stats.compute()
+    assert stats.percent_correct == (100 + 0) / 2
@@ -0,0 +1,61 @@
+import numpy as np
+from tasks.trial_log import TrialLog
+
+TONE = {"Name": "2000 Hz", "Freq": 2000}
+SILENCE = {"Name": "Silence"}
+
+
+def test_append_grows_and_keeps_column_types():
+    log = TrialLog(capacity=2)
+    for trial in range(5):
+        log.append({"Trial": trial, "Hit": trial % 2 == 0, "Response": "Hit"}, TONE)
+    assert len(log) == 5 and log.capacity == 8
+    assert log.column("Trial").dtype == np.int64 and log.column("Trial").tolist() == [0, 1, 2, 3, 4]
+    assert log.column("Hit").dtype == np.bool_
+    assert log.last("Response") == "Hit"
+
+
+def test_missing_values_widen_columns():
+    log = TrialLog()
+    log.append({"Trial": 1}, TONE)
+    log.append({"Trial": 2, "Late": 3}, TONE)
+    log.append({}, TONE)
+    assert log.column("Late").dtype == np.float64
+    np.testing.assert_array_equal(log.column("Late"), [np.nan, 3, np.nan])
+    np.testing.assert_array_equal(log.column("Trial"), [1, 2, np.nan])
+    log.update_last({"Trial": 3})
+    assert log.last("Trial") == 3 and np.isnan(log.last_row()["Late"])
+
+
+def test_sounds_are_mapped_to_integer_ids_by_name():
+    log = TrialLog()
+    for sound in (TONE, SILENCE, dict(TONE), SILENCE):
+        log.append({}, sound)
+    assert log.sounds().tolist() == [0, 1, 0, 1]
+    assert log.stimuli == [TONE, SILENCE]
+    assert log.stimulus_id({"Name": "4000 Hz"}) == 2
+
+
+def test_ragged_response_times():
+    log = TrialLog(capacity=1)
+    times = [np.arange(3.0), np.array([]), np.arange(20.0), np.array([7.5])]
+    for response_times in times:
+        log.append({}, TONE, response_times)
+    for trial, response_times in enumerate(times):
+        np.testing.assert_array_equal(log.response_times(trial), response_times)
+    assert log.response_offsets[:5].tolist() == [0, 3, 3, 23, 24]
+
+
+def test_to_frame_round_trip_shares_numeric_columns():
+    log = TrialLog()
+    times = [np.array([0.2, 0.4]), np.array([])]
+    log.append({"Trial": 1, "Time": 0.5, "Response": "Hit"}, TONE, times[0])
+    log.append({"Trial": 2, "Time": 1.5, "Response": "Miss"}, SILENCE, times[1])
+    frame = log.to_frame(response_times=True)
+    assert frame["Trial"].tolist() == [1, 2]
+    assert frame["Response"].tolist() == ["Hit", "Miss"]
+    assert frame["Sound"].tolist() == ["2000 Hz", "Silence"]
+    for expected, actual in zip(times, frame["Response Times"]):
+        np.testing.assert_array_equal(actual, expected)
+    assert np.shares_memory(frame["Time"].to_numpy(), log.columns["Time"])
+    assert np.shares_memory(frame["Trial"].to_numpy(), log.columns["Trial"])